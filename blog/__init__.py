@@ -3,9 +3,29 @@ import os
 from flask import Flask
 
 app = Flask(__name__)
-config_path = os.environ.get("CONFIG_PATH", "blog.config.DevelopmentConfig")
-app.config.from_object(config_path)
+
+def create_app(config=None):
+	""" Configure the app from a config class or its import path
+	
+	Defaults to the class named by $CONFIG_PATH. Nothing here touches the
+	database: the engine is created on first use, and the schema is left to
+	migrations. There is one app per process, so calling this again
+	reconfigures it.
+	"""
+	if config is None:
+		config = os.environ.get("CONFIG_PATH", "blog.config.DevelopmentConfig")
+	app.config.from_object(config)
+	for module in (database, filters, login, counters, pagecache, instrumentation,
+			assets):
+		module.init_app(app)
+	return app
 
 from . import views
+from . import export
 from . import filters
 from . import login
+from . import instrumentation
+from . import assets, compression
+from . import database, counters, pagecache
+
+create_app()
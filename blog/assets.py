@@ -0,0 +1,241 @@
+""" Self-hosted static assets with content-hashed names
+
+`manage.py assets` downloads the third party CSS and JavaScript into
+static/vendor, checking each file against the SHA-384 digest recorded for it
+below, joins them with our own into bundles, and writes every
+static file to static/dist under a name containing a hash of its content,
+with gzip (and, if the brotli module is installed, brotli) copies beside
+it. dist/manifest.json maps each original name to its hashed one, and
+url_for("static") uses it, so a file's URL changes whenever it does and
+browsers can cache it for good.
+
+Commit static/vendor once its digests are recorded. Without a build, as in
+development, pages load Bootstrap and jQuery from their CDNs instead.
+"""
+import os
+import re
+import gzip
+import json
+import base64
+import hashlib
+import mimetypes
+import posixpath
+import urllib.request
+
+from flask import request, send_from_directory, safe_join
+
+from . import app
+
+try:
+	import brotli
+except ImportError:
+	brotli = None
+
+# Where the vendored files come from; base.html falls back to the same URLs
+VENDOR = {
+	"vendor/bootstrap.min.css": "https://netdna.bootstrapcdn.com/bootstrap/3.1.1/css/bootstrap.min.css",
+	"vendor/bootstrap.min.js": "https://netdna.bootstrapcdn.com/bootstrap/3.1.1/js/bootstrap.min.js",
+	"vendor/jquery.min.js": "https://code.jquery.com/jquery-2.1.1.min.js",
+}
+
+# The vendored files' SHA-384 digests, in Subresource Integrity form. A file
+# without one, or that doesn't match it, stops the build. After changing a
+# URL above, check the new file and record it from `manage.py assets --pin`.
+VENDOR_SHA384 = {}
+
+# Each page loads one stylesheet and one script
+BUNDLES = {
+	"site.css": ["vendor/bootstrap.min.css", "css/main.css"],
+	"site.js": ["vendor/jquery.min.js", "vendor/bootstrap.min.js"],
+}
+
+DIST = "dist"
+MANIFEST = "manifest.json"
+COMPRESSIBLE = {".css", ".js", ".svg", ".html", ".txt", ".json", ".xml", ".map"}
+# Hashed files never change, so they may be cached for a year
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+manifest = {}
+
+def init_app(app):
+	global manifest
+	manifest = load_manifest(app.static_folder)
+
+def load_manifest(static):
+	try:
+		with open(os.path.join(static, DIST, MANIFEST)) as f:
+			return json.load(f)
+	except FileNotFoundError:
+		return {}
+
+@app.url_defaults
+def hashed_static(endpoint, values):
+	""" Point url_for("static") at the hashed copy of a file, once built """
+	if endpoint == "static":
+		hashed = manifest.get(values.get("filename"))
+		if hashed is not None:
+			values["filename"] = hashed
+
+@app.template_global()
+def asset_built(name):
+	return name in manifest
+
+@app.route("/static/dist/<path:filename>")
+def hashed_asset(filename):
+	""" Serve a hashed file, compressed ahead of time if the client can take it """
+	directory = os.path.join(app.static_folder, DIST)
+	path = safe_join(directory, filename)
+	mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+	encoding = None
+	for candidate, suffix in [("br", ".br"), ("gzip", ".gz")]:
+		if request.accept_encodings[candidate] and os.path.isfile(path + suffix):
+			encoding = candidate
+			filename += suffix
+			break
+	response = send_from_directory(directory, filename, mimetype=mimetype)
+	if encoding is not None:
+		response.headers["Content-Encoding"] = encoding
+	response.vary.add("Accept-Encoding")
+	response.headers["Cache-Control"] = IMMUTABLE
+	return response
+
+def vendor_digest(data):
+	return "sha384-" + base64.b64encode(hashlib.sha384(data).digest()).decode("ascii")
+
+def verify(name, data):
+	""" Raise ValueError unless a vendored file is the one that was pinned """
+	expected = VENDOR_SHA384.get(name)
+	if expected is None:
+		raise ValueError("No SHA-384 recorded for {}; check it and pin it with "
+				"manage.py assets --pin".format(name))
+	if vendor_digest(data) != expected:
+		raise ValueError("{} doesn't match its recorded SHA-384".format(name))
+
+def fetch_vendor(static, refresh=False, check=True):
+	""" Download the third party files that are missing, or all of them
+	
+	Each is checked before it is written, unless `check` is false, as when
+	pinning new versions.
+	"""
+	fetched = 0
+	for name, url in sorted(VENDOR.items()):
+		path = os.path.join(static, name)
+		if os.path.exists(path) and not refresh:
+			continue
+		with urllib.request.urlopen(url, timeout=30) as source:
+			data = source.read()
+		if check:
+			verify(name, data)
+		write(path, data)
+		fetched += 1
+	return fetched
+
+def check_vendor(static):
+	""" Verify every vendored file, raising ValueError if any is missing or changed """
+	for name in sorted(VENDOR):
+		try:
+			with open(os.path.join(static, name), "rb") as f:
+				data = f.read()
+		except FileNotFoundError:
+			raise ValueError("{} is missing; run manage.py assets without "
+					"--offline".format(name))
+		verify(name, data)
+
+def vendor_digests(static):
+	""" The digest of each vendored file present, to record in VENDOR_SHA384 """
+	digests = {}
+	for name in sorted(VENDOR):
+		path = os.path.join(static, name)
+		if os.path.exists(path):
+			with open(path, "rb") as f:
+				digests[name] = vendor_digest(f.read())
+	return digests
+
+def write(path, data):
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	with open(path + ".tmp", "wb") as f:
+		f.write(data)
+	os.replace(path + ".tmp", path)
+
+def hashed_name(name, data):
+	root, ext = posixpath.splitext(name)
+	return "{}/{}.{}{}".format(DIST, root, hashlib.sha1(data).hexdigest()[:12], ext)
+
+def rewrite_urls(css, name, hashed):
+	""" Make a stylesheet's relative url()s work from its new place in dist """
+	def replace(match):
+		url = match.group(2)
+		if re.match(r"^([a-z]+:|/|#)", url):
+			return match.group(0)
+		path, suffix = re.match(r"^([^?#]*)(.*)$", url).groups()
+		target = posixpath.normpath(posixpath.join(posixpath.dirname(name), path))
+		target = hashed.get(target, target)
+		return "url({0}{1}{2}{0})".format(match.group(1),
+				app.static_url_path + "/" + target, suffix)
+	return re.sub(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""", replace, css)
+
+def compress(path, data):
+	""" Write gzip and brotli copies beside a file, where they are smaller """
+	if posixpath.splitext(path)[1] not in COMPRESSIBLE:
+		return
+	compressed = gzip.compress(data, 9)
+	if len(compressed) < len(data):
+		write(path + ".gz", compressed)
+	if brotli is not None:
+		compressed = brotli.compress(data, quality=11)
+		if len(compressed) < len(data):
+			write(path + ".br", compressed)
+
+def build(static):
+	""" Write the bundles and hashed copies of every static file to dist
+	
+	Files from the previous build are kept, for pages still cached with
+	links to them; any older are removed. Returns the number of files
+	written and the bundles skipped for want of a source file.
+	"""
+	names = []
+	for root, dirs, files in os.walk(static):
+		dirs[:] = [name for name in dirs if os.path.join(root, name)
+				!= os.path.join(static, DIST)]
+		names.extend(os.path.relpath(os.path.join(root, name), static)
+				.replace(os.sep, "/") for name in files)
+	
+	hashed = {}
+	contents = {}
+	# Stylesheets go last, as they may refer to the other files
+	for name in sorted(names, key=lambda name: (name.endswith(".css"), name)):
+		with open(os.path.join(static, name), "rb") as f:
+			data = f.read()
+		if name.endswith(".css"):
+			data = rewrite_urls(data.decode("utf-8"), name, hashed).encode("utf-8")
+		contents[name] = data
+		hashed[name] = hashed_name(name, data)
+	
+	missing = []
+	for bundle, parts in sorted(BUNDLES.items()):
+		if not all(part in contents for part in parts):
+			missing.append(bundle)
+			continue
+		data = b"\n".join(contents[part] for part in parts)
+		contents[bundle] = data
+		hashed[bundle] = hashed_name(bundle, data)
+	
+	written = 0
+	for name, data in contents.items():
+		path = os.path.join(static, hashed[name])
+		if os.path.exists(path):
+			continue
+		write(path, data)
+		compress(path, data)
+		written += 1
+	
+	keep = set(hashed.values()) | set(load_manifest(static).values())
+	for root, dirs, files in os.walk(os.path.join(static, DIST)):
+		for name in files:
+			path = os.path.join(root, name)
+			relative = os.path.relpath(path, static).replace(os.sep, "/")
+			if name != MANIFEST and re.sub(r"\.(gz|br)$", "", relative) not in keep:
+				os.remove(path)
+	write(os.path.join(static, DIST, MANIFEST),
+			json.dumps(hashed, indent=2, sort_keys=True).encode("utf-8"))
+	return {"written": written, "missing": missing}
@@ -0,0 +1,125 @@
+import os
+import sys
+import math
+import time
+import random
+import subprocess
+
+from sqlalchemy import func
+from werkzeug.security import generate_password_hash
+
+from . import app
+from . import pagecache
+from .database import session, Entry, User
+from .instrumentation import sql_queries
+from .pagination import encode_cursor
+from .seed import markdown_document
+from .views import PAGINATE_BY
+
+BENCH_EMAIL = "bench@example.com"
+BENCH_PASSWORD = "benchmark"
+
+def percentile(samples, fraction):
+	""" Nearest-rank percentile of a sorted list """
+	return samples[max(0, int(math.ceil(fraction * len(samples))) - 1)]
+
+def bench_user():
+	user = session.query(User).filter_by(email=BENCH_EMAIL).first()
+	if user is None:
+		user = User(name="Benchmark", email=BENCH_EMAIL,
+				password=generate_password_hash(BENCH_PASSWORD))
+		session.add(user)
+		session.commit()
+	return user.id
+
+def measure(make_request, count):
+	latencies = []
+	queries = sql_queries.total()
+	start = time.perf_counter()
+	for i in range(count):
+		before = time.perf_counter()
+		response = make_request(i)
+		latencies.append(time.perf_counter() - before)
+		if response.status_code >= 400:
+			raise RuntimeError("Request failed with {}".format(response.status))
+	elapsed = time.perf_counter() - start
+	queries = sql_queries.total() - queries
+	latencies.sort()
+	return {
+		"requests": count,
+		"throughput": round(count / elapsed, 1),
+		"p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+		"p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+		"p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+		"queries_per_request": round(queries / count, 2),
+	}
+
+def measure_startup(runs=5):
+	""" Time a cold `import blog` in a fresh interpreter, as a worker boots """
+	timings = []
+	for i in range(runs):
+		start = time.perf_counter()
+		subprocess.check_call([sys.executable, "-c", "import blog"],
+				cwd=os.path.dirname(app.root_path))
+		timings.append(time.perf_counter() - start)
+	timings.sort()
+	target = app.config.get("STARTUP_TIME_TARGET", 0.5)
+	return {
+		"runs": runs,
+		"p50_ms": round(percentile(timings, 0.5) * 1000, 3),
+		"target_ms": target * 1000,
+		"within_target": percentile(timings, 0.5) <= target,
+	}
+
+def run_benchmark(requests=200, cold=False, rng=None):
+	""" Time the main routes through the test client
+	
+	Returns throughput, latency percentiles and SQL queries per request for
+	each scenario. The add_entry scenario writes to the database, so point
+	this at a seeded stand-in, never at production.
+	"""
+	rng = rng or random.Random(0)
+	bench_user()
+	total = session.query(Entry).count()
+	if not total:
+		raise RuntimeError("No entries to benchmark; run manage.py seed first")
+	ids = [id for id, in session.query(Entry.id).order_by(func.random()).limit(100)]
+	last_page = (total - 1) // PAGINATE_BY + 1
+	# The same last page, reached with a cursor instead of an offset
+	deep = session.query(Entry).order_by(Entry.datetime.asc(), Entry.id.asc())
+	deep = deep.offset(min(PAGINATE_BY, total - 1)).first()
+	cursor = encode_cursor(deep)
+	session.remove()
+	
+	saved = pagecache.page_cache
+	if cold:
+		pagecache.page_cache = None
+	try:
+		credentials = {"email": BENCH_EMAIL, "password": BENCH_PASSWORD}
+		anonymous = app.test_client()
+		author = app.test_client()
+		author.post("/login", data=credentials)
+		scenarios = [
+			# Buffered, so that streamed pages are timed until they are sent
+			("index", lambda i: anonymous.get("/", buffered=True)),
+			("deep_page", lambda i: anonymous.get("/page/{}".format(last_page),
+					buffered=True)),
+			("deep_cursor", lambda i: anonymous.get("/",
+					query_string={"before": cursor}, buffered=True)),
+			("entry", lambda i: anonymous.get("/entry/{}".format(rng.choice(ids)),
+					buffered=True)),
+			("login", lambda i: app.test_client().post("/login", data=credentials)),
+			("add_entry", lambda i: author.post("/entry/add", data={
+				"title": "Benchmark #{}".format(i),
+				"content": markdown_document(rng),
+			})),
+		]
+		report = {}
+		for name, make_request in scenarios:
+			# Warm up connections and caches before timing
+			make_request(-1)
+			report[name] = measure(make_request, requests)
+		report["startup"] = measure_startup()
+	finally:
+		pagecache.page_cache = saved
+	return report
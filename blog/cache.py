@@ -0,0 +1,142 @@
+import os
+import hashlib
+import tempfile
+import time
+import threading
+from collections import OrderedDict
+
+class LRUCache(object):
+	""" A bounded, thread-safe, in-process least-recently-used cache """
+	def __init__(self, size):
+		self.size = size
+		self.data = OrderedDict()
+		self.lock = threading.Lock()
+		self.hits = 0
+		self.misses = 0
+	
+	def get(self, key, default=None):
+		with self.lock:
+			if key not in self.data:
+				self.misses += 1
+				return default
+			self.data.move_to_end(key)
+			self.hits += 1
+			return self.data[key]
+	
+	def set(self, key, value):
+		with self.lock:
+			self.data[key] = value
+			self.data.move_to_end(key)
+			while len(self.data) > self.size:
+				self.data.popitem(last=False)
+	
+	def delete(self, key):
+		with self.lock:
+			self.data.pop(key, None)
+	
+	def clear(self):
+		with self.lock:
+			self.data.clear()
+	
+	def __len__(self):
+		return len(self.data)
+	
+	def stats(self):
+		return {"hits": self.hits, "misses": self.misses, "size": len(self)}
+
+class TTLCache(LRUCache):
+	""" An LRUCache whose entries also expire a fixed number of seconds after being set """
+	def __init__(self, size, ttl):
+		super().__init__(size)
+		self.ttl = ttl
+	
+	def get(self, key, default=None):
+		with self.lock:
+			item = self.data.get(key)
+			if item is None or item[1] < time.monotonic():
+				self.data.pop(key, None)
+				self.misses += 1
+				return default
+			self.data.move_to_end(key)
+			self.hits += 1
+			return item[0]
+	
+	def set(self, key, value):
+		super().set(key, (value, time.monotonic() + self.ttl))
+
+class DiskCache(object):
+	""" A cache of text values stored as files in a local directory
+	
+	Unlike LRUCache, this is shared by every worker process on the machine.
+	Entries are written to a temporary file and renamed into place, so
+	readers never see a partial write. Past `size` files, the oldest written
+	are removed.
+	"""
+	def __init__(self, directory, size=None):
+		self.directory = directory
+		self.size = size
+		os.makedirs(directory, exist_ok=True)
+	
+	def path(self, key):
+		return os.path.join(self.directory,
+				hashlib.sha1(key.encode("utf-8")).hexdigest())
+	
+	def get(self, key, default=None):
+		try:
+			with open(self.path(key), encoding="utf-8") as f:
+				return f.read()
+		except FileNotFoundError:
+			return default
+	
+	def set(self, key, value):
+		fd, temp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+		with os.fdopen(fd, "w", encoding="utf-8") as f:
+			f.write(value)
+		os.replace(temp, self.path(key))
+		if self.size is not None:
+			self.prune()
+	
+	def prune(self):
+		""" Remove the oldest files until there are at most `size` """
+		entries = [entry for entry in os.scandir(self.directory)
+				if not entry.name.endswith(".tmp")]
+		if len(entries) <= self.size:
+			return
+		def written(entry):
+			try:
+				return entry.stat().st_mtime
+			except FileNotFoundError:
+				return 0
+		entries.sort(key=written)
+		for entry in entries[:len(entries) - self.size]:
+			try:
+				os.remove(entry.path)
+			except FileNotFoundError:
+				# Another process pruned it first
+				pass
+	
+	def delete(self, key):
+		try:
+			os.remove(self.path(key))
+		except FileNotFoundError:
+			pass
+	
+	def clear(self):
+		for name in os.listdir(self.directory):
+			try:
+				os.remove(os.path.join(self.directory, name))
+			except FileNotFoundError:
+				pass
+	
+	def __len__(self):
+		return len(os.listdir(self.directory))
+
+def make_cache(backend, size=None, directory=None):
+	""" Build a cache from config settings: "memory", "disk" or None for no cache """
+	if backend == "memory":
+		return LRUCache(size)
+	if backend == "disk":
+		return DiskCache(directory, size)
+	if backend is None:
+		return None
+	raise ValueError("Unknown cache backend {!r}".format(backend))
@@ -0,0 +1,57 @@
+""" Gzip text responses, HTML pages above all, for clients that accept it
+
+Streamed pages are compressed a chunk at a time, flushing after each, so
+they still reach the browser as they render.
+"""
+import gzip
+import zlib
+
+from flask import request
+
+from . import app
+
+class GzipStream(object):
+	""" Compresses a streamed body as it is sent, and closes the stream after """
+	def __init__(self, chunks, level):
+		self.chunks = chunks
+		# 16 + MAX_WBITS writes a gzip header and trailer
+		self.compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+	
+	def __iter__(self):
+		for chunk in self.chunks:
+			if isinstance(chunk, str):
+				chunk = chunk.encode("utf-8")
+			data = self.compressor.compress(chunk) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+			if data:
+				yield data
+		yield self.compressor.flush()
+	
+	def close(self):
+		# Unlike a generator's, this runs even if the body was never iterated
+		close = getattr(self.chunks, "close", None)
+		if close is not None:
+			close()
+
+@app.after_request
+def compress_response(response):
+	if (response.status_code != 200 or response.direct_passthrough
+			or "Content-Encoding" in response.headers
+			or response.mimetype not in app.config.get("COMPRESS_MIMETYPES", ())
+			or not request.accept_encodings["gzip"]):
+		return response
+	level = app.config.get("COMPRESS_LEVEL", 6)
+	if response.is_streamed:
+		response.response = GzipStream(response.response, level)
+		response.headers.pop("Content-Length", None)
+	else:
+		data = response.get_data()
+		if len(data) < app.config.get("COMPRESS_MIN_SIZE", 500):
+			return response
+		response.set_data(gzip.compress(data, level))
+	response.headers["Content-Encoding"] = "gzip"
+	response.vary.add("Accept-Encoding")
+	# The compressed body is different bytes, so it can't share a strong ETag
+	etag, weak = response.get_etag()
+	if etag is not None and not weak:
+		response.set_etag(etag, weak=True)
+	return response
@@ -0,0 +1,176 @@
+import datetime
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from . import app
+from .cache import TTLCache, LRUCache
+from .database import session, Counter, Entry, insert_or_ignore
+
+ENTRY_COUNT = "entries"
+# Bumped by every write that changes what readers see
+GENERATION = "generation"
+
+# Lets requests that only need the generation, like 304s, skip the database.
+# Writes in other processes show up within GENERATION_TTL seconds. Kept
+# for each database read from, as a replica may be behind the primary.
+generation_cache = TTLCache(1, 0)
+# Entry counts by month for the archive sidebar, for the current generation
+month_cache = LRUCache(1)
+
+def init_app(app):
+	generation_cache.ttl = app.config.get("GENERATION_TTL", 0)
+	generation_cache.size = 1 + len(app.config.get("SQLALCHEMY_REPLICA_URIS") or [])
+	generation_cache.clear()
+	month_cache.clear()
+
+def increment(name, delta=1, recount=None):
+	""" Adjust a counter as part of the current transaction
+	
+	A counter that doesn't exist yet is left alone; it will be counted from
+	scratch the next time it is read. Given `recount`, it is created from a
+	fresh count instead, which should already include this change.
+	"""
+	updated = session.query(Counter).filter_by(name=name).update({
+		Counter.value: Counter.value + delta,
+		Counter.updated: datetime.datetime.utcnow(),
+	}, synchronize_session=False)
+	if updated or recount is None:
+		return
+	insert = insert_or_ignore(Counter.__table__, name=name, value=recount(),
+			reconciled=datetime.datetime.now(), updated=datetime.datetime.utcnow())
+	if not session.execute(insert).rowcount:
+		# Another transaction created it first, without this change
+		increment(name, delta)
+
+def reconcile(name, recount):
+	""" Replace a counter's value with a fresh count """
+	counter = Counter(name=name, value=recount(),
+			reconciled=datetime.datetime.now())
+	session.merge(counter)
+	try:
+		session.commit()
+	except IntegrityError:
+		# Another worker created the row first; its count is just as good
+		session.rollback()
+	return counter.value
+
+def get_count(name, recount):
+	""" Read a counter, recounting it if it is missing or due a reconcile """
+	counter = session.query(Counter).get(name)
+	max_age = datetime.timedelta(
+			seconds=app.config.get("COUNTER_RECONCILE_SECONDS", 3600))
+	if counter is None or counter.reconciled < datetime.datetime.now() - max_age:
+		return reconcile(name, recount)
+	return counter.value
+
+def count_entries():
+	return session.query(Entry).count()
+
+def entry_count():
+	return get_count(ENTRY_COUNT, count_entries)
+
+def author_key(author_id):
+	return "author:{}".format(author_id)
+
+def count_author_entries(author_id):
+	return session.query(Entry).filter_by(author_id=author_id).count()
+
+def author_entry_count(author_id):
+	return get_count(author_key(author_id),
+			lambda: count_author_entries(author_id))
+
+def reconcile_authors():
+	""" Recount every author's entries with one grouped query """
+	counts = dict(session.query(Entry.author_id, func.count(Entry.id))
+			.filter(Entry.author_id != None).group_by(Entry.author_id))
+	# Authors whose last entry has gone still have a counter to zero
+	for name, in session.query(Counter.name).filter(Counter.name.like("author:%")):
+		counts.setdefault(int(name.split(":", 1)[1]), 0)
+	now = datetime.datetime.now()
+	for author_id, count in counts.items():
+		session.merge(Counter(name=author_key(author_id), value=count,
+				reconciled=now))
+	session.commit()
+	return len(counts)
+
+def month_key(stamp):
+	return "month:{:%Y-%m}".format(stamp)
+
+def month_range(year, month):
+	""" The first moment of a month and of the month after it """
+	return (datetime.datetime(year, month, 1),
+			datetime.datetime(year + month // 12, month % 12 + 1, 1))
+
+def count_month(year, month):
+	start, end = month_range(year, month)
+	return session.query(Entry).filter(Entry.datetime >= start,
+			Entry.datetime < end).count()
+
+def add_to_month(stamp, delta=1):
+	""" Count an entry added to or removed from the month of `stamp` """
+	increment(month_key(stamp), delta,
+			lambda: count_month(stamp.year, stamp.month))
+
+def month_count(year, month):
+	return get_count(month_key(datetime.date(year, month, 1)),
+			lambda: count_month(year, month))
+
+def month_index():
+	""" (first day, count) for every month with entries, newest first
+	
+	Read from the month counters, so it costs one small query per content
+	generation however many entries there are.
+	"""
+	current, updated = generation()
+	cached = month_cache.get(current)
+	if cached is not None:
+		return cached
+	counts = session.query(Counter.name, Counter.value).filter(
+			Counter.name.like("month:%"), Counter.value > 0)
+	cached = [(datetime.date(int(name[6:10]), int(name[11:13]), 1), value)
+			for name, value in counts.order_by(Counter.name.desc())]
+	month_cache.set(current, cached)
+	return cached
+
+def reconcile_months():
+	""" Recount every month's entries with one grouped query """
+	if session.get_bind().dialect.name == "postgresql":
+		month = func.to_char(Entry.datetime, "YYYY-MM")
+	else:
+		month = func.strftime("%Y-%m", Entry.datetime)
+	counts = {"month:" + name: count for name, count in
+			session.query(month, func.count(Entry.id)).group_by(month)
+			if name is not None}
+	for name, in session.query(Counter.name).filter(Counter.name.like("month:%")):
+		counts.setdefault(name, 0)
+	now = datetime.datetime.now()
+	for name, count in counts.items():
+		session.merge(Counter(name=name, value=count, reconciled=now))
+	session.commit()
+	month_cache.clear()
+	return len(counts)
+
+def touch():
+	""" Record that the site's content has changed, as part of the current transaction """
+	increment(GENERATION)
+
+def generation():
+	""" The current content generation, and when it last changed (in UTC)
+	
+	Cached pages and ETags are keyed on the generation, so a write in any
+	worker process makes every cached copy stale at once.
+	"""
+	# A page read from a replica must not be cached under a newer generation
+	# seen on the primary, or it would stay stale until the next write
+	key = session.get_bind().engine
+	cached = generation_cache.get(key)
+	if cached is not None:
+		return cached
+	counter = session.query(Counter).get(GENERATION)
+	if counter is None:
+		cached = reconcile(GENERATION, lambda: 0), datetime.datetime.utcnow()
+	else:
+		cached = counter.value, counter.updated
+	generation_cache.set(key, cached)
+	return cached
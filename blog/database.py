@@ -1,19 +1,189 @@
+import os
+import random
 import datetime
+import functools
+import itertools
+import threading
+import contextlib
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, relationship
+from flask import request, has_request_context, after_this_request
+from sqlalchemy import create_engine, event, exc, DDL
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.pool import Pool, StaticPool
+from sqlalchemy.orm import Session as BaseSession, sessionmaker, scoped_session, relationship
+from sqlalchemy.orm import joinedload, load_only
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, ForeignKey, Index
 
 from flask_login import UserMixin
 
 from . import app
+from .filters import render_markdown, make_excerpt, RENDERER_VERSION
+
+# SQLite URIs for a database held in memory
+MEMORY_URIS = ("sqlite://", "sqlite:///:memory:")
+
+def engine_options(config, uri=None):
+	""" Connection pool settings for create_engine, taken from the app config
+	
+	Settings left as None fall back to the defaults for the database's dialect.
+	"""
+	options = {}
+	if uri in MEMORY_URIS:
+		# An in-memory database lasts only as long as its one connection, so
+		# every thread has to share that
+		options["poolclass"] = StaticPool
+		options["connect_args"] = {"check_same_thread": False}
+	for key, option in [
+		("SQLALCHEMY_POOL_SIZE", "pool_size"),
+		("SQLALCHEMY_MAX_OVERFLOW", "max_overflow"),
+		("SQLALCHEMY_POOL_TIMEOUT", "pool_timeout"),
+		("SQLALCHEMY_POOL_RECYCLE", "pool_recycle"),
+		("SQLALCHEMY_POOL_PRE_PING", "pool_pre_ping"),
+	]:
+		if config.get(key) is not None:
+			options[option] = config[key]
+	return options
+
+# Built from the app config on first use, so that importing the app, or
+# forking workers from a master that has imported it, opens no connections
+engine = None
+replicas = None
+engine_lock = threading.Lock()
+
+def get_engine():
+	""" The database engine, created on first use """
+	global engine
+	if engine is None:
+		with engine_lock:
+			if engine is None:
+				uri = app.config["SQLALCHEMY_DATABASE_URI"]
+				engine = create_engine(uri, **engine_options(app.config, uri))
+	return engine
+
+def get_replicas():
+	""" An engine, with its own pool, for each of SQLALCHEMY_REPLICA_URIS """
+	global replicas
+	if replicas is None:
+		with engine_lock:
+			if replicas is None:
+				replicas = [create_engine(uri, **engine_options(app.config, uri))
+						for uri in app.config.get("SQLALCHEMY_REPLICA_URIS") or []]
+	return replicas
+
+# Set on the responses to writes, so that the writer reads from the primary
+# until the replicas have caught up with what they wrote
+STICKY_COOKIE = "read_primary"
+
+def read_replica():
+	""" The replica to read from in this request, or None for the primary """
+	if not has_request_context() or not getattr(request, "read_only", False):
+		return None
+	if STICKY_COOKIE in request.cookies or not get_replicas():
+		return None
+	# One replica for the whole request, so that its reads agree
+	if getattr(request, "replica", None) is None:
+		request.replica = random.choice(get_replicas())
+	return request.replica
+
+class RoutingSession(BaseSession):
+	""" Reads from a replica in read-only views; flushes and DML go to the primary """
+	def get_bind(self, mapper=None, clause=None):
+		if not self._flushing and not isinstance(clause, UpdateBase):
+			replica = read_replica()
+			if replica is not None:
+				return replica
+		return super().get_bind(mapper, clause)
+
+def read_only(view):
+	""" Let a view's queries go to a replica """
+	@functools.wraps(view)
+	def wrapper(*args, **kwargs):
+		request.read_only = True
+		return view(*args, **kwargs)
+	return wrapper
+
+@contextlib.contextmanager
+def reading():
+	""" Let the queries in the block go to a replica, in any view """
+	if not has_request_context():
+		yield
+		return
+	previous = getattr(request, "read_only", False)
+	request.read_only = True
+	try:
+		yield
+	finally:
+		request.read_only = previous
+
+def stick_to_primary():
+	""" Read from the primary for the next few requests, to see our own write """
+	if not get_replicas():
+		return
+	@after_this_request
+	def set_cookie(response):
+		response.set_cookie(STICKY_COOKIE, "1", httponly=True,
+				max_age=app.config.get("REPLICA_STICKY_SECONDS", 10))
+		return response
 
-engine = create_engine(app.config["SQLALCHEMY_DATABASE_URI"])
 Base = declarative_base()
-Session = sessionmaker(bind=engine)
-session = Session()
+Session = sessionmaker(class_=RoutingSession)
+# Makes each thread's session. Tests replace it to run every session inside
+# a transaction that they roll back; see tests/fixtures.py.
+session_factory = lambda: Session(bind=get_engine())
+# One session per thread, removed at the end of every request
+session = scoped_session(lambda: session_factory())
+
+def init_app(app):
+	""" Drop any engines built from an earlier config """
+	global engine, replicas
+	session.remove()
+	for old in [engine] + (replicas or []):
+		if old is not None:
+			old.dispose()
+	engine = replicas = None
+
+def insert_or_ignore(table, **values):
+	""" An INSERT that does nothing if it would break a unique constraint """
+	if session.get_bind().dialect.name == "postgresql":
+		return postgresql.insert(table).values(**values).on_conflict_do_nothing()
+	insert = table.insert().values(**values)
+	if session.get_bind().dialect.name == "sqlite":
+		insert = insert.prefix_with("OR IGNORE")
+	return insert
+
+def init_db():
+	""" Create any missing tables, for fresh databases; otherwise use migrations """
+	Base.metadata.create_all(get_engine())
+
+@app.teardown_request
+@app.teardown_appcontext
+def remove_session(exception=None):
+	session.remove()
+
+# Connections must never be shared between processes. If a worker is forked
+# from a process that already has pooled connections, the child discards the
+# ones it inherited and opens its own.
+@event.listens_for(Pool, "connect")
+def connect(dbapi_connection, connection_record):
+	connection_record.info["pid"] = os.getpid()
 
+@event.listens_for(Pool, "checkout")
+def checkout(dbapi_connection, connection_record, connection_proxy):
+	pid = os.getpid()
+	if connection_record.info["pid"] != pid:
+		connection_record.connection = connection_proxy.connection = None
+		raise exc.DisconnectionError(
+			"Connection record belongs to pid {}, attempting to check out "
+			"in pid {}".format(connection_record.info["pid"], pid))
+
+def reset_after_fork():
+	# Closing the session would use the parent's connection, so just forget it
+	session.registry.clear()
+
+if hasattr(os, "register_at_fork"):
+	os.register_at_fork(after_in_child=reset_after_fork)
 
 class Entry(Base):
 	__tablename__ = "entries"
@@ -21,8 +191,51 @@ class Entry(Base):
 	id = Column(Integer, primary_key=True)
 	title = Column(String(1024))
 	content = Column(Text)
+	content_html = Column(Text)
+	# Shown on list pages in place of the full entry
+	excerpt_html = Column(Text)
+	excerpt_truncated = Column(Boolean)
+	render_version = Column(Integer)
 	datetime = Column(DateTime, default=datetime.datetime.now)
 	author_id = Column(Integer, ForeignKey('users.id'))
+	
+	# Back keyset pagination, which seeks on (datetime, id), over all entries
+	# and within each author's
+	__table_args__ = (
+		Index("ix_entries_datetime_id", "datetime", "id"),
+		Index("ix_entries_author_datetime_id", "author_id", "datetime", "id"),
+	)
+	
+	def set_content(self, content, render=True):
+		""" Change the markdown, rendering it now or leaving it to a job
+		
+		Until the render_entry job has run, pages render the markdown as
+		they are served.
+		"""
+		self.content = content
+		if not render:
+			self.content_html = self.excerpt_html = None
+			self.excerpt_truncated = self.render_version = None
+			return
+		self.content_html = render_markdown(content)
+		self.excerpt_html, self.excerpt_truncated = make_excerpt(self.content_html)
+		self.render_version = RENDERER_VERSION
+
+# Full text search indexes. Postgres adds a search_vector column, left out
+# of the model so that loading an entry never fetches it, with a GIN index;
+# SQLite keeps a separate FTS5 table whose rowids are entry ids.
+event.listen(Entry.__table__, "after_create", DDL(
+	"ALTER TABLE entries ADD COLUMN search_vector tsvector"
+).execute_if(dialect="postgresql"))
+event.listen(Entry.__table__, "after_create", DDL(
+	"CREATE INDEX ix_entries_search_vector ON entries USING gin (search_vector)"
+).execute_if(dialect="postgresql"))
+event.listen(Entry.__table__, "after_create", DDL(
+	"CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5(title, content)"
+).execute_if(dialect="sqlite"))
+event.listen(Entry.__table__, "before_drop", DDL(
+	"DROP TABLE IF EXISTS entries_fts"
+).execute_if(dialect="sqlite"))
 
 class User(Base, UserMixin):
 	__tablename__ = "users"
@@ -33,4 +246,73 @@ class User(Base, UserMixin):
 	password = Column(String(128))
 	entries = relationship("Entry", backref="author")
 
-Base.metadata.create_all(engine)
\ No newline at end of file
+# Loader options for pages that list entries as excerpts. The full text
+# stays in the database, and authors come in the same query.
+EXCERPT_OPTIONS = (
+	load_only("title", "excerpt_html", "excerpt_truncated", "render_version",
+			"datetime", "author_id"),
+	joinedload("author").load_only("name"),
+)
+
+def load_text(entries):
+	""" Load the text of listed entries that have no current excerpt
+	
+	Their excerpts are cut from the full text as the page renders, which
+	would otherwise be loaded with a query for each entry. This takes one.
+	"""
+	stale = [entry.id for entry in entries if entry.excerpt_html is None
+			or entry.render_version != RENDERER_VERSION]
+	if stale:
+		session.query(Entry).filter(Entry.id.in_(stale)).options(
+				load_only("content", "content_html")).all()
+	return entries
+
+def with_text(rows, batch):
+	""" Like load_text, for entries streamed from the database in batches """
+	rows = iter(rows)
+	while True:
+		entries = load_text(list(itertools.islice(rows, batch)))
+		if not entries:
+			return
+		yield from entries
+
+class Counter(Base):
+	""" A count maintained incrementally, so pages need not run COUNT(*) """
+	__tablename__ = "counters"
+	
+	name = Column(String(128), primary_key=True)
+	value = Column(Integer, nullable=False, default=0)
+	reconciled = Column(DateTime, default=datetime.datetime.now)
+	# In UTC, as it is sent in Last-Modified headers
+	updated = Column(DateTime, default=datetime.datetime.utcnow)
+
+class ImportProgress(Base):
+	""" How many entries an import has taken from its source; see blog.transfer """
+	__tablename__ = "import_progress"
+	
+	# The source's real path, or a hash of it if that is too long
+	path = Column(String(1024), primary_key=True)
+	# Of the source's contents, so a changed file starts again
+	digest = Column(String(40), primary_key=True)
+	done = Column(Integer, nullable=False, default=0)
+	updated = Column(DateTime, default=datetime.datetime.now)
+
+class Job(Base):
+	""" Background work waiting for `manage.py worker`; see blog.jobs """
+	__tablename__ = "jobs"
+	
+	id = Column(Integer, primary_key=True)
+	name = Column(String(128), nullable=False)
+	# A JSON list
+	arguments = Column(Text, nullable=False)
+	key = Column(String(1024), nullable=False)
+	created = Column(DateTime, default=datetime.datetime.now)
+	# When a worker took it, or None while it waits
+	claimed = Column(DateTime)
+	attempts = Column(Integer, nullable=False, default=0)
+	
+	# Only one copy of a job waits at a time; queueing it again is a no-op
+	__table_args__ = (
+		Index("ix_jobs_waiting_key", "key", unique=True,
+				postgresql_where=claimed == None, sqlite_where=claimed == None),
+	)
@@ -0,0 +1,218 @@
+import os
+import json
+import fcntl
+import shutil
+import hashlib
+import multiprocessing
+
+from flask import render_template
+from sqlalchemy.orm import joinedload
+
+from . import app
+from . import jobs
+from .database import session, Entry, User, EXCERPT_OPTIONS, load_text
+from .filters import RENDERER_VERSION
+from .views import PAGINATE_BY
+
+MANIFEST = "manifest.json"
+# Held by whichever process is exporting to the directory
+LOCK = ".export.lock"
+# Present while an export has been asked for but not yet started
+PENDING = ".export.pending"
+# Fewer pages than this are rendered in this process, as starting a pool of
+# fresh interpreters would take longer than rendering them
+POOL_MIN_JOBS = 50
+
+def entry_path(id):
+	return os.path.join("entry", str(id), "index.html")
+
+def page_path(page):
+	if page == 1:
+		return "index.html"
+	return os.path.join("page", str(page), "index.html")
+
+def page_url(page):
+	if page == 1:
+		return "/"
+	return "/page/{}/".format(page)
+
+def entry_hash(entry, author_name):
+	parts = [entry.title, entry.content, entry.datetime.isoformat(),
+			author_name, str(RENDERER_VERSION)]
+	return hashlib.sha1("\0".join(part or "" for part in parts)
+			.encode("utf-8")).hexdigest()
+
+def scan():
+	""" Hash every entry, newest first, without holding them all in memory """
+	entries = session.query(Entry, User.name).outerjoin(User, Entry.author)
+	entries = entries.order_by(Entry.datetime.desc(), Entry.id.desc())
+	for entry, author_name in entries.yield_per(1000):
+		yield entry.id, entry.datetime.isoformat(), entry_hash(entry, author_name)
+
+def write(directory, path, html):
+	path = os.path.join(directory, path)
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	with open(path + ".tmp", "w", encoding="utf-8") as f:
+		f.write(html)
+	os.replace(path + ".tmp", path)
+
+def remove(directory, path):
+	try:
+		os.remove(os.path.join(directory, path))
+	except FileNotFoundError:
+		pass
+
+def render_job(job):
+	""" Render one page in a worker process and write it to disk """
+	directory, kind, key, ids, last_page = job
+	with app.test_request_context("/"):
+		entries = session.query(Entry).filter(Entry.id.in_(ids))
+		entries = entries.order_by(Entry.datetime.desc(), Entry.id.desc())
+		if kind == "entry":
+			entries = entries.options(joinedload(Entry.author)).all()
+			html = render_template("entries.html", entries=entries, exported=True)
+			write(directory, entry_path(key), html)
+		else:
+			html = render_template("entries.html",
+				entries=load_text(entries.options(*EXCERPT_OPTIONS).all()),
+				excerpts=True,
+				exported=True,
+				older_url=page_url(key + 1) if key < last_page else None,
+				newer_url=page_url(key - 1) if key > 1 else None,
+			)
+			write(directory, page_path(key), html)
+	return kind
+
+def copy_static(directory):
+	""" Copy the static assets, skipping files that are already up to date """
+	source = os.path.join(app.root_path, "static")
+	copied = 0
+	for root, dirs, files in os.walk(source):
+		for name in files:
+			src = os.path.join(root, name)
+			dst = os.path.join(directory, "static", os.path.relpath(src, source))
+			if os.path.exists(dst) and os.path.getmtime(dst) >= os.path.getmtime(src):
+				continue
+			os.makedirs(os.path.dirname(dst), exist_ok=True)
+			shutil.copy2(src, dst)
+			copied += 1
+	return copied
+
+def export_site(directory, processes=None, per_page=PAGINATE_BY):
+	""" Write the public site to a directory as static HTML
+	
+	A manifest of each entry's content hash is kept alongside the output,
+	so later runs only re-render entries that changed and the index pages
+	whose contents changed or shifted.
+	"""
+	os.makedirs(directory, exist_ok=True)
+	manifest_path = os.path.join(directory, MANIFEST)
+	try:
+		with open(manifest_path) as f:
+			manifest = json.load(f)
+	except FileNotFoundError:
+		manifest = {"entries": {}, "pages": {}}
+	old_entries = manifest["entries"]
+	old_pages = manifest["pages"]
+	
+	entries = {}
+	pages = []
+	jobs = []
+	for id, stamp, digest in scan():
+		entries[str(id)] = {"hash": digest, "datetime": stamp}
+		if old_entries.get(str(id), {}).get("hash") != digest:
+			jobs.append((directory, "entry", id, [id], None))
+		if not pages or len(pages[-1]) == per_page:
+			pages.append([])
+		pages[-1].append((id, digest))
+	# The workers open their own connections
+	session.remove()
+	
+	page_hashes = {}
+	for number, page in enumerate(pages, 1):
+		# A page also changes when it gains or loses an older neighbour
+		digest = hashlib.sha1(json.dumps([page, number < len(pages)])
+				.encode("utf-8")).hexdigest()
+		page_hashes[str(number)] = digest
+		if old_pages.get(str(number)) != digest:
+			jobs.append((directory, "page", number,
+					[id for id, entry_digest in page], len(pages)))
+	if not pages:
+		page_hashes["1"] = None
+		jobs.append((directory, "page", 1, [], 1))
+	
+	for id in set(old_entries) - set(entries):
+		remove(directory, entry_path(id))
+	for number in set(old_pages) - set(page_hashes):
+		remove(directory, page_path(int(number)))
+	
+	written = {"entry": 0, "page": 0}
+	if len(jobs) < POOL_MIN_JOBS or processes == 1:
+		for job in jobs:
+			written[render_job(job)] += 1
+		session.remove()
+	else:
+		# Forked from a threaded server, a worker could inherit a lock that
+		# another thread held and wait on it forever. Spawned ones start
+		# afresh and configure the app from $CONFIG_PATH.
+		context = multiprocessing.get_context("spawn")
+		with context.Pool(processes) as pool:
+			for kind in pool.imap_unordered(render_job, jobs, chunksize=16):
+				written[kind] += 1
+	
+	manifest = {"entries": entries, "pages": page_hashes}
+	with open(manifest_path + ".tmp", "w") as f:
+		json.dump(manifest, f)
+	os.replace(manifest_path + ".tmp", manifest_path)
+	
+	return {
+		"entries": written["entry"],
+		"pages": written["page"],
+		"removed": len(set(old_entries) - set(entries)),
+		"static": copy_static(directory),
+	}
+
+def lock(directory, blocking=True):
+	""" Take the directory's export lock, shared by every process and thread
+	
+	Returns the open lock file, which releases the lock when closed, or None
+	if it isn't blocking and another export holds the lock.
+	"""
+	os.makedirs(directory, exist_ok=True)
+	f = open(os.path.join(directory, LOCK), "a")
+	try:
+		fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+	except BlockingIOError:
+		f.close()
+		return None
+	return f
+
+def take_pending(directory):
+	try:
+		os.remove(os.path.join(directory, PENDING))
+		return True
+	except FileNotFoundError:
+		return False
+
+@jobs.job
+def export_changes():
+	""" Bring the static export in EXPORT_DIR up to date after a write
+	
+	Exports to the directory from every process run one at a time, and
+	those asked for while one runs are merged into a single export after it.
+	"""
+	directory = app.config.get("EXPORT_DIR")
+	if not directory:
+		return
+	os.makedirs(directory, exist_ok=True)
+	open(os.path.join(directory, PENDING), "w").close()
+	# Another request may arrive between our last look and letting go of the
+	# lock; it then finds the lock held, so we look again
+	while os.path.exists(os.path.join(directory, PENDING)):
+		lock_file = lock(directory, blocking=False)
+		if lock_file is None:
+			# Whoever holds it exports again once it is done
+			return
+		with lock_file:
+			while take_pending(directory):
+				export_site(directory, app.config.get("EXPORT_PROCESSES"))
@@ -1,13 +1,144 @@
+import html
+import hashlib
+import email.utils
+from html.parser import HTMLParser
+
 from . import app
+from .cache import LRUCache
+from .instrumentation import timed
 from flask import Markup
 import mistune as md
 
+# Bump this whenever the markdown renderer or its options change, then run
+# `manage.py rerender` to bring the stored HTML up to date
+RENDERER_VERSION = 1
+
+# List pages show about this many characters of each entry's text. Run
+# `manage.py excerpts --all` after changing it.
+EXCERPT_LENGTH = 600
+
+markdown_cache = LRUCache(1024)
+
+def init_app(app):
+	markdown_cache.size = app.config.get("MARKDOWN_CACHE_SIZE", 1024)
+	markdown_cache.clear()
+
+def render_markdown(text):
+	key = hashlib.sha1(text.encode("utf-8")).hexdigest()
+	html = markdown_cache.get(key)
+	if html is None:
+		html = md.markdown(text,escape=True)
+		markdown_cache.set(key, html)
+	return html
+
+# Elements that have no closing tag
+VOID_ELEMENTS = {"area", "base", "br", "col", "embed", "hr", "img", "input",
+		"link", "meta", "source", "track", "wbr"}
+
+class BlockScanner(HTMLParser):
+	""" Finds where each top level element of some HTML ends, and how much
+	text comes before that point """
+	def __init__(self, source):
+		super().__init__(convert_charrefs=True)
+		self.source = source
+		# HTMLParser reports (line, column) positions
+		self.line_starts = [0]
+		for line in source.split("\n"):
+			self.line_starts.append(self.line_starts[-1] + len(line) + 1)
+		self.depth = 0
+		self.text = []
+		self.boundaries = []
+	
+	def position(self):
+		line, column = self.getpos()
+		return self.line_starts[line - 1] + column
+	
+	def block_ended(self):
+		end = self.source.index(">", self.position()) + 1
+		self.boundaries.append((end, "".join(self.text)))
+	
+	def handle_starttag(self, tag, attrs):
+		if tag in VOID_ELEMENTS:
+			self.handle_startendtag(tag, attrs)
+		else:
+			self.depth += 1
+	
+	def handle_startendtag(self, tag, attrs):
+		if self.depth == 0:
+			self.block_ended()
+	
+	def handle_endtag(self, tag):
+		self.depth -= 1
+		if self.depth == 0:
+			self.block_ended()
+	
+	def handle_data(self, data):
+		self.text.append(data)
+
+def make_excerpt(source, length=EXCERPT_LENGTH):
+	""" Cut rendered HTML down to roughly `length` characters of text
+	
+	The cut is made between top level elements, such as paragraphs, so the
+	excerpt is well formed. If the first element alone is far too long, its
+	text is shortened at a word boundary instead. Returns the excerpt and
+	whether anything was left out.
+	"""
+	scanner = BlockScanner(source)
+	scanner.feed(source)
+	scanner.close()
+	previous = None
+	for end, text in scanner.boundaries:
+		if len(text.strip()) >= length:
+			break
+		previous = end
+	else:
+		return source, False
+	
+	# Leave out an element that would make the excerpt far too long
+	if len(text.strip()) > length * 2:
+		if previous is not None:
+			end = previous
+		else:
+			text = " ".join(text.split())
+			cut = text.rfind(" ", 0, length)
+			text = text[:cut if cut > 0 else length]
+			return "<p>{}&hellip;</p>".format(html.escape(text)), True
+	return source[:end], bool(source[end:].strip())
+
 @app.template_filter()
 def markdown(text):
-	return Markup(md.markdown(text,escape=True))
+	with timed("markdown_time"):
+		return Markup(render_markdown(text))
+
+@app.template_filter()
+def entry_html(entry):
+	# Use the HTML rendered when the entry was saved, unless it is missing or
+	# was rendered by an older version of the renderer
+	if entry.content_html is not None and entry.render_version == RENDERER_VERSION:
+		return Markup(entry.content_html)
+	return markdown(entry.content)
+
+@app.template_filter()
+def excerpt(entry):
+	""" The entry's excerpt HTML, and whether it leaves anything out """
+	# Entries saved before excerpts, or by an older renderer, are cut down
+	# from their full text here instead
+	if entry.excerpt_html is not None and entry.render_version == RENDERER_VERSION:
+		return Markup(entry.excerpt_html), entry.excerpt_truncated
+	html, truncated = make_excerpt(entry_html(entry))
+	return Markup(html), truncated
 
 @app.template_filter()
 def dateformat(date, format):
 	if not date:
 		return None
 	return date.strftime(format)
+
+@app.template_filter()
+def rfc3339(date):
+	# Naive datetimes are in the server's local time
+	return date.astimezone().isoformat()
+
+@app.template_filter()
+def rfc822(date):
+	return email.utils.format_datetime(date.astimezone())
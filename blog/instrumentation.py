@@ -0,0 +1,172 @@
+import time
+import logging
+import functools
+import contextlib
+
+from flask import request, has_request_context, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql.expression import SavepointClause, ReleaseSavepointClause
+from sqlalchemy.sql.expression import RollbackToSavepointClause
+
+from . import app
+from .metrics import registry
+
+log = logging.getLogger(__name__)
+
+SAVEPOINT_CLAUSES = (SavepointClause, ReleaseSavepointClause, RollbackToSavepointClause)
+
+request_duration = registry.histogram("blog_request_duration_seconds",
+		"Time taken to handle a request", ["endpoint"])
+request_sql = registry.histogram("blog_request_sql_seconds",
+		"Time spent running SQL statements per request", ["endpoint"])
+request_render = registry.histogram("blog_request_render_seconds",
+		"Time spent rendering templates per request", ["endpoint"])
+request_markdown = registry.histogram("blog_request_markdown_seconds",
+		"Time spent in the markdown filter per request", ["endpoint"])
+sql_queries = registry.counter("blog_sql_queries",
+		"SQL statements run", ["endpoint"])
+responses = registry.counter("blog_responses",
+		"Responses sent", ["endpoint", "status"])
+
+def init_app(app):
+	registry.directory = app.config.get("METRICS_DIR")
+	registry.flush_interval = app.config.get("METRICS_FLUSH_SECONDS", 1)
+
+@event.listens_for(Engine, "before_cursor_execute")
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+	conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+@event.listens_for(Engine, "after_cursor_execute")
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+	elapsed = time.perf_counter() - conn.info["query_start"].pop()
+	stats = current_stats()
+	if stats is None or is_savepoint(context):
+		return
+	stats.query_count += 1
+	stats.query_time += elapsed
+	if stats.statements is not None:
+		stats.statements.append((elapsed, statement))
+
+def is_savepoint(context):
+	""" Whether a statement only manages a savepoint
+	
+	Those aren't counted, any more than the BEGIN and COMMIT that the
+	driver sends itself, so that tests run inside savepoints see the same
+	query counts.
+	"""
+	compiled = getattr(context, "compiled", None)
+	return isinstance(getattr(compiled, "statement", None), SAVEPOINT_CLAUSES)
+
+@before_render_template.connect_via(app)
+def before_render(sender, template, context, **extra):
+	stats = current_stats()
+	if stats is not None:
+		stats.render_starts.append(time.perf_counter())
+
+@template_rendered.connect_via(app)
+def after_render(sender, template, context, **extra):
+	stats = current_stats()
+	if stats is not None and stats.render_starts:
+		stats.render_time += time.perf_counter() - stats.render_starts.pop()
+
+class RequestStats(object):
+	""" Where the time went while handling one request """
+	def __init__(self, keep_statements=False):
+		self.start = time.perf_counter()
+		self.query_count = 0
+		self.query_time = 0.0
+		self.render_time = 0.0
+		self.render_starts = []
+		self.markdown_time = 0.0
+		# Statements are only kept when they might be logged
+		self.statements = [] if keep_statements else None
+
+def current_stats():
+	# Kept on the request rather than in `g`, as a streamed response is
+	# rendered in a fresh app context once the view has returned
+	if has_request_context():
+		return getattr(request._get_current_object(), "stats", None)
+
+@contextlib.contextmanager
+def timed(name):
+	""" Add the time spent in the block to a total kept for the current request """
+	start = time.perf_counter()
+	try:
+		yield
+	finally:
+		stats = current_stats()
+		if stats is not None:
+			setattr(stats, name, getattr(stats, name) + time.perf_counter() - start)
+
+@app.before_request
+def reset_query_stats():
+	request.stats = RequestStats(
+			keep_statements=app.config.get("SLOW_REQUEST_SECONDS") is not None)
+
+def query_stats():
+	""" The number of SQL statements run so far in this request, and their total time """
+	stats = current_stats()
+	if stats is None:
+		return 0, 0.0
+	return stats.query_count, stats.query_time
+
+def query_stats_header():
+	""" Whether responses report their queries in a header, and so can't be streamed """
+	return app.debug or app.config.get("QUERY_STATS_HEADER")
+
+@app.after_request
+def add_query_stats_header(response):
+	# A streamed body runs its queries after the headers have been sent
+	if response.is_streamed:
+		return response
+	if query_stats_header():
+		count, elapsed = query_stats()
+		response.headers["X-Query-Count"] = str(count)
+		response.headers["X-Query-Time"] = "{:.2f}ms".format(elapsed * 1000)
+	return response
+
+@app.after_request
+def record_request(response):
+	stats = current_stats()
+	if stats is None:
+		return response
+	endpoint = request.endpoint or "none"
+	description = "{} {} ({}) {}".format(request.method,
+			request.full_path.rstrip("?"), endpoint, response.status_code)
+	record = functools.partial(record_stats, stats, endpoint,
+			response.status_code, description)
+	if response.is_streamed:
+		# Wait until the body has been rendered and sent
+		response.call_on_close(record)
+	else:
+		record()
+	return response
+
+def record_stats(stats, endpoint, status, description):
+	elapsed = time.perf_counter() - stats.start
+	request_duration.observe(elapsed, endpoint)
+	request_sql.observe(stats.query_time, endpoint)
+	request_render.observe(stats.render_time, endpoint)
+	request_markdown.observe(stats.markdown_time, endpoint)
+	sql_queries.inc(endpoint, amount=stats.query_count)
+	responses.inc(endpoint, str(status))
+	registry.flush()
+	
+	threshold = app.config.get("SLOW_REQUEST_SECONDS")
+	if threshold is not None and elapsed >= threshold:
+		log_slow_request(stats, elapsed, description)
+
+def log_slow_request(stats, elapsed, description):
+	lines = ["Slow request: {} in {:.1f}ms; {} queries {:.1f}ms, "
+			"render {:.1f}ms, markdown {:.1f}ms".format(description,
+			elapsed * 1000, stats.query_count, stats.query_time * 1000,
+			stats.render_time * 1000, stats.markdown_time * 1000)]
+	for statement_time, statement in stats.statements or []:
+		lines.append("  {:.1f}ms: {}".format(statement_time * 1000, " ".join(statement.split())))
+	log.warning("\n".join(lines))
+
+@app.route("/metrics")
+def metrics():
+	return app.response_class(registry.render(),
+			mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,234 @@
+""" Work done in the background once a write has committed
+
+Views queue jobs by name and return without waiting for them. Where they
+run depends on JOB_QUEUE_MODE:
+
+* "thread": on a pool of JOB_THREADS threads in the same process. Jobs still
+  queued when the process exits are lost, though `manage.py serve` workers
+  wait up to JOB_DRAIN_SECONDS for them first.
+* "database": stored in the jobs table and run by `manage.py worker`, so they
+  survive restarts. A job whose worker dies is retried once its lease of
+  JOB_LEASE_SECONDS runs out, up to JOB_MAX_ATTEMPTS times.
+* "eager": straight away, before `enqueue` returns, as the tests use.
+
+Queueing a job while an identical one is still waiting does nothing, so a
+burst of edits to one entry renders it once.
+"""
+import os
+import json
+import signal
+import logging
+import datetime
+import threading
+import collections
+
+from sqlalchemy import or_
+
+from . import app
+from .database import session, Entry, Job, insert_or_ignore
+from .filters import render_markdown, make_excerpt, RENDERER_VERSION
+from .metrics import registry
+
+log = logging.getLogger(__name__)
+
+jobs_run = registry.counter("blog_jobs",
+		"Background jobs run", ["job", "outcome"])
+jobs_coalesced = registry.counter("blog_jobs_coalesced",
+		"Jobs not queued as the same job was already waiting", ["job"])
+
+registered = {}
+
+def job(func):
+	""" Make a function available to `enqueue` under its name """
+	registered[func.__name__] = func
+	return func
+
+def job_key(name, arguments):
+	return "{}:{}".format(name, json.dumps(arguments))
+
+def run(name, arguments):
+	""" Run a job, counting how it went """
+	try:
+		registered[name](*arguments)
+	except Exception:
+		session.rollback()
+		jobs_run.inc(name, "error")
+		log.exception("Job %s%r failed", name, tuple(arguments))
+		raise
+	jobs_run.inc(name, "ok")
+	registry.flush()
+
+class ThreadQueue(object):
+	""" Runs jobs on a pool of daemon threads in this process """
+	def __init__(self, threads):
+		self.threads = threads
+		self.pid = os.getpid()
+		self.jobs = collections.deque()
+		# Keys of the jobs queued but not yet started
+		self.waiting = set()
+		self.unfinished = 0
+		self.condition = threading.Condition()
+		self.workers = []
+	
+	def put(self, name, arguments):
+		key = job_key(name, arguments)
+		with self.condition:
+			if key in self.waiting:
+				return False
+			self.waiting.add(key)
+			self.jobs.append((key, name, arguments))
+			self.unfinished += 1
+			if not self.workers:
+				self.start()
+			self.condition.notify_all()
+		return True
+	
+	def start(self):
+		for i in range(self.threads):
+			thread = threading.Thread(target=self.work, daemon=True,
+					name="jobs-{}".format(i))
+			thread.start()
+			self.workers.append(thread)
+	
+	def work(self):
+		while True:
+			with self.condition:
+				while not self.jobs:
+					self.condition.wait()
+				key, name, arguments = self.jobs.popleft()
+				# The same job queued from now on has to run again
+				self.waiting.discard(key)
+			try:
+				with app.app_context():
+					run(name, arguments)
+			except Exception:
+				pass
+			finally:
+				with self.condition:
+					self.unfinished -= 1
+					self.condition.notify_all()
+	
+	def drain(self, timeout):
+		""" Wait up to `timeout` seconds for every queued job to finish """
+		with self.condition:
+			return self.condition.wait_for(lambda: not self.unfinished, timeout)
+
+pool = None
+pool_lock = threading.Lock()
+
+def get_pool():
+	global pool
+	with pool_lock:
+		# Threads don't survive a fork, so each worker process has its own
+		if pool is None or pool.pid != os.getpid():
+			pool = ThreadQueue(app.config.get("JOB_THREADS", 2))
+	return pool
+
+def drain():
+	""" Give this process's queued jobs JOB_DRAIN_SECONDS to finish, before exiting """
+	if pool is None or pool.pid != os.getpid():
+		return True
+	return pool.drain(app.config.get("JOB_DRAIN_SECONDS", 10))
+
+def store(name, arguments):
+	""" Save a job for `manage.py worker`, unless the same one is waiting """
+	insert = insert_or_ignore(Job.__table__, name=name,
+			arguments=json.dumps(arguments), key=job_key(name, arguments),
+			created=datetime.datetime.now(), attempts=0)
+	stored = session.execute(insert).rowcount
+	session.commit()
+	return bool(stored)
+
+def enqueue(name, *arguments):
+	""" Run a job in the background, unless the same job is already waiting """
+	if name not in registered:
+		raise ValueError("Unknown job {!r}".format(name))
+	arguments = list(arguments)
+	mode = app.config.get("JOB_QUEUE_MODE", "thread")
+	if mode == "eager":
+		run(name, arguments)
+		return True
+	if mode == "database":
+		queued = store(name, arguments)
+	elif mode == "thread":
+		queued = get_pool().put(name, arguments)
+	else:
+		raise ValueError("Unknown JOB_QUEUE_MODE {!r}".format(mode))
+	if not queued:
+		jobs_coalesced.inc(name)
+	return queued
+
+def claim():
+	""" Take the oldest job that is waiting, or whose worker has gone quiet """
+	now = datetime.datetime.now()
+	lease = datetime.timedelta(seconds=app.config.get("JOB_LEASE_SECONDS", 300))
+	available = or_(Job.claimed == None, Job.claimed < now - lease)
+	for id, in session.query(Job.id).filter(available).order_by(Job.id).limit(10).all():
+		# Only one worker's update can match, however many try at once
+		taken = session.query(Job).filter(Job.id == id, available).update(
+				{Job.claimed: now, Job.attempts: Job.attempts + 1},
+				synchronize_session=False)
+		session.commit()
+		if taken:
+			return session.query(Job).get(id)
+	session.commit()
+	return None
+
+def work_stored(stopping, poll=1):
+	""" Run stored jobs one at a time until `stopping` is set """
+	while not stopping.is_set():
+		with app.app_context():
+			stored = claim()
+			if stored is None:
+				stopping.wait(poll)
+				continue
+			id, name, attempts = stored.id, stored.name, stored.attempts
+			arguments = json.loads(stored.arguments)
+			if attempts > app.config.get("JOB_MAX_ATTEMPTS", 3):
+				log.error("Giving up on job %s%r after %d attempts", name,
+						tuple(arguments), attempts - 1)
+			else:
+				try:
+					run(name, arguments)
+				except Exception:
+					# Left claimed, so it is retried when the lease runs out
+					continue
+			session.query(Job).filter_by(id=id).delete()
+			session.commit()
+
+def run_worker(threads=None, poll=1):
+	""" Run stored jobs on a pool of threads until SIGTERM or SIGINT """
+	threads = threads or app.config.get("JOB_THREADS", 2)
+	stopping = threading.Event()
+	def stop(*args):
+		log.info("Stopping once the running jobs finish")
+		stopping.set()
+	signal.signal(signal.SIGTERM, stop)
+	signal.signal(signal.SIGINT, stop)
+	workers = [threading.Thread(target=work_stored, args=(stopping, poll),
+			name="jobs-{}".format(i)) for i in range(threads)]
+	for worker in workers:
+		worker.start()
+	log.info("Running jobs on %d threads", threads)
+	for worker in workers:
+		# With a timeout, so that signals are still handled while waiting
+		while worker.is_alive():
+			worker.join(0.5)
+
+@job
+def render_entry(id):
+	""" Store an entry's rendered HTML and excerpt """
+	row = session.query(Entry.content).filter(Entry.id == id).first()
+	if row is None:
+		# Deleted since
+		return
+	html = render_markdown(row.content or "")
+	excerpt, truncated = make_excerpt(html)
+	# An edit made meanwhile queued a render of its own, so leave it to that
+	session.query(Entry).filter(Entry.id == id, Entry.content == row.content).update({
+		Entry.content_html: html,
+		Entry.excerpt_html: excerpt,
+		Entry.excerpt_truncated: truncated,
+		Entry.render_version: RENDERER_VERSION,
+	}, synchronize_session=False)
+	session.commit()
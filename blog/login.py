@@ -1,7 +1,10 @@
-from flask_login import LoginManager
+from flask_login import LoginManager, UserMixin
+from sqlalchemy import event
 
 from . import app
-from .database import session, User
+from .cache import TTLCache
+from .database import session, User, reading
+from .metrics import registry
 
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -9,6 +12,42 @@ login_manager.init_app(app)
 login_manager.login_view = "login_get"
 login_manager.login_message_category = "danger"
 
+class CachedUser(UserMixin):
+	""" The user fields needed on every request, detached from the database """
+	def __init__(self, id, name, email):
+		self.id = id
+		self.name = name
+		self.email = email
+
+# Other worker processes can't see our invalidations, so entries also expire
+user_cache = TTLCache(1024, 300)
+user_cache_hits = registry.counter("blog_user_cache_hits",
+		"Logged in users found in the user cache")
+user_cache_misses = registry.counter("blog_user_cache_misses",
+		"Logged in users loaded from the database")
+
+def init_app(app):
+	user_cache.size = app.config.get("USER_CACHE_SIZE", 1024)
+	user_cache.ttl = app.config.get("USER_CACHE_TTL", 300)
+	user_cache.clear()
+
 @login_manager.user_loader
 def load_user(id):
-	return session.query(User).get(int(id))
+	user = user_cache.get(int(id))
+	if user is None:
+		user_cache_misses.inc()
+		with reading():
+			user = session.query(User).get(int(id))
+		if user is None:
+			return None
+		user = CachedUser(user.id, user.name, user.email)
+		user_cache.set(user.id, user)
+	else:
+		user_cache_hits.inc()
+	return user
+
+@event.listens_for(User, "after_insert")
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def invalidate_user(mapper, connection, target):
+	user_cache.delete(target.id)
@@ -0,0 +1,219 @@
+""" Counters and histograms exposed in the Prometheus text format
+
+Each process keeps its own metrics in memory. With several worker processes,
+set METRICS_DIR to a directory they share: every worker writes a snapshot
+there at most once every METRICS_FLUSH_SECONDS, and /metrics adds them all up.
+The snapshots of workers that have exited are folded into a single file.
+"""
+import os
+import json
+import time
+import bisect
+import tempfile
+import threading
+
+# Prometheus' default latency buckets, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# The counts of every worker that has exited, in METRICS_DIR
+RETIRED = "retired.json"
+
+class Metric(object):
+	type = None
+	
+	def __init__(self, name, help, labels=()):
+		self.name = name
+		self.help = help
+		self.labels = tuple(labels)
+		self.values = {}
+		self.lock = threading.Lock()
+	
+	def clear(self):
+		with self.lock:
+			self.values.clear()
+	
+	def snapshot(self):
+		with self.lock:
+			return [[list(key), self.copy(value)] for key, value in self.values.items()]
+	
+	def label_text(self, key, extra=()):
+		pairs = list(zip(self.labels, key)) + list(extra)
+		if not pairs:
+			return ""
+		return "{" + ",".join('{}="{}"'.format(name, escape(value))
+				for name, value in pairs) + "}"
+	
+	def render(self, values):
+		lines = ["# HELP {} {}".format(self.name, self.help),
+				"# TYPE {} {}".format(self.name, self.type)]
+		for key in sorted(values):
+			lines.extend(self.render_value(key, values[key]))
+		return lines
+
+class Counter(Metric):
+	""" A count that only goes up """
+	type = "counter"
+	
+	def inc(self, *labels, amount=1):
+		with self.lock:
+			self.values[labels] = self.values.get(labels, 0) + amount
+	
+	def total(self):
+		with self.lock:
+			return sum(self.values.values())
+	
+	def copy(self, value):
+		return value
+	
+	def merge(self, value, other):
+		return (value or 0) + other
+	
+	def render_value(self, key, value):
+		yield "{}_total{} {}".format(self.name, self.label_text(key), number(value))
+
+class Histogram(Metric):
+	""" Observations counted into cumulative buckets, with their sum """
+	type = "histogram"
+	
+	def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+		super().__init__(name, help, labels)
+		self.buckets = tuple(buckets)
+	
+	def observe(self, value, *labels):
+		index = bisect.bisect_left(self.buckets, value)
+		with self.lock:
+			counts = self.values.get(labels)
+			if counts is None:
+				# One count per bucket plus +Inf, then the sum
+				counts = self.values[labels] = [0] * (len(self.buckets) + 2)
+			counts[index] += 1
+			counts[-1] += value
+	
+	def copy(self, value):
+		return list(value)
+	
+	def merge(self, value, other):
+		if value is None:
+			return list(other)
+		return [a + b for a, b in zip(value, other)]
+	
+	def render_value(self, key, counts):
+		cumulative = 0
+		for bound, count in zip(self.buckets + ("+Inf",), counts):
+			cumulative += count
+			yield "{}_bucket{} {}".format(self.name,
+					self.label_text(key, [("le", number(bound))]), cumulative)
+		yield "{}_sum{} {}".format(self.name, self.label_text(key), number(counts[-1]))
+		yield "{}_count{} {}".format(self.name, self.label_text(key), cumulative)
+
+class Registry(object):
+	def __init__(self):
+		self.metrics = []
+		self.directory = None
+		self.flush_interval = 1
+		self.flushed = 0
+	
+	def register(self, metric):
+		self.metrics.append(metric)
+		return metric
+	
+	def counter(self, name, help, labels=()):
+		return self.register(Counter(name, help, labels))
+	
+	def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+		return self.register(Histogram(name, help, labels, buckets))
+	
+	def clear(self):
+		for metric in self.metrics:
+			metric.clear()
+	
+	def snapshot(self):
+		return {metric.name: metric.snapshot() for metric in self.metrics}
+	
+	def flush(self, force=False):
+		""" Write this process's snapshot to the shared directory, if there is one """
+		if self.directory is None:
+			return
+		now = time.monotonic()
+		if not force and now - self.flushed < self.flush_interval:
+			return
+		self.flushed = now
+		self.write("{}.json".format(os.getpid()), self.snapshot())
+	
+	def write(self, name, snapshot):
+		fd, temp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+		with os.fdopen(fd, "w") as f:
+			json.dump(snapshot, f)
+		os.replace(temp, os.path.join(self.directory, name))
+	
+	def read(self, name):
+		try:
+			with open(os.path.join(self.directory, name)) as f:
+				return json.load(f)
+		except (OSError, ValueError):
+			return None
+	
+	def retire(self, pid):
+		""" Fold an exited process's snapshot into those of the processes before it
+		
+		So that replacing workers doesn't leave ever more files to read.
+		"""
+		if self.directory is None:
+			return
+		snapshot = self.read("{}.json".format(pid))
+		if snapshot is None:
+			return
+		retired = self.read(RETIRED) or {}
+		merged = self.merge([retired, snapshot])
+		self.write(RETIRED, {name: [[list(key), value] for key, value in values.items()]
+				for name, values in merged.items()})
+		os.remove(os.path.join(self.directory, "{}.json".format(pid)))
+	
+	def remove_snapshots(self):
+		""" Forget the snapshots of earlier processes, e.g. when a server starts """
+		if self.directory is None:
+			return
+		for name in os.listdir(self.directory):
+			if name.endswith(".json"):
+				os.remove(os.path.join(self.directory, name))
+	
+	def snapshots(self):
+		if self.directory is None:
+			return [self.snapshot()]
+		self.flush(force=True)
+		snapshots = []
+		for name in os.listdir(self.directory):
+			if not name.endswith(".json"):
+				continue
+			snapshot = self.read(name)
+			if snapshot is not None:
+				snapshots.append(snapshot)
+		return snapshots
+	
+	def merge(self, snapshots):
+		""" Add up snapshots, giving each metric's values by their labels """
+		merged = {}
+		for metric in self.metrics:
+			values = merged[metric.name] = {}
+			for snapshot in snapshots:
+				for key, value in snapshot.get(metric.name, []):
+					key = tuple(key)
+					values[key] = metric.merge(values.get(key), value)
+		return merged
+	
+	def render(self):
+		""" Every metric in the Prometheus text exposition format """
+		merged = self.merge(self.snapshots())
+		lines = []
+		for metric in self.metrics:
+			lines.extend(metric.render(merged[metric.name]))
+		return "\n".join(lines) + "\n"
+
+def escape(value):
+	return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def number(value):
+	if isinstance(value, str):
+		return value
+	return repr(float(value)) if isinstance(value, float) else str(value)
+
+registry = Registry()
@@ -0,0 +1,96 @@
+import hashlib
+import functools
+from urllib.parse import urlencode
+
+from flask import request, session as http_session, make_response
+from flask_login import current_user
+
+from . import app
+from . import counters
+from .cache import make_cache, LRUCache
+
+page_cache = None
+# The ids either side of each entry, keyed by generation and entry id. Adding
+# or removing an entry bumps the generation, which moves every entry's
+# neighbours to fresh keys.
+neighbour_cache = LRUCache(4096)
+
+def init_app(app):
+	global page_cache
+	page_cache = make_cache(app.config.get("PAGE_CACHE_BACKEND", "memory"),
+			size=app.config.get("PAGE_CACHE_SIZE", 512),
+			directory=app.config.get("PAGE_CACHE_DIR"))
+	neighbour_cache.size = app.config.get("NEIGHBOUR_CACHE_SIZE", 4096)
+	neighbour_cache.clear()
+
+def invalidate():
+	""" Drop this process's cached pages; other processes see the new generation """
+	counters.generation_cache.clear()
+	counters.month_cache.clear()
+	neighbour_cache.clear()
+	if page_cache is not None:
+		page_cache.clear()
+
+def not_modified(etag, updated):
+	if request.if_none_match:
+		# Weak, as compressed pages carry a weak copy of the ETag
+		return request.if_none_match.contains_weak(etag)
+	if request.if_modified_since and updated:
+		return updated.replace(microsecond=0) <= request.if_modified_since.replace(tzinfo=None)
+	return False
+
+def tee(chunks, key, mimetype):
+	""" Pass a streamed body through, caching it once it has all been sent """
+	body = []
+	for chunk in chunks:
+		body.append(chunk if isinstance(chunk, str) else chunk.decode("utf-8"))
+		yield chunk
+	page_cache.set(key, "{}\n{}".format(mimetype, "".join(body)))
+
+def cached_page(view):
+	""" Serve a read-only page from the page cache, with conditional GET
+	
+	Pages are keyed by the content generation, path, query arguments and
+	logged in user, and carry an ETag built from the same key.
+	"""
+	@functools.wraps(view)
+	def wrapper(*args, **kwargs):
+		# Flashed messages belong to a single visitor, so render those fresh
+		if "_flashes" in http_session:
+			return view(*args, **kwargs)
+		
+		generation, updated = counters.generation()
+		user = current_user.get_id() if current_user.is_authenticated else ""
+		key = "{}:{}?{}:{}".format(generation, request.path,
+				urlencode(sorted(request.args.items(multi=True))), user)
+		etag = hashlib.sha1(key.encode("utf-8")).hexdigest()
+		
+		if not_modified(etag, updated):
+			response = app.response_class(status=304)
+		else:
+			cached = page_cache.get(key) if page_cache is not None else None
+			if cached is not None:
+				mimetype, body = cached.split("\n", 1)
+				response = make_response(body)
+				response.mimetype = mimetype
+			else:
+				response = make_response(view(*args, **kwargs))
+				if response.status_code != 200:
+					return response
+				if page_cache is not None and response.is_streamed:
+					response.response = tee(response.response, key, response.mimetype)
+				elif page_cache is not None:
+					page_cache.set(key, "{}\n{}".format(response.mimetype,
+							response.get_data(as_text=True)))
+		
+		response.set_etag(etag)
+		response.last_modified = updated
+		response.cache_control.must_revalidate = True
+		response.cache_control.max_age = 0
+		if user:
+			response.cache_control.private = True
+		else:
+			response.cache_control.public = True
+		response.vary.add("Cookie")
+		return response
+	return wrapper
@@ -0,0 +1,123 @@
+import datetime
+
+from sqlalchemy import tuple_
+from sqlalchemy.orm import aliased
+
+from .database import Entry
+
+CURSOR_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+def encode_cursor(entry):
+	return "{},{}".format(entry.datetime.strftime(CURSOR_FORMAT), entry.id)
+
+def decode_cursor(cursor):
+	""" Parse a "<datetime>,<id>" cursor, returning None if it is malformed """
+	if not cursor:
+		return None
+	try:
+		stamp, id = cursor.rsplit(",", 1)
+		return datetime.datetime.strptime(stamp, CURSOR_FORMAT), int(id)
+	except ValueError:
+		return None
+
+# Row value comparisons let both Postgres and SQLite seek straight to a
+# position in the (datetime, id) index; the equivalent OR of two conditions
+# makes SQLite scan the index from one end.
+def older_than(stamp, id, entry=Entry):
+	return tuple_(entry.datetime, entry.id) < tuple_(stamp, id)
+
+def newer_than(stamp, id, entry=Entry):
+	return tuple_(entry.datetime, entry.id) > tuple_(stamp, id)
+
+def keyset(query, before=None, after=None, limit=10):
+	""" Fetch one page of entries, newest first, by seeking on (datetime, id)
+	
+	Returns the entries along with whether there are older and newer pages.
+	Fetching one extra row tells us if there is another page in the direction
+	we are moving without having to count anything.
+	"""
+	if after is not None:
+		stamp, id = after
+		query = query.filter(newer_than(stamp, id))
+		query = query.order_by(Entry.datetime.asc(), Entry.id.asc())
+		rows = query.limit(limit + 1).all()
+		has_newer = len(rows) > limit
+		return rows[:limit][::-1], True, has_newer
+	
+	if before is not None:
+		stamp, id = before
+		query = query.filter(older_than(stamp, id))
+	query = query.order_by(Entry.datetime.desc(), Entry.id.desc())
+	rows = query.limit(limit + 1).all()
+	has_older = len(rows) > limit
+	return rows[:limit], has_older, before is not None
+
+class Page(object):
+	""" A page of entries read from the database while it is being rendered
+	
+	`rows` should hold up to `limit` + 1 entries in display order; the extra
+	one only tells us there is an older page. The links to the pages either
+	side are known once the entries have been iterated over.
+	"""
+	def __init__(self, rows, limit, url, has_older=False, has_newer=False):
+		self.rows = rows
+		self.limit = limit
+		self.url = url
+		self.has_older = has_older
+		self.has_newer = has_newer
+		self.first = self.last = None
+	
+	def __iter__(self):
+		# Read every row rather than stopping early, so the cursor is finished
+		# with and closed
+		for count, entry in enumerate(self.rows):
+			if count == self.limit:
+				self.has_older = True
+				continue
+			if self.first is None:
+				self.first = entry
+			self.last = entry
+			yield entry
+	
+	@property
+	def older_url(self):
+		if self.last is not None and self.has_older:
+			return self.url(before=encode_cursor(self.last))
+	
+	@property
+	def newer_url(self):
+		if self.first is not None and self.has_newer:
+			return self.url(after=encode_cursor(self.first))
+
+def keyset_page(query, url, before=None, after=None, limit=10, batch=20):
+	""" Like keyset, but the entries are streamed from the database as a Page
+	
+	Pages after a cursor are fetched oldest first and so are read in full.
+	"""
+	if after is not None:
+		rows, has_older, has_newer = keyset(query, before, after, limit)
+		return Page(rows, limit, url, has_older, has_newer)
+	if before is not None:
+		stamp, id = before
+		query = query.filter(older_than(stamp, id))
+	query = query.order_by(Entry.datetime.desc(), Entry.id.desc())
+	rows = query.limit(limit + 1).yield_per(batch)
+	return Page(rows, limit, url, has_newer=before is not None)
+
+def with_neighbours(query):
+	""" Add the ids of the entries either side of each entry to a query
+	
+	Each is a correlated subquery that seeks one step through the
+	(datetime, id) index, so an entry and its neighbours take one query.
+	"""
+	other = aliased(Entry)
+	older = query.session.query(other.id)
+	older = older.filter(older_than(Entry.datetime, Entry.id, other))
+	older = older.order_by(other.datetime.desc(), other.id.desc()).limit(1)
+	newer = query.session.query(other.id)
+	newer = newer.filter(newer_than(Entry.datetime, Entry.id, other))
+	newer = newer.order_by(other.datetime.asc(), other.id.asc()).limit(1)
+	return query.add_columns(
+		older.correlate(Entry).as_scalar().label("older_id"),
+		newer.correlate(Entry).as_scalar().label("newer_id"),
+	)
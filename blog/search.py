@@ -0,0 +1,135 @@
+import re
+
+from sqlalchemy import event, func, select, and_, or_, literal_column
+from sqlalchemy import inspect, Table, MetaData, Column, Integer, Text
+from sqlalchemy.dialects.postgresql import TSVECTOR
+
+from .database import Session, session, Entry, EXCERPT_OPTIONS, load_text
+
+# The SQLite FTS5 index. It is created by DDL in blog.database, not by
+# create_all, so it lives in its own MetaData.
+fts = Table("entries_fts", MetaData(),
+	Column("rowid", Integer),
+	Column("title", Text),
+	Column("content", Text),
+)
+
+# The entries table as Postgres search sees it. Its search_vector column is
+# also added by DDL, and only there, so it isn't part of the Entry model.
+vectors = Table("entries", MetaData(),
+	Column("id", Integer, primary_key=True),
+	Column("title", Text),
+	Column("content", Text),
+	Column("search_vector", TSVECTOR),
+)
+
+def document(entry):
+	return "{} {}".format(entry.title or "", entry.content or "")
+
+def index_entries(connection, entries):
+	dialect = connection.dialect.name
+	for entry in entries:
+		if dialect == "postgresql":
+			connection.execute(vectors.update()
+				.where(vectors.c.id == entry.id)
+				.values(search_vector=func.to_tsvector("english", document(entry))))
+		elif dialect == "sqlite":
+			connection.execute(fts.delete().where(fts.c.rowid == entry.id))
+			connection.execute(fts.insert().values(rowid=entry.id,
+					title=entry.title or "", content=entry.content or ""))
+
+def unindex_entries(connection, ids):
+	# On Postgres the search vector goes with the row
+	if ids and connection.dialect.name == "sqlite":
+		connection.execute(fts.delete().where(fts.c.rowid.in_(ids)))
+
+def changed(entry):
+	state = inspect(entry)
+	return (state.attrs.title.history.has_changes()
+			or state.attrs.content.history.has_changes())
+
+@event.listens_for(Session, "after_flush")
+def update_search_index(db_session, flush_context):
+	""" Keep the search index in the same transaction as the entries it indexes """
+	entries = [obj for obj in db_session.new if isinstance(obj, Entry)]
+	entries += [obj for obj in db_session.dirty
+			if isinstance(obj, Entry) and changed(obj)]
+	deleted = [obj.id for obj in db_session.deleted if isinstance(obj, Entry)]
+	if entries or deleted:
+		connection = db_session.connection()
+		index_entries(connection, entries)
+		unindex_entries(connection, deleted)
+
+def rebuild():
+	""" Re-index every entry, for rows written without going through the ORM """
+	connection = session.connection()
+	if connection.dialect.name == "postgresql":
+		title = func.coalesce(vectors.c.title, "")
+		content = func.coalesce(vectors.c.content, "")
+		result = connection.execute(vectors.update().values(
+				search_vector=func.to_tsvector("english", title + " " + content)))
+	elif connection.dialect.name == "sqlite":
+		entries = Entry.__table__
+		title = func.coalesce(entries.c.title, "")
+		content = func.coalesce(entries.c.content, "")
+		connection.execute(fts.delete())
+		result = connection.execute(fts.insert().from_select(
+				["rowid", "title", "content"],
+				select([entries.c.id, title, content])))
+	session.commit()
+	return result.rowcount
+
+def encode_cursor(entry, score):
+	return "{!r},{}".format(score, entry.id)
+
+def decode_cursor(cursor):
+	""" Parse a "<score>,<id>" cursor, returning None if it is malformed """
+	if not cursor:
+		return None
+	try:
+		score, id = cursor.rsplit(",", 1)
+		return float(score), int(id)
+	except ValueError:
+		return None
+
+def fts_query(q):
+	# Quote every word so that FTS5 treats none of it as query syntax
+	return " ".join('"{}"'.format(word) for word in re.findall(r"\w+", q))
+
+def search(q, after=None, limit=10):
+	""" Ranked full text search over entry titles and content
+	
+	Returns (entry, score) pairs, best match first, and whether there are
+	more results. Results are paged by seeking on (score, id).
+	"""
+	dialect = session.get_bind().dialect.name
+	if dialect == "postgresql":
+		query = func.plainto_tsquery("english", q)
+		hits = select([
+			vectors.c.id.label("id"),
+			func.ts_rank(vectors.c.search_vector, query).label("score"),
+		]).where(vectors.c.search_vector.op("@@")(query))
+	elif dialect == "sqlite":
+		q = fts_query(q)
+		if not q:
+			return [], False
+		# bm25 scores better matches lower, so flip it to sort like ts_rank
+		hits = select([
+			fts.c.rowid.label("id"),
+			(-func.bm25(literal_column("entries_fts"))).label("score"),
+		]).where(literal_column("entries_fts").match(q))
+	else:
+		raise NotImplementedError("Search is not supported on {}".format(dialect))
+	hits = hits.alias("hits")
+	
+	results = session.query(Entry, hits.c.score)
+	results = results.join(hits, hits.c.id == Entry.id)
+	results = results.options(*EXCERPT_OPTIONS)
+	if after is not None:
+		score, id = after
+		results = results.filter(or_(hits.c.score < score,
+				and_(hits.c.score == score, Entry.id < id)))
+	results = results.order_by(hits.c.score.desc(), Entry.id.desc())
+	rows = results.limit(limit + 1).all()
+	load_text([entry for entry, score in rows[:limit]])
+	return rows[:limit], len(rows) > limit
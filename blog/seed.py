@@ -0,0 +1,135 @@
+import io
+import random
+import datetime
+
+from werkzeug.security import generate_password_hash
+
+from .database import session, Entry, User
+from .filters import render_markdown, make_excerpt, RENDERER_VERSION
+from . import counters
+from . import search
+
+WORDS = """lorem ipsum dolor sit amet consectetur adipisicing elit sed do eiusmod
+tempor incididunt ut labore et dolore magna aliqua enim ad minim veniam quis
+nostrud exercitation ullamco laboris nisi aliquip ex ea commodo consequat duis
+aute irure in reprehenderit voluptate velit esse cillum eu fugiat nulla
+pariatur excepteur sint occaecat cupidatat non proident sunt culpa qui officia
+deserunt mollit anim id est laborum""".split()
+
+def sentence(rng, low=6, high=16):
+	words = [rng.choice(WORDS) for i in range(rng.randint(low, high))]
+	return " ".join(words).capitalize() + "."
+
+def paragraph(rng):
+	text = " ".join(sentence(rng) for i in range(rng.randint(2, 6)))
+	# Sprinkle in some inline markup
+	words = text.split(" ")
+	for i in range(rng.randint(0, 3)):
+		index = rng.randrange(len(words))
+		words[index] = rng.choice(["*{}*", "**{}**", "`{}`",
+				"[{}](http://example.com/)"]).format(words[index])
+	return " ".join(words)
+
+def markdown_document(rng):
+	""" A post of a few hundred words to a few thousand, in varied markdown """
+	blocks = []
+	for i in range(rng.randint(1, 12)):
+		kind = rng.random()
+		if kind < 0.6:
+			blocks.append(paragraph(rng))
+		elif kind < 0.7:
+			blocks.append("## " + sentence(rng, 2, 6).rstrip("."))
+		elif kind < 0.8:
+			blocks.append("\n".join("* " + sentence(rng, 3, 8)
+					for i in range(rng.randint(2, 6))))
+		elif kind < 0.9:
+			blocks.append("> " + sentence(rng))
+		else:
+			blocks.append("```\n" + "\n".join("    ".join(rng.sample(WORDS, 3))
+					for i in range(rng.randint(2, 8))) + "\n```")
+	return "\n\n".join(blocks)
+
+def add_users(count, rng):
+	""" Insert seed users, all with the password "password" """
+	first = (session.query(User.id).order_by(User.id.desc()).limit(1).scalar() or 0) + 1
+	password = generate_password_hash("password")
+	rows = [{
+		"name": "{} {}".format(rng.choice(WORDS), rng.choice(WORDS)).title(),
+		"email": "seed{}@example.com".format(first + i),
+		"password": password,
+	} for i in range(count)]
+	if rows:
+		session.execute(User.__table__.insert(), rows)
+		session.commit()
+	return [id for id, in session.query(User.id).filter(
+			User.email.in_(row["email"] for row in rows))]
+
+def copy_value(value):
+	""" A value in COPY's text format, where NULL is \\N and so unlike "" """
+	if value is None:
+		return "\\N"
+	return (str(value).replace("\\", "\\\\").replace("\t", "\\t")
+			.replace("\n", "\\n").replace("\r", "\\r"))
+
+def copy_rows(columns, rows):
+	""" Load a batch of entries with COPY, much faster than INSERT on Postgres """
+	buffer = io.StringIO()
+	for row in rows:
+		buffer.write("\t".join(copy_value(row[column]) for column in columns) + "\n")
+	buffer.seek(0)
+	cursor = session.connection().connection.cursor()
+	cursor.copy_expert("COPY entries ({}) FROM STDIN".format(", ".join(columns)),
+			buffer)
+
+def add_entries(count, author_ids, batch=5000, render=True, rng=None,
+		progress=None):
+	""" Bulk insert generated entries, spread evenly over the past few years """
+	rng = rng or random.Random()
+	columns = ["title", "content", "content_html", "excerpt_html",
+			"excerpt_truncated", "render_version", "datetime", "author_id"]
+	now = datetime.datetime.now()
+	step = datetime.timedelta(days=3 * 365) / max(count, 1)
+	postgres = session.get_bind().dialect.name == "postgresql"
+	
+	done = 0
+	while done < count:
+		rows = []
+		for i in range(done, min(done + batch, count)):
+			content = markdown_document(rng)
+			html = excerpt = truncated = None
+			if render:
+				html = render_markdown(content)
+				excerpt, truncated = make_excerpt(html)
+			rows.append({
+				"title": sentence(rng, 2, 8).rstrip("."),
+				"content": content,
+				"content_html": html,
+				"excerpt_html": excerpt,
+				"excerpt_truncated": truncated,
+				"render_version": RENDERER_VERSION if render else None,
+				"datetime": now - step * (count - i),
+				"author_id": rng.choice(author_ids) if author_ids else None,
+			})
+		if postgres:
+			copy_rows(columns, rows)
+		else:
+			session.execute(Entry.__table__.insert(), rows)
+		session.commit()
+		done += len(rows)
+		if progress:
+			progress(done)
+	
+	catch_up()
+	return done
+
+def catch_up():
+	""" Rebuild the search index and counters after inserting rows in bulk
+	
+	Core inserts skip the ORM hooks that keep these up to date.
+	"""
+	search.rebuild()
+	counters.reconcile(counters.ENTRY_COUNT, counters.count_entries)
+	counters.reconcile_authors()
+	counters.reconcile_months()
+	counters.touch()
+	session.commit()
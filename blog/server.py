@@ -0,0 +1,236 @@
+""" A pre-forking, multi-threaded HTTP server for production use
+
+The master process binds the listening socket and forks a fixed number of
+worker processes, each serving requests from a bounded pool of threads.
+Workers are replaced when they exit, including after serving their share of
+requests. SIGTERM or SIGINT shuts everything down gracefully and SIGHUP
+recycles every worker. Run it with `manage.py serve`.
+"""
+import os
+import time
+import random
+import select
+import signal
+import socket
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import WSGIRequestHandler
+
+from . import jobs
+from .metrics import registry
+
+log = logging.getLogger(__name__)
+
+def warm_up(app):
+	""" Compile every template once, so that forked workers share the result """
+	for name in app.jinja_env.list_templates():
+		app.jinja_env.get_template(name)
+
+class RequestHandler(WSGIRequestHandler):
+	# HTTP/1.1 keeps connections alive between requests
+	protocol_version = "HTTP/1.1"
+	
+	def setup(self):
+		# Idle keep-alive connections are closed after this many seconds
+		self.timeout = self.server.keepalive
+		WSGIRequestHandler.setup(self)
+	
+	def handle_one_request(self):
+		WSGIRequestHandler.handle_one_request(self)
+		if self.server.stopping:
+			self.close_connection = True
+
+class Worker(object):
+	""" Serves connections from an inherited listening socket on a thread pool """
+	multithread = True
+	multiprocess = True
+	passthrough_errors = False
+	ssl_context = None
+	shutdown_signal = False
+	
+	def __init__(self, sock, app, threads, max_requests, keepalive):
+		self.socket = sock
+		self.server_address = sock.getsockname()[:2]
+		self.app = self.count_requests(app)
+		self.threads = threads
+		self.max_requests = max_requests
+		self.keepalive = keepalive
+		self.requests = 0
+		self.lock = threading.Lock()
+		self.stopping = False
+	
+	def count_requests(self, app):
+		def wrapper(environ, start_response):
+			with self.lock:
+				self.requests += 1
+				if self.max_requests and self.requests >= self.max_requests:
+					self.stopping = True
+			return app(environ, start_response)
+		return wrapper
+	
+	def log(self, type, message, *args):
+		getattr(log, type)(message, *args)
+	
+	def handle(self, connection, address):
+		try:
+			RequestHandler(connection, address, self)
+		except Exception:
+			log.exception("Error handling connection from %s", address)
+		finally:
+			try:
+				connection.close()
+			except OSError:
+				pass
+	
+	def stop(self, *args):
+		self.stopping = True
+	
+	def serve(self):
+		signal.signal(signal.SIGTERM, self.stop)
+		signal.signal(signal.SIGINT, self.stop)
+		signal.signal(signal.SIGHUP, self.stop)
+		executor = ThreadPoolExecutor(self.threads)
+		slots = threading.BoundedSemaphore(self.threads)
+		while not self.stopping:
+			try:
+				ready, _, _ = select.select([self.socket], [], [], 0.5)
+			except InterruptedError:
+				continue
+			# Don't accept more connections than there are free threads; the
+			# rest wait in the listen backlog where another worker can take them
+			if not ready or not slots.acquire(timeout=0.5):
+				continue
+			if self.stopping:
+				slots.release()
+				break
+			try:
+				connection, address = self.socket.accept()
+			except (BlockingIOError, InterruptedError):
+				# Another worker got there first
+				slots.release()
+				continue
+			connection.setblocking(True)
+			future = executor.submit(self.handle, connection, address)
+			future.add_done_callback(lambda future: slots.release())
+		# Let in-flight requests finish before exiting
+		executor.shutdown(wait=True)
+
+class Server(object):
+	def __init__(self, app, host="0.0.0.0", port=8080, workers=None,
+			threads=8, backlog=2048, max_requests=0, max_requests_jitter=0,
+			keepalive=5, warm_templates=True):
+		self.app = app
+		self.host = host
+		self.port = port
+		self.workers = workers or os.cpu_count() or 1
+		self.threads = threads
+		self.backlog = backlog
+		self.max_requests = max_requests
+		self.max_requests_jitter = max_requests_jitter
+		self.keepalive = keepalive
+		self.warm_templates = warm_templates
+		self.children = {}
+		self.stopping = False
+	
+	@classmethod
+	def from_config(cls, app, **overrides):
+		config = app.config
+		options = dict(
+			workers=config.get("SERVER_WORKERS"),
+			threads=config.get("SERVER_THREADS", 8),
+			backlog=config.get("SERVER_BACKLOG", 2048),
+			max_requests=config.get("SERVER_MAX_REQUESTS", 0),
+			max_requests_jitter=config.get("SERVER_MAX_REQUESTS_JITTER", 0),
+			keepalive=config.get("SERVER_KEEPALIVE", 5),
+			warm_templates=config.get("SERVER_WARM_TEMPLATES", True),
+		)
+		options.update((key, value) for key, value in overrides.items()
+				if value is not None)
+		return cls(app, **options)
+	
+	def bind(self):
+		sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		sock.bind((self.host, self.port))
+		sock.listen(self.backlog)
+		# Workers all wait on this socket; only one wins each connection
+		sock.setblocking(False)
+		self.socket = sock
+		return sock
+	
+	def spawn(self):
+		pid = os.fork()
+		if pid:
+			self.children[pid] = time.time()
+			return pid
+		# In the worker
+		status = 0
+		try:
+			if not self.warm_templates:
+				warm_up(self.app)
+			max_requests = self.max_requests
+			if max_requests and self.max_requests_jitter:
+				# Stagger recycling so that workers don't all restart at once
+				max_requests += random.randint(0, self.max_requests_jitter)
+			Worker(self.socket, self.app, self.threads, max_requests,
+					self.keepalive).serve()
+			# Background jobs queued by its requests die with the process
+			if not jobs.drain():
+				log.warning("Worker %s exiting with jobs unfinished", os.getpid())
+			# Counted in with the other exited workers' once it is reaped
+			registry.flush(force=True)
+		except Exception:
+			log.exception("Worker %s failed", os.getpid())
+			status = 1
+		finally:
+			os._exit(status)
+	
+	def signal_children(self, signum):
+		for pid in list(self.children):
+			try:
+				os.kill(pid, signum)
+			except ProcessLookupError:
+				self.children.pop(pid, None)
+	
+	def shutdown(self, signum, frame):
+		self.stopping = True
+		self.signal_children(signal.SIGTERM)
+	
+	def recycle(self, signum, frame):
+		# Workers finish what they are doing and exit, and are then replaced
+		self.signal_children(signal.SIGTERM)
+	
+	def run(self):
+		self.bind()
+		# Counts from workers of a previous run would otherwise be added in
+		registry.remove_snapshots()
+		if self.warm_templates:
+			# Warmed up once here and shared with the workers copy-on-write.
+			# The app opens no database connections until first used.
+			warm_up(self.app)
+		signal.signal(signal.SIGTERM, self.shutdown)
+		signal.signal(signal.SIGINT, self.shutdown)
+		signal.signal(signal.SIGHUP, self.recycle)
+		log.info("Serving on %s:%s with %s workers of %s threads",
+				self.host, self.port, self.workers, self.threads)
+		
+		while True:
+			while not self.stopping and len(self.children) < self.workers:
+				self.spawn()
+			if self.stopping and not self.children:
+				break
+			try:
+				pid, status = os.wait()
+			except ChildProcessError:
+				self.children.clear()
+				continue
+			except InterruptedError:
+				continue
+			started = self.children.pop(pid, None)
+			registry.retire(pid)
+			if started is not None and status and time.time() - started < 1:
+				# Crashing on startup; don't spin
+				time.sleep(1)
+		self.socket.close()
@@ -0,0 +1,207 @@
+""" Bulk import and export of entries
+
+Imports read JSON Lines files, one entry per line, or directories of
+Markdown files with "key: value" front matter between "---" lines. Both are
+read as a stream and inserted a batch per transaction, so memory use stays
+flat however large the archive. Each batch also records how far through
+its source the import has got, in the same transaction, so an interrupted
+import carries on where it stopped when run again.
+
+Dumps write JSON Lines in the format imports read, oldest entry first.
+"""
+import os
+import json
+import hashlib
+import datetime
+import itertools
+
+from .database import session, Entry, User, ImportProgress
+from .filters import render_markdown, make_excerpt, RENDERER_VERSION
+from .seed import copy_rows, catch_up
+
+COLUMNS = ["title", "content", "content_html", "excerpt_html",
+		"excerpt_truncated", "render_version", "datetime", "author_id"]
+
+DATE_FORMATS = ["%Y-%m-%dT%H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M",
+		"%Y-%m-%d %H:%M:%S.%f", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"]
+
+def parse_datetime(value):
+	for format in DATE_FORMATS:
+		try:
+			return datetime.datetime.strptime(value.strip(), format)
+		except ValueError:
+			continue
+	raise ValueError("unrecognised date {!r}".format(value))
+
+def read_jsonl(path, skip=0):
+	""" (location, record) for each line of a JSON Lines file after the first `skip` """
+	with open(path, encoding="utf-8") as f:
+		number = 0
+		for line_number, line in enumerate(f, 1):
+			if not line.strip():
+				continue
+			number += 1
+			if number <= skip:
+				continue
+			location = "{}:{}".format(path, line_number)
+			try:
+				record = json.loads(line)
+			except ValueError as e:
+				raise ValueError("{}: {}".format(location, e))
+			yield location, record
+
+def front_matter(text):
+	""" Split a document into its front matter fields and its body """
+	lines = text.split("\n")
+	if lines[0].strip() != "---":
+		return {}, text
+	fields = {}
+	for i, line in enumerate(lines[1:], 1):
+		if line.strip() == "---":
+			return fields, "\n".join(lines[i + 1:]).lstrip("\n")
+		key, separator, value = line.partition(":")
+		if separator and key.strip():
+			fields[key.strip().lower()] = value.strip().strip("\"'")
+	# No closing line, so it wasn't front matter after all
+	return {}, text
+
+def read_markdown(directory, skip=0):
+	""" (location, record) for each .md file in a directory, by file name """
+	names = sorted(name for name in os.listdir(directory) if name.endswith(".md"))
+	for name in names[skip:]:
+		path = os.path.join(directory, name)
+		with open(path, encoding="utf-8") as f:
+			fields, content = front_matter(f.read())
+		fields.setdefault("title", os.path.splitext(name)[0])
+		fields["content"] = content
+		yield path, fields
+
+def read_source(source, skip=0):
+	if os.path.isdir(source):
+		return read_markdown(source, skip)
+	return read_jsonl(source, skip)
+
+def source_paths(source):
+	if os.path.isdir(source):
+		return [os.path.join(source, name) for name in sorted(os.listdir(source))
+				if name.endswith(".md")]
+	return [source]
+
+def source_digest(source):
+	""" A hash of everything an import reads from a source """
+	digest = hashlib.sha1()
+	for path in source_paths(source):
+		digest.update(os.path.basename(path).encode("utf-8") + b"\0")
+		with open(path, "rb") as f:
+			for block in iter(lambda: f.read(1 << 20), b""):
+				digest.update(block)
+	return digest.hexdigest()
+
+def progress_key(source):
+	""" The (path, digest) that an import's progress is recorded under
+	
+	However the source is named, and only for as long as it is unchanged.
+	"""
+	path = os.path.realpath(source)
+	if len(path) > ImportProgress.path.type.length:
+		path = hashlib.sha1(path.encode("utf-8")).hexdigest()
+	return path, source_digest(source)
+
+def entry_row(location, record, authors, render=True):
+	title = record.get("title")
+	if not title:
+		raise ValueError("{}: entry has no title".format(location))
+	content = record.get("content") or ""
+	stamp = record.get("datetime") or record.get("date")
+	try:
+		stamp = parse_datetime(stamp) if stamp else datetime.datetime.now()
+	except ValueError as e:
+		raise ValueError("{}: {}".format(location, e))
+	html = excerpt = truncated = None
+	if render:
+		html = render_markdown(content)
+		excerpt, truncated = make_excerpt(html)
+	return {
+		"title": title[:1023],
+		"content": content,
+		"content_html": html,
+		"excerpt_html": excerpt,
+		"excerpt_truncated": truncated,
+		"render_version": RENDERER_VERSION if render else None,
+		"datetime": stamp,
+		"author_id": authors.get(record.get("author")),
+	}
+
+def look_up_authors(records, authors):
+	""" Add the user ids for any new author emails in a batch to `authors` """
+	emails = {record.get("author") for location, record in records}
+	emails = [email for email in emails if email and email not in authors]
+	if emails:
+		found = dict(session.query(User.email, User.id)
+				.filter(User.email.in_(emails)))
+		for email in emails:
+			authors[email] = found.get(email)
+
+def import_entries(source, batch=500, render=True, restart=False, progress=None):
+	""" Insert the entries from a JSON Lines file or Markdown directory
+	
+	Authors are matched to users by email; entries by unknown authors are
+	imported without one. Returns counts of the entries imported, those
+	skipped as already imported, and those whose author wasn't found.
+	"""
+	path, digest = progress_key(source)
+	progress_row = session.query(ImportProgress).filter_by(path=path, digest=digest)
+	if restart:
+		progress_row.delete()
+		session.commit()
+	done = progress_row.with_entities(ImportProgress.done).scalar() or 0
+	result = {"imported": 0, "skipped": done, "unmatched": 0}
+	postgres = session.get_bind().dialect.name == "postgresql"
+	
+	records = read_source(source, skip=done)
+	authors = {}
+	while True:
+		records_batch = list(itertools.islice(records, batch))
+		if not records_batch:
+			break
+		look_up_authors(records_batch, authors)
+		rows = [entry_row(location, record, authors, render)
+				for location, record in records_batch]
+		if postgres:
+			copy_rows(COLUMNS, rows)
+		else:
+			session.execute(Entry.__table__.insert(), rows)
+		done += len(rows)
+		session.merge(ImportProgress(path=path, digest=digest, done=done,
+				updated=datetime.datetime.now()))
+		session.commit()
+		result["imported"] += len(rows)
+		result["unmatched"] += sum(1 for location, record in records_batch
+				if record.get("author") and authors[record["author"]] is None)
+		if progress:
+			progress(done)
+	
+	if result["imported"]:
+		catch_up()
+	return result
+
+def dump_entries(out, batch=1000):
+	""" Write every entry to `out` as JSON Lines, oldest first
+	
+	Rows are fetched `batch` at a time through a server-side cursor, so the
+	table is never held in memory all at once.
+	"""
+	rows = session.query(Entry.id, Entry.title, Entry.datetime, User.email,
+			Entry.content).outerjoin(User, Entry.author_id == User.id)
+	rows = rows.order_by(Entry.datetime, Entry.id)
+	count = 0
+	for id, title, stamp, email, content in rows.yield_per(batch):
+		out.write(json.dumps({
+			"id": id,
+			"title": title,
+			"datetime": stamp.isoformat() if stamp else None,
+			"author": email,
+			"content": content,
+		}, sort_keys=True) + "\n")
+		count += 1
+	return count
@@ -1,15 +1,57 @@
-from flask import render_template, request, redirect, url_for, flash
+import datetime
+import functools
+
+from flask import render_template, request, redirect, url_for, flash, make_response, abort
+from flask import session as http_session, stream_with_context
+from flask import before_render_template, template_rendered
+from sqlalchemy.orm import joinedload
 from flask_login import login_user, login_required, current_user, logout_user
 from werkzeug.security import check_password_hash
 
 from . import app
-from .database import session, Entry, User
+from . import counters
+from . import search
+from . import jobs
+from .pagecache import cached_page, invalidate, neighbour_cache
+from .database import session, Entry, User, EXCERPT_OPTIONS, with_text
+from .database import read_only, stick_to_primary
+from .instrumentation import query_stats_header
+from .pagination import keyset, keyset_page, with_neighbours, Page, decode_cursor
 
 PAGINATE_BY = 10
+# Entries fetched from the database at a time while a listing streams
+STREAM_BATCH = 20
+# Template output is sent in chunks of at least this many characters
+STREAM_CHUNK_SIZE = 1024
 
-@app.route("/")
-@app.route("/page/<int:page>")
-def entries(page=1):
+def stream_template(name, **context):
+	""" Render a template as a streamed response, sending each part as it's ready """
+	# Flashed messages are popped from the session as they're shown, and the
+	# session cookie has to be set before the body is sent. Likewise the
+	# query stats header, which needs the page's queries to have run.
+	if "_flashes" in http_session or query_stats_header():
+		return render_template(name, **context)
+	app.update_template_context(context)
+	template = app.jinja_env.get_template(name)
+	def generate():
+		before_render_template.send(app, template=template, context=context)
+		chunk, size = [], 0
+		for piece in template.generate(context):
+			chunk.append(piece)
+			size += len(piece)
+			if size >= STREAM_CHUNK_SIZE:
+				yield "".join(chunk)
+				chunk, size = [], 0
+		yield "".join(chunk)
+		template_rendered.send(app, template=template, context=context)
+	return app.response_class(stream_with_context(generate()))
+
+def entry_listing(entries, endpoint, page=1, count=None, url_args={}, **context):
+	""" Stream one page of a listing of entries, newest first, as excerpts
+	
+	Pages are reached by (datetime, id) cursors; numbered pages are kept for
+	old links. `count` returns the total number of entries in the listing.
+	"""
 	# Zero-indexed page
 	page_index = page - 1
 	
@@ -20,32 +62,141 @@ def entries(page=1):
 	if limit < 1 or limit > 100:
 		limit = PAGINATE_BY
 	
-	count = session.query(Entry).count()
-	
-	start = page_index * limit
-	end = start + limit
-	
-	total_pages = (count - 1) // limit + 1
-	has_next = page_index < total_pages - 1
-	has_prev = page_index > 0
+	before = decode_cursor(request.args.get("before"))
+	after = decode_cursor(request.args.get("after"))
 	has_paginator = True
 	
-	entries = session.query(Entry)
-	entries = entries.order_by(Entry.datetime.desc())
-	entries = entries[start:end]
-	#TODO: clip posts so that they don't fill the screen
+	entries = entries.options(*EXCERPT_OPTIONS)
+	url = functools.partial(url_for, endpoint, limit=limit, **url_args)
+	if page_index > 0 and before is None and after is None:
+		# Numbered pages are kept for old links, but cost an OFFSET scan
+		entries = entries.order_by(Entry.datetime.desc(), Entry.id.desc())
+		# One extra row tells us whether there is a next page
+		entries = entries.offset(page_index * limit).limit(limit + 1)
+		entries = Page(entries.yield_per(STREAM_BATCH), limit, url,
+				has_newer=True)
+	else:
+		entries = keyset_page(entries, url, before, after, limit, STREAM_BATCH)
+		if before is not None or after is not None:
+			page = None
+	entries.rows = with_text(entries.rows, STREAM_BATCH)
 	
-	return render_template("entries.html",
+	total_pages = None
+	if count is not None and app.config.get("SHOW_TOTAL_PAGES"):
+		total_pages = (count() - 1) // limit + 1
+	
+	return stream_template("entries.html",
 		entries=entries,
-		has_next=has_next,
+		pager=entries,
+		excerpts=True,
 		has_paginator=has_paginator,
-		has_prev=has_prev,
 		page=page,
 		total_pages=total_pages,
 		limit=limit,
+		months=counters.month_index(),
 		current_user=current_user,
+		**context
 	)
 
+@app.route("/")
+@app.route("/page/<int:page>")
+@read_only
+@cached_page
+def entries(page=1):
+	return entry_listing(session.query(Entry), "entries", page,
+			counters.entry_count)
+
+@app.route("/author/<int:id>")
+@app.route("/author/<int:id>/page/<int:page>")
+@read_only
+@cached_page
+def author_entries(id, page=1):
+	# Not through the logged in user cache, which crawlers would churn
+	author = session.query(User.id, User.name).filter_by(id=id).first()
+	if author is None:
+		abort(404)
+	# Kept up to date as entries are added and removed, so the heading costs
+	# no COUNT over a long archive
+	count = counters.author_entry_count(id)
+	entries = session.query(Entry).filter(Entry.author_id == id)
+	return entry_listing(entries, "author_entries", page, lambda: count,
+			{"id": id}, author=author, author_count=count)
+
+@app.route("/archive/<int:year>/<int:month>")
+@app.route("/archive/<int:year>/<int:month>/page/<int:page>")
+@read_only
+@cached_page
+def archive(year, month, page=1):
+	try:
+		start, end = counters.month_range(year, month)
+	except ValueError:
+		abort(404)
+	count = counters.month_count(year, month)
+	# One range scan of the datetime index, like the index pages
+	entries = session.query(Entry).filter(Entry.datetime >= start,
+			Entry.datetime < end)
+	return entry_listing(entries, "archive", page, lambda: count,
+			{"year": year, "month": month}, archive_month=start,
+			archive_count=count)
+
+def feed(template, mimetype):
+	entries = session.query(Entry).options(joinedload(Entry.author))
+	entries, has_next, has_prev = keyset(entries,
+			limit=app.config.get("FEED_SIZE", 20))
+	generation, updated = counters.generation()
+	response = make_response(render_template(template,
+		entries=entries,
+		updated=updated.replace(tzinfo=datetime.timezone.utc),
+	))
+	response.mimetype = mimetype
+	return response
+
+@app.route("/feed.atom")
+@read_only
+@cached_page
+def feed_atom():
+	return feed("feed.atom.xml", "application/atom+xml")
+
+@app.route("/feed.rss")
+@read_only
+@cached_page
+def feed_rss():
+	return feed("feed.rss.xml", "application/rss+xml")
+
+@app.route("/search")
+@read_only
+@cached_page
+def search_entries():
+	q = request.args.get("q", "").strip()
+	after = search.decode_cursor(request.args.get("after"))
+	results, has_more = [], False
+	if q:
+		results, has_more = search.search(q, after, PAGINATE_BY)
+	
+	more_url = None
+	if has_more:
+		more_url = url_for("search_entries", q=q,
+				after=search.encode_cursor(*results[-1]))
+	
+	return render_template("search.html",
+		entries=[entry for entry, score in results],
+		excerpts=True,
+		q=q,
+		more_url=more_url,
+		current_user=current_user,
+	)
+
+def after_write(entry_id=None):
+	""" Queue the work that follows a committed change to the entries
+	
+	Counts and the search index are kept in the write's own transaction;
+	rendering the markdown and the static export can wait.
+	"""
+	if entry_id is not None:
+		jobs.enqueue("render_entry", entry_id)
+	if app.config.get("EXPORT_DIR"):
+		jobs.enqueue("export_changes")
+
 @app.route("/entry/add", methods=["GET"])
 @login_required
 def add_entry_get():
@@ -61,20 +212,52 @@ def add_entry_post():
 	checktitle = checktitle[:1023]
 	entry = Entry(
 		title=checktitle,
-		content=request.form["content"],
-		author=current_user,
+		author_id=current_user.id,
+		datetime=datetime.datetime.now(),
 	)
+	entry.set_content(request.form["content"], render=False)
 	session.add(entry)
+	counters.increment(counters.ENTRY_COUNT)
+	counters.increment(counters.author_key(current_user.id))
+	counters.add_to_month(entry.datetime)
+	counters.touch()
 	session.commit()
+	invalidate()
+	stick_to_primary()
+	after_write(entry.id)
 	return redirect(url_for("entries"))
 
+@app.route("/entry/latest")
 @app.route("/entry/<int:id>")
-def single_post(id=1):
-	#TODO: default to latest post instead of first one
-	entries = session.query(Entry).get(id)
-	#TODO: link next and previous posts a la wz2100.net
+@read_only
+@cached_page
+def single_post(id=None):
+	entries = session.query(Entry).options(joinedload(Entry.author))
+	if id is None:
+		entries = entries.order_by(Entry.datetime.desc(), Entry.id.desc())
+	else:
+		entries = entries.filter(Entry.id == id)
+	
+	generation, updated = counters.generation()
+	key = "{}:{}".format(generation, id)
+	neighbours = neighbour_cache.get(key) if id is not None else None
+	if neighbours is None:
+		row = with_neighbours(entries).first()
+		if row is None:
+			abort(404)
+		entry, older_id, newer_id = row
+		neighbour_cache.set("{}:{}".format(generation, entry.id),
+				(older_id, newer_id))
+	else:
+		entry = entries.first()
+		if entry is None:
+			abort(404)
+		older_id, newer_id = neighbours
+	
 	return render_template("entries.html",
-		entries=[entries]
+		entries=[entry],
+		older_url=url_for("single_post", id=older_id) if older_id else None,
+		newer_url=url_for("single_post", id=newer_id) if newer_id else None,
 	)
 
 @app.route("/entry/<int:id>/edit", methods=["GET"])
@@ -96,8 +279,12 @@ def edit_entry_post(id):
 		flash("You can only edit your own posts", "danger")
 		return redirect(url_for("entries"))
 	entry.title=request.form["title"]
-	entry.content=request.form["content"]
+	entry.set_content(request.form["content"], render=False)
+	counters.touch()
 	session.commit()
+	invalidate()
+	stick_to_primary()
+	after_write(entry.id)
 	#TODO: redirect to same post
 	return redirect(url_for("entries"))
 
@@ -120,8 +307,16 @@ def remove_entry_delete(id):
 		flash("You can only delete your own posts", "danger")
 		return redirect(url_for("entries"))
 	print("Starting deletion")
-	session.query(Entry).filter(Entry.id==id).delete()
+	# Deleted through the session so that the search index sees it
+	session.delete(entry)
+	counters.increment(counters.ENTRY_COUNT, -1)
+	counters.increment(counters.author_key(entry.author_id), -1)
+	counters.add_to_month(entry.datetime, -1)
+	counters.touch()
 	session.commit()
+	invalidate()
+	stick_to_primary()
+	after_write()
 	return redirect(url_for("entries"))
 
 @app.route("/login", methods=["GET"])
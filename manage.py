@@ -1,39 +1,267 @@
 import os
+import sys
+import json
+import time
+import random
+import logging
 
 from flask_script import Manager
-from flask_migrate import Migrate, MigrateCommand
+from flask_migrate import Migrate, MigrateCommand, stamp
 
 from getpass import getpass
 from werkzeug.security import generate_password_hash
 
+from sqlalchemy import or_
+
 from blog import app
-from blog.database import session, Entry, User, Base
+from blog.database import session, Entry, User, Base, init_db, get_engine
+from blog.filters import render_markdown, make_excerpt, RENDERER_VERSION
+from blog import counters
+from blog import search
+from blog.export import export_site, lock
+from blog.assets import fetch_vendor, check_vendor, vendor_digests, build
+from blog.transfer import import_entries, dump_entries
+from blog.seed import add_users, add_entries
+from blog.bench import run_benchmark
+from blog.server import Server
+from blog.jobs import run_worker
 
 manager = Manager(app)
 
 class DB(object):
+	""" What Flask-Migrate needs of a Flask-SQLAlchemy object """
 	def __init__(self, metadata):
 		self.metadata = metadata
+	
+	@property
+	def engine(self):
+		return get_engine()
 
 migrate = Migrate(app, DB(Base.metadata))
 manager.add_command('db', MigrateCommand)
 
+@manager.command
+def initdb():
+	"""Create the tables in a fresh database and stamp it as fully migrated
+	
+	Databases created before migrations existed are instead stamped with
+	`db stamp a833631ac1fb` and brought up to date with `db upgrade`.
+	"""
+	init_db()
+	stamp()
+
 @manager.command
 def run():
 	port = int(os.environ.get('PORT', 8080))
 	app.run(host='0.0.0.0', port=port)
 
+@manager.option("-H", "--host", dest="host", default="0.0.0.0")
+@manager.option("-p", "--port", dest="port", type=int, default=None,
+		help="Defaults to $PORT, or 8080")
+@manager.option("-w", "--workers", dest="workers", type=int, default=None,
+		help="Worker processes (default: SERVER_WORKERS, or one per core)")
+@manager.option("-t", "--threads", dest="threads", type=int, default=None,
+		help="Threads per worker (default: SERVER_THREADS)")
+def serve(host="0.0.0.0", port=None, workers=None, threads=None):
+	"""Run the pre-forking production server"""
+	logging.basicConfig(level=logging.INFO)
+	if port is None:
+		port = int(os.environ.get('PORT', 8080))
+	Server.from_config(app, host=host, port=port, workers=workers,
+			threads=threads).run()
+
+@manager.option("-t", "--threads", dest="threads", type=int, default=None,
+		help="Jobs to run at once (default: JOB_THREADS)")
+def worker(threads=None):
+	"""Run the jobs stored when JOB_QUEUE_MODE is 'database'"""
+	logging.basicConfig(level=logging.INFO)
+	run_worker(threads)
+
+@manager.option("-e", "--entries", dest="entries", type=int, default=25,
+		help="Number of entries to generate")
+@manager.option("-u", "--users", dest="users", type=int, default=0,
+		help="Number of authors to generate; entries have no author if 0")
+@manager.option("-b", "--batch", dest="batch", type=int, default=5000,
+		help="Number of entries to insert per transaction")
+@manager.option("-r", "--raw", dest="raw", action="store_true",
+		help="Leave the markdown unrendered; see rerender")
+@manager.option("-s", "--seed", dest="random_seed", type=int, default=None,
+		help="Random seed, for repeatable data sets")
+def seed(entries=25, users=0, batch=5000, raw=False, random_seed=None):
+	"""Fill the database with generated authors and entries"""
+	rng = random.Random(random_seed)
+	author_ids = add_users(users, rng)
+	start = time.time()
+	def progress(done):
+		print("{}/{} entries, {:.0f}/s".format(done, entries,
+				done / (time.time() - start)))
+	add_entries(entries, author_ids, batch=batch, render=not raw, rng=rng,
+			progress=progress)
+
 @manager.command
-def seed():
-	content = """Lorem ipsum dolor sit amet, consectetur adipisicing elit, sed do eiusmod tempor incididunt ut labore et dolore magna aliqua. Ut enim ad minim veniam, quis nostrud exercitation ullamco laboris nisi ut aliquip ex ea commodo consequat. Duis aute irure dolor in reprehenderit in voluptate velit esse cillum dolore eu fugiat nulla pariatur. Excepteur sint occaecat cupidatat non proident, sunt in culpa qui officia deserunt mollit anim id est laborum."""
-
-	for i in range(25):
-		entry = Entry(
-			title="Test Entry #{}".format(i),
-			content=content
-		)
-		session.add(entry)
-	session.commit()
+def reconcile():
+	"""Recount the maintained counters; run this periodically from cron"""
+	count = counters.reconcile(counters.ENTRY_COUNT, counters.count_entries)
+	authors = counters.reconcile_authors()
+	months = counters.reconcile_months()
+	print("{} entries by {} authors over {} months".format(count, authors, months))
+
+@manager.option("-b", "--batch", dest="batch", type=int, default=500,
+		help="Number of entries to re-render per transaction")
+@manager.option("-a", "--all", dest="everything", action="store_true",
+		help="Re-render every entry, not just stale ones")
+def rerender(batch=500, everything=False):
+	"""Re-render stored entry HTML after the markdown renderer changes"""
+	last_id = 0
+	total = 0
+	while True:
+		entries = session.query(Entry).filter(Entry.id > last_id)
+		if not everything:
+			entries = entries.filter(or_(Entry.render_version == None,
+					Entry.render_version != RENDERER_VERSION))
+		entries = entries.order_by(Entry.id).limit(batch).all()
+		if not entries:
+			break
+		for entry in entries:
+			entry.set_content(entry.content or "")
+		last_id = entries[-1].id
+		total += len(entries)
+		session.commit()
+		session.expunge_all()
+	if total:
+		# So that cached pages pick up the new HTML
+		counters.touch()
+		session.commit()
+	print("Re-rendered {} entries".format(total))
+
+@manager.option("-b", "--batch", dest="batch", type=int, default=1000,
+		help="Number of entries to update per transaction")
+@manager.option("-a", "--all", dest="everything", action="store_true",
+		help="Regenerate every excerpt, e.g. after changing EXCERPT_LENGTH")
+def excerpts(batch=1000, everything=False):
+	"""Fill in the excerpts shown on list pages for entries without one"""
+	last_id = 0
+	total = 0
+	while True:
+		rows = session.query(Entry.id, Entry.content, Entry.content_html,
+				Entry.render_version).filter(Entry.id > last_id)
+		if not everything:
+			rows = rows.filter(Entry.excerpt_html == None)
+		rows = rows.order_by(Entry.id).limit(batch).all()
+		if not rows:
+			break
+		updates = []
+		for id, content, html, version in rows:
+			update = {"id": id}
+			# Excerpts are cut from the stored HTML, if it is up to date
+			if html is None or version != RENDERER_VERSION:
+				html = render_markdown(content or "")
+				update.update(content_html=html, render_version=RENDERER_VERSION)
+			update["excerpt_html"], update["excerpt_truncated"] = make_excerpt(html)
+			updates.append(update)
+		session.bulk_update_mappings(Entry, updates)
+		session.commit()
+		last_id = rows[-1].id
+		total += len(rows)
+	if total:
+		# So that cached list pages pick up the new excerpts
+		counters.touch()
+		session.commit()
+	print("Updated {} excerpts".format(total))
+
+@manager.command
+def reindex():
+	"""Rebuild the full text search index from scratch"""
+	print("Indexed {} entries".format(search.rebuild()))
+
+@manager.option("directory", help="Where to write the site")
+@manager.option("-p", "--processes", dest="processes", type=int, default=None,
+		help="Number of rendering processes (default: one per core)")
+def export(directory, processes=None):
+	"""Export the public site as static HTML, re-rendering only what changed"""
+	with lock(directory):
+		written = export_site(directory, processes)
+	print("Wrote {entries} entries and {pages} index pages, removed {removed} "
+			"entries, copied {static} static files".format(**written))
+
+def named(name):
+	""" Register a command under a name that can't be a function's, like `import` """
+	def rename(func):
+		func.__name__ = name
+		return func
+	return rename
+
+@manager.option("source", help="A JSON Lines file, or a directory of .md files")
+@manager.option("-b", "--batch", dest="batch", type=int, default=500,
+		help="Number of entries to insert per transaction")
+@manager.option("-r", "--raw", dest="raw", action="store_true",
+		help="Leave the markdown unrendered; see rerender")
+@manager.option("--restart", dest="restart", action="store_true",
+		help="Start again from the top instead of resuming an earlier import")
+@named("import")
+def import_(source, batch=500, raw=False, restart=False):
+	"""Import entries, matching authors to users by email; resumes if interrupted"""
+	start = time.time()
+	def progress(done):
+		print("{} entries, {:.0f}/s".format(done, done / (time.time() - start)))
+	result = import_entries(source, batch=batch, render=not raw, restart=restart,
+			progress=progress)
+	print("Imported {imported} entries, skipped {skipped} imported earlier; "
+			"{unmatched} had an unknown author".format(**result))
+
+@manager.option("-o", "--output", dest="output", default=None,
+		help="Write here instead of stdout")
+@manager.option("-b", "--batch", dest="batch", type=int, default=1000,
+		help="Number of rows to fetch from the database at a time")
+def dump(output=None, batch=1000):
+	"""Write every entry out as JSON Lines, in the format import reads"""
+	if output:
+		with open(output, "w", encoding="utf-8") as f:
+			count = dump_entries(f, batch)
+	else:
+		count = dump_entries(sys.stdout, batch)
+	print("Dumped {} entries".format(count), file=sys.stderr)
+
+@manager.option("-o", "--offline", dest="offline", action="store_true",
+		help="Build from the vendored files already downloaded")
+@manager.option("-r", "--refresh", dest="refresh", action="store_true",
+		help="Download the vendored files again, even if present")
+@manager.option("--pin", dest="pin", action="store_true",
+		help="Print the vendored files' digests to record, instead of checking them")
+def assets(offline=False, refresh=False, pin=False):
+	"""Vendor, bundle, hash and compress the static files; run on every deploy"""
+	try:
+		if not offline:
+			fetched = fetch_vendor(app.static_folder, refresh, check=not pin)
+			print("Downloaded {} vendored files".format(fetched))
+		if pin:
+			print("Check these files, then record in VENDOR_SHA384 in blog/assets.py:")
+			for name, digest in vendor_digests(app.static_folder).items():
+				print('\t"{}": "{}",'.format(name, digest))
+			return
+		check_vendor(app.static_folder)
+	except ValueError as e:
+		sys.exit(str(e))
+	result = build(app.static_folder)
+	print("Wrote {} hashed files".format(result["written"]))
+	if result["missing"]:
+		# Pages would quietly load them from the CDNs instead
+		sys.exit("Not built, for want of files: {}".format(", ".join(result["missing"])))
+
+@manager.option("-n", "--requests", dest="requests", type=int, default=200,
+		help="Number of requests to time for each scenario")
+@manager.option("-c", "--cold", dest="cold", action="store_true",
+		help="Disable the page cache, to measure rendering from the database")
+@manager.option("-o", "--output", dest="output", default=None,
+		help="Write the JSON report here instead of stdout")
+def bench(requests=200, cold=False, output=None):
+	"""Benchmark the main routes; run this against a stand-in database"""
+	report = json.dumps(run_benchmark(requests, cold), indent=2, sort_keys=True)
+	if output:
+		with open(output, "w") as f:
+			f.write(report + "\n")
+	else:
+		print(report)
 
 @manager.command
 def adduser():
@@ -0,0 +1,45 @@
+"""create entries and users
+
+The schema as it was before migrations, when init_db created it. Stamp
+databases from then with this revision before upgrading them:
+manage.py db stamp a833631ac1fb
+
+Revision ID: a833631ac1fb
+Revises: 
+Create Date: 2026-10-17 20:37:20.977481
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a833631ac1fb'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+	op.create_table("users",
+		sa.Column("id", sa.Integer(), nullable=False),
+		sa.Column("name", sa.String(length=128), nullable=True),
+		sa.Column("email", sa.String(length=128), nullable=True),
+		sa.Column("password", sa.String(length=128), nullable=True),
+		sa.PrimaryKeyConstraint("id"),
+		sa.UniqueConstraint("email"),
+	)
+	op.create_table("entries",
+		sa.Column("id", sa.Integer(), nullable=False),
+		sa.Column("title", sa.String(length=1024), nullable=True),
+		sa.Column("content", sa.Text(), nullable=True),
+		sa.Column("datetime", sa.DateTime(), nullable=True),
+		sa.Column("author_id", sa.Integer(), nullable=True),
+		sa.ForeignKeyConstraint(["author_id"], ["users.id"]),
+		sa.PrimaryKeyConstraint("id"),
+	)
+
+
+def downgrade():
+	op.drop_table("entries")
+	op.drop_table("users")
@@ -0,0 +1,98 @@
+"""store rendered html and add counters, jobs and search
+
+Revision ID: e74350f61c2a
+Revises: a833631ac1fb
+Create Date: 2026-10-17 20:37:23.501931
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e74350f61c2a'
+down_revision = 'a833631ac1fb'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+	# SQLite gets the boolean's CHECK by copying the table; Postgres has a
+	# native boolean and no CHECK. (Letting the copy take the CHECK from the
+	# column writes it twice.)
+	sqlite = op.get_bind().dialect.name == "sqlite"
+	with op.batch_alter_table("entries", recreate="always" if sqlite else "auto",
+			table_args=(sa.CheckConstraint("excerpt_truncated IN (0, 1)"),)) as batch_op:
+		batch_op.add_column(sa.Column("content_html", sa.Text(), nullable=True))
+		batch_op.add_column(sa.Column("excerpt_html", sa.Text(), nullable=True))
+		batch_op.add_column(sa.Column("excerpt_truncated",
+				sa.Boolean(create_constraint=False), nullable=True))
+		batch_op.add_column(sa.Column("render_version", sa.Integer(), nullable=True))
+	op.create_index("ix_entries_datetime_id", "entries", ["datetime", "id"])
+	op.create_index("ix_entries_author_datetime_id", "entries",
+			["author_id", "datetime", "id"])
+	
+	op.create_table("counters",
+		sa.Column("name", sa.String(length=128), nullable=False),
+		sa.Column("value", sa.Integer(), nullable=False),
+		sa.Column("reconciled", sa.DateTime(), nullable=True),
+		sa.Column("updated", sa.DateTime(), nullable=True),
+		sa.PrimaryKeyConstraint("name"),
+	)
+	op.create_table("import_progress",
+		sa.Column("path", sa.String(length=1024), nullable=False),
+		sa.Column("digest", sa.String(length=40), nullable=False),
+		sa.Column("done", sa.Integer(), nullable=False),
+		sa.Column("updated", sa.DateTime(), nullable=True),
+		sa.PrimaryKeyConstraint("path", "digest"),
+	)
+	jobs = op.create_table("jobs",
+		sa.Column("id", sa.Integer(), nullable=False),
+		sa.Column("name", sa.String(length=128), nullable=False),
+		sa.Column("arguments", sa.Text(), nullable=False),
+		sa.Column("key", sa.String(length=1024), nullable=False),
+		sa.Column("created", sa.DateTime(), nullable=True),
+		sa.Column("claimed", sa.DateTime(), nullable=True),
+		sa.Column("attempts", sa.Integer(), nullable=False),
+		sa.PrimaryKeyConstraint("id"),
+	)
+	op.create_index("ix_jobs_waiting_key", "jobs", ["key"], unique=True,
+			postgresql_where=jobs.c.claimed == None,
+			sqlite_where=jobs.c.claimed == None)
+	
+	# The search indexes, as blog.database creates them, filled from the
+	# entries already there
+	dialect = op.get_bind().dialect.name
+	if dialect == "postgresql":
+		op.execute("ALTER TABLE entries ADD COLUMN search_vector tsvector")
+		op.execute("CREATE INDEX ix_entries_search_vector ON entries "
+				"USING gin (search_vector)")
+		op.execute("UPDATE entries SET search_vector = to_tsvector('english', "
+				"coalesce(title, '') || ' ' || coalesce(content, ''))")
+	elif dialect == "sqlite":
+		op.execute("CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts "
+				"USING fts5(title, content)")
+		op.execute("INSERT INTO entries_fts (rowid, title, content) "
+				"SELECT id, coalesce(title, ''), coalesce(content, '') FROM entries")
+
+
+def downgrade():
+	dialect = op.get_bind().dialect.name
+	if dialect == "postgresql":
+		op.execute("DROP INDEX ix_entries_search_vector")
+		op.execute("ALTER TABLE entries DROP COLUMN search_vector")
+	elif dialect == "sqlite":
+		op.execute("DROP TABLE IF EXISTS entries_fts")
+	
+	op.drop_index("ix_jobs_waiting_key", table_name="jobs")
+	op.drop_table("jobs")
+	op.drop_table("import_progress")
+	op.drop_table("counters")
+	
+	op.drop_index("ix_entries_author_datetime_id", table_name="entries")
+	op.drop_index("ix_entries_datetime_id", table_name="entries")
+	with op.batch_alter_table("entries") as batch_op:
+		batch_op.drop_column("render_version")
+		batch_op.drop_column("excerpt_truncated")
+		batch_op.drop_column("excerpt_html")
+		batch_op.drop_column("content_html")
@@ -0,0 +1,31 @@
+""" Setup for pytest, which can run the tests in parallel: pytest -n auto tests
+
+Each worker process uses a database of its own, named after the worker
+(see worker_database in blog/config.py). Those on Postgres are created here
+when missing; SQLite makes its own.
+"""
+import os
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine.url import make_url
+
+def pytest_configure(config):
+	if os.environ.get("PYTEST_XDIST_WORKER") is None:
+		return
+	if os.environ.get("CONFIG_PATH") == None:
+		os.environ["CONFIG_PATH"] = "blog.config.TestingConfig"
+	from blog import app
+	url = make_url(app.config["SQLALCHEMY_DATABASE_URI"])
+	if url.get_backend_name() != "postgresql":
+		return
+	# The replica tests want a second database beside it
+	names = [url.database, url.database + "-replica"]
+	url.database = "postgres"
+	engine = create_engine(url, isolation_level="AUTOCOMMIT")
+	with engine.connect() as connection:
+		for name in names:
+			exists = connection.execute("SELECT 1 FROM pg_database WHERE datname = %s",
+					name).scalar()
+			if not exists:
+				connection.execute('CREATE DATABASE "{}"'.format(name))
+	engine.dispose()
@@ -0,0 +1,110 @@
+""" A base class for tests that use the database
+
+The tables are created once per process rather than for every test. Each
+test then runs in a transaction on a single connection, which every session
+joins inside a SAVEPOINT: the views commit and roll back as usual, but only
+ever the savepoint, and the whole transaction is rolled back at the end.
+
+Run the suite in parallel with pytest-xdist; see tests/conftest.py.
+"""
+import os
+import unittest
+
+from sqlalchemy import event
+
+from blog import database, pagecache
+from blog.database import Base, Session, get_engine, session
+from blog.login import user_cache
+
+# The engine that the tables were last created with
+schema_engine = None
+
+@event.listens_for(Base.metadata, "after_drop")
+def forget_schema(target, connection, **kwargs):
+	global schema_engine
+	schema_engine = None
+
+def create_schema():
+	""" Create the tables, unless they already exist on the current engine """
+	global schema_engine
+	if schema_engine is not get_engine():
+		Base.metadata.create_all(get_engine())
+		schema_engine = get_engine()
+
+def clear_tables():
+	""" Delete every row, for tests whose data has to be committed
+	
+	Ids start from 1 again afterwards, as the acceptance tests expect.
+	"""
+	connection = get_engine().connect()
+	with connection.begin():
+		for table in reversed(Base.metadata.sorted_tables):
+			connection.execute(table.delete())
+		if connection.dialect.name == "sqlite":
+			connection.execute("DELETE FROM entries_fts")
+		elif connection.dialect.name == "postgresql":
+			reset_sequences(connection)
+	connection.close()
+
+def reset_sequences(connection):
+	""" Number each test's rows from 1, as Postgres sequences ignore rollbacks """
+	for table in Base.metadata.sorted_tables:
+		if "id" in table.c and table.c.id.primary_key:
+			connection.execute("SELECT setval(pg_get_serial_sequence(%s, 'id'), 1, false)",
+					table.name)
+
+def worker_number():
+	""" Which of the parallel test processes this is, counting from 0 """
+	return int(os.environ.get("PYTEST_XDIST_WORKER", "gw0")[2:])
+
+# Of the sessions' own class, so that listeners for them apply to it too
+class SavepointSession(Session.class_):
+	""" A session whose commits and rollbacks end a savepoint, not the transaction """
+	def begin(self, subtransactions=False, nested=False):
+		transaction = super().begin(subtransactions, nested)
+		if transaction.parent is None:
+			# The SAVEPOINT itself waits for the first statement
+			transaction = super().begin(nested=True)
+		return transaction
+	
+	def close(self):
+		# Throw away what wasn't committed, as closing a real transaction would,
+		# but leave the objects as they were loaded
+		self.expunge_all()
+		self.rollback()
+		super().close()
+
+@event.listens_for(SavepointSession, "after_transaction_end")
+def restart_savepoint(db_session, transaction):
+	""" Start a new savepoint when one ends, as a new transaction would start """
+	if (transaction.nested and transaction.parent.parent is None
+			and transaction.parent.is_active):
+		# Just as a real commit leaves everything to be loaded again
+		db_session.expire_all()
+		db_session.begin_nested()
+
+class TransactionTestCase(unittest.TestCase):
+	""" Rolls back everything each test writes to the database """
+	def setUp(self):
+		create_schema()
+		self.connection = get_engine().connect()
+		self.transaction = self.connection.begin()
+		if self.connection.dialect.name == "sqlite":
+			# pysqlite only begins a transaction before writing, and releasing
+			# a savepoint made outside of one would commit it
+			self.connection.execute("BEGIN")
+		elif self.connection.dialect.name == "postgresql":
+			reset_sequences(self.connection)
+		
+		session.remove()
+		self.session_factory = database.session_factory
+		database.session_factory = lambda: SavepointSession(bind=self.connection)
+	
+	def tearDown(self):
+		session.remove()
+		database.session_factory = self.session_factory
+		self.transaction.rollback()
+		self.connection.close()
+		# Anything cached from the rolled back rows goes with them
+		pagecache.invalidate()
+		user_cache.clear()
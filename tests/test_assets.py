@@ -0,0 +1,200 @@
+import os
+import gzip
+import json
+import shutil
+import tempfile
+import unittest
+
+from flask import url_for
+
+# Configure your app to use the testing database
+if os.environ.get("CONFIG_PATH") == None:
+	os.environ["CONFIG_PATH"] = "blog.config.TestingConfig"
+
+from blog import app
+from blog import assets, pagecache
+from blog.database import session, User, Entry
+
+from fixtures import TransactionTestCase
+
+class AssetTests(TransactionTestCase):
+	def setUp(self):
+		""" Test setup """
+		super().setUp()
+		self.client = app.test_client()
+		self.static_folder = app.static_folder
+		# Named static, as Flask takes the static URL path from the folder's name
+		self.directory = tempfile.mkdtemp()
+		self.static = os.path.join(self.directory, "static")
+		app.static_folder = self.static
+		
+		files = {
+			"vendor/bootstrap.min.css": "body{background:url(../fonts/icons.svg)}",
+			"vendor/bootstrap.min.js": "var bootstrap;",
+			"vendor/jquery.min.js": "var jQuery;",
+			"css/main.css": "h1 { background: url('../img/logo.png?v=1'); }" * 20,
+			"fonts/icons.svg": "<svg></svg>",
+			"img/logo.png": "PNG",
+		}
+		for name, content in files.items():
+			assets.write(os.path.join(self.static, name), content.encode("utf-8"))
+	
+	def tearDown(self):
+		""" Test teardown """
+		app.static_folder = self.static_folder
+		assets.init_app(app)
+		shutil.rmtree(self.directory)
+		super().tearDown()
+	
+	def build(self):
+		result = assets.build(self.static)
+		assets.init_app(app)
+		# As restarting after a deploy would
+		pagecache.invalidate()
+		return result
+	
+	def read(self, name):
+		with open(os.path.join(self.static, name), "rb") as f:
+			return f.read()
+	
+	def test_build(self):
+		result = self.build()
+		self.assertEqual(result, {"written": 8, "missing": []})
+		manifest = json.loads(self.read("dist/manifest.json").decode("utf-8"))
+		self.assertRegex(manifest["site.css"], r"^dist/site\.[0-9a-f]{12}\.css$")
+		self.assertRegex(manifest["img/logo.png"], r"^dist/img/logo\.[0-9a-f]{12}\.png$")
+		
+		# Bundles hold their parts in order, with their urls pointing at the hashed files
+		css = self.read(manifest["site.css"]).decode("utf-8")
+		self.assertLess(css.index("background:url"), css.index("h1 {"))
+		self.assertIn("url(/static/{})".format(manifest["fonts/icons.svg"]), css)
+		self.assertIn("url('/static/{}?v=1')".format(manifest["img/logo.png"]), css)
+		self.assertEqual(gzip.decompress(self.read(manifest["site.css"] + ".gz")), css.encode("utf-8"))
+		self.assertFalse(os.path.exists(os.path.join(self.static, manifest["img/logo.png"] + ".gz")))
+		
+		# Rebuilding writes only what changed, keeping the previous build's files
+		self.assertEqual(self.build()["written"], 0)
+		assets.write(os.path.join(self.static, "css/main.css"), b"h2 {}")
+		self.assertEqual(self.build()["written"], 2)
+		self.assertTrue(os.path.exists(os.path.join(self.static, manifest["site.css"])))
+		assets.write(os.path.join(self.static, "css/main.css"), b"h3 {}")
+		self.build()
+		self.assertFalse(os.path.exists(os.path.join(self.static, manifest["site.css"])))
+		self.assertFalse(os.path.exists(os.path.join(self.static, manifest["site.css"] + ".gz")))
+	
+	def test_missing_vendor_file(self):
+		os.remove(os.path.join(self.static, "vendor/jquery.min.js"))
+		self.assertEqual(self.build()["missing"], ["site.js"])
+		body = self.client.get("/", buffered=True).data.decode("utf-8")
+		self.assertIn("https://code.jquery.com/jquery-2.1.1.min.js", body)
+		self.assertNotIn("https://netdna.bootstrapcdn.com/bootstrap/3.1.1/css/bootstrap.min.css", body)
+	
+	def test_check_vendor(self):
+		digests = assets.vendor_digests(self.static)
+		self.assertEqual(sorted(digests), sorted(assets.VENDOR))
+		self.assertRegex(digests["vendor/jquery.min.js"], r"^sha384-[A-Za-z0-9+/]{64}$")
+		pinned = assets.VENDOR_SHA384
+		assets.VENDOR_SHA384 = dict(digests)
+		try:
+			assets.check_vendor(self.static)
+			assets.write(os.path.join(self.static, "vendor/jquery.min.js"), b"var $;")
+			with self.assertRaisesRegex(ValueError, "jquery.min.js doesn't match"):
+				assets.check_vendor(self.static)
+			del assets.VENDOR_SHA384["vendor/jquery.min.js"]
+			with self.assertRaisesRegex(ValueError, "No SHA-384 recorded"):
+				assets.check_vendor(self.static)
+			os.remove(os.path.join(self.static, "vendor/bootstrap.min.js"))
+			with self.assertRaisesRegex(ValueError, "bootstrap.min.js is missing"):
+				assets.check_vendor(self.static)
+		finally:
+			assets.VENDOR_SHA384 = pinned
+	
+	def test_hashed_urls(self):
+		with app.test_request_context("/"):
+			self.assertEqual(url_for("static", filename="site.css"), "/static/site.css")
+		body = self.client.get("/", buffered=True).data.decode("utf-8")
+		self.assertIn("https://netdna.bootstrapcdn.com/bootstrap/3.1.1/css/bootstrap.min.css", body)
+		self.assertNotIn('"//', body)
+		self.assertNotIn("http://", body)
+		
+		self.build()
+		with app.test_request_context("/"):
+			url = url_for("static", filename="site.css")
+		self.assertRegex(url, r"^/static/dist/site\.[0-9a-f]{12}\.css$")
+		body = self.client.get("/", buffered=True).data.decode("utf-8")
+		self.assertIn('href="{}"'.format(url), body)
+		self.assertNotIn("bootstrapcdn", body)
+		self.assertNotIn("code.jquery.com", body)
+	
+	def test_serve_hashed(self):
+		self.build()
+		with app.test_request_context("/"):
+			url = url_for("static", filename="site.css")
+		response = self.client.get(url)
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(response.mimetype, "text/css")
+		self.assertNotIn("Content-Encoding", response.headers)
+		self.assertEqual(response.headers["Cache-Control"], assets.IMMUTABLE)
+		self.assertEqual(response.headers["Vary"], "Accept-Encoding")
+		plain = response.data
+		response.close()
+		
+		response = self.client.get(url, headers={"Accept-Encoding": "gzip, deflate"})
+		self.assertEqual(response.headers["Content-Encoding"], "gzip")
+		self.assertEqual(response.mimetype, "text/css")
+		self.assertEqual(gzip.decompress(response.data), plain)
+		response.close()
+		
+		self.assertEqual(self.client.get("/static/dist/missing.css").status_code, 404)
+
+class CompressionTests(TransactionTestCase):
+	def setUp(self):
+		""" Test setup """
+		super().setUp()
+		self.client = app.test_client()
+		user = User(name="Alice", email="alice@example.com", password="")
+		for i in range(10):
+			entry = Entry(title="Test Entry #{}".format(i), author=user)
+			entry.set_content("Test content #{}".format(i))
+			session.add(entry)
+		session.commit()
+	
+	def test_streamed_page(self):
+		plain = self.client.get("/", buffered=True)
+		self.assertNotIn("Content-Encoding", plain.headers)
+		self.assertFalse(plain.headers["ETag"].startswith("W/"))
+		
+		response = self.client.get("/", headers={"Accept-Encoding": "gzip"}, buffered=True)
+		self.assertEqual(response.headers["Content-Encoding"], "gzip")
+		self.assertIn("Accept-Encoding", response.headers["Vary"])
+		self.assertEqual(gzip.decompress(response.data), plain.data)
+		etag = response.headers["ETag"]
+		self.assertEqual(etag, "W/" + plain.headers["ETag"])
+		
+		response = self.client.get("/", headers={"Accept-Encoding": "gzip",
+				"If-None-Match": etag}, buffered=True)
+		self.assertEqual(response.status_code, 304)
+		self.assertNotIn("Content-Encoding", response.headers)
+	
+	def test_buffered_response(self):
+		response = self.client.get("/feed.atom", headers={"Accept-Encoding": "gzip"})
+		self.assertEqual(response.headers["Content-Encoding"], "gzip")
+		self.assertEqual(int(response.headers["Content-Length"]), len(response.data))
+		self.assertIn(b"Test content #0", gzip.decompress(response.data))
+		self.assertTrue(response.headers["ETag"].startswith("W/"))
+		
+		response = self.client.get("/feed.atom", headers={"Accept-Encoding": "gzip",
+				"If-None-Match": response.headers["ETag"]})
+		self.assertEqual(response.status_code, 304)
+	
+	def test_small_response(self):
+		app.config["COMPRESS_MIN_SIZE"] = 10 ** 6
+		try:
+			response = self.client.get("/feed.atom", headers={"Accept-Encoding": "gzip"})
+		finally:
+			app.config["COMPRESS_MIN_SIZE"] = 500
+		self.assertNotIn("Content-Encoding", response.headers)
+		self.assertIn(b"Test content #0", response.data)
+
+if __name__ == "__main__":
+	unittest.main()
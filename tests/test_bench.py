@@ -0,0 +1,78 @@
+import os
+import random
+import unittest
+
+# Configure your app to use the testing database
+if os.environ.get("CONFIG_PATH") == None:
+	os.environ["CONFIG_PATH"] = "blog.config.TestingConfig"
+
+from blog import search
+from blog.bench import run_benchmark, percentile
+from blog.counters import entry_count
+from blog.database import session, Entry
+from blog.seed import add_users, add_entries, markdown_document
+
+from fixtures import TransactionTestCase
+
+class SeedTests(TransactionTestCase):
+	def test_markdown_document(self):
+		rng = random.Random(1)
+		documents = [markdown_document(rng) for i in range(20)]
+		self.assertEqual(len(set(documents)), 20)
+		self.assertEqual(markdown_document(random.Random(1)), documents[0])
+	
+	def test_seed(self):
+		rng = random.Random(1)
+		author_ids = add_users(5, rng)
+		self.assertEqual(len(author_ids), 5)
+		self.assertEqual(add_entries(120, author_ids, batch=50, rng=rng), 120)
+		
+		self.assertEqual(session.query(Entry).count(), 120)
+		self.assertEqual(entry_count(), 120)
+		authors = set(id for id, in session.query(Entry.author_id))
+		self.assertEqual(authors, set(author_ids))
+		entry = session.query(Entry).first()
+		self.assertTrue(entry.content_html)
+		# Searchable straight away
+		word = entry.content.split()[0].strip("*`#>[")
+		self.assertTrue(search.search(word)[0])
+	
+	def test_seed_raw(self):
+		add_entries(10, [], render=False, rng=random.Random(1))
+		entry = session.query(Entry).first()
+		self.assertIsNone(entry.content_html)
+		self.assertIsNone(entry.author_id)
+	
+	def test_seed_twice(self):
+		rng = random.Random(1)
+		first = add_users(2, rng)
+		second = add_users(2, rng)
+		self.assertEqual(len(set(first + second)), 4)
+	
+	def test_percentile(self):
+		samples = list(range(1, 101))
+		self.assertEqual(percentile(samples, 0.5), 50)
+		self.assertEqual(percentile(samples, 0.99), 99)
+		self.assertEqual(percentile([7], 0.95), 7)
+	
+	def test_bench(self):
+		rng = random.Random(1)
+		add_entries(30, add_users(3, rng), rng=rng)
+		report = run_benchmark(3)
+		startup = report.pop("startup")
+		self.assertTrue(startup["p50_ms"] > 0)
+		self.assertEqual(set(report), {"index", "deep_page", "deep_cursor",
+				"entry", "login", "add_entry"})
+		for result in report.values():
+			self.assertEqual(result["requests"], 3)
+			self.assertTrue(result["p50_ms"] <= result["p99_ms"])
+		self.assertEqual(report["index"]["queries_per_request"], 0)
+		self.assertEqual(session.query(Entry).count(), 30 + 3 + 1)
+	
+	def test_bench_cold(self):
+		add_entries(30, [], rng=random.Random(1))
+		report = run_benchmark(2, cold=True)
+		self.assertTrue(report["index"]["queries_per_request"] >= 1)
+
+if __name__ == "__main__":
+	unittest.main()
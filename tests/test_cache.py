@@ -0,0 +1,103 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from blog.cache import LRUCache, TTLCache, DiskCache, make_cache
+
+class LRUCacheTests(unittest.TestCase):
+	def test_get_set(self):
+		cache = LRUCache(2)
+		cache.set("a", 1)
+		self.assertEqual(cache.get("a"), 1)
+		self.assertEqual(cache.get("b"), None)
+		self.assertEqual(cache.get("b", 2), 2)
+	
+	def test_evicts_least_recently_used(self):
+		cache = LRUCache(2)
+		cache.set("a", 1)
+		cache.set("b", 2)
+		cache.get("a")
+		cache.set("c", 3)
+		self.assertEqual(cache.get("a"), 1)
+		self.assertEqual(cache.get("b"), None)
+		self.assertEqual(len(cache), 2)
+	
+	def test_delete_clear(self):
+		cache = LRUCache(2)
+		cache.set("a", 1)
+		cache.set("b", 2)
+		cache.delete("a")
+		self.assertEqual(cache.get("a"), None)
+		cache.clear()
+		self.assertEqual(len(cache), 0)
+
+	def test_stats(self):
+		cache = LRUCache(2)
+		cache.set("a", 1)
+		cache.get("a")
+		cache.get("b")
+		self.assertEqual(cache.stats(), {"hits": 1, "misses": 1, "size": 1})
+
+class TTLCacheTests(unittest.TestCase):
+	def test_expires(self):
+		cache = TTLCache(2, 0.01)
+		cache.set("a", 1)
+		self.assertEqual(cache.get("a"), 1)
+		time.sleep(0.02)
+		self.assertEqual(cache.get("a"), None)
+		self.assertEqual(cache.stats(), {"hits": 1, "misses": 1, "size": 0})
+	
+	def test_bounded(self):
+		cache = TTLCache(2, 60)
+		for key in "abc":
+			cache.set(key, key)
+		self.assertEqual(cache.get("a"), None)
+		self.assertEqual(cache.get("c"), "c")
+
+class DiskCacheTests(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+	
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+	
+	def test_get_set(self):
+		cache = DiskCache(self.directory)
+		cache.set("/page/2", "<p>Page two</p>")
+		self.assertEqual(cache.get("/page/2"), "<p>Page two</p>")
+		self.assertEqual(cache.get("/page/3"), None)
+		# Visible to other processes sharing the directory
+		self.assertEqual(DiskCache(self.directory).get("/page/2"), "<p>Page two</p>")
+	
+	def test_delete_clear(self):
+		cache = DiskCache(self.directory)
+		cache.set("a", "1")
+		cache.set("b", "2")
+		cache.delete("a")
+		self.assertEqual(cache.get("a"), None)
+		cache.clear()
+		self.assertEqual(len(cache), 0)
+	
+	def test_bounded(self):
+		cache = DiskCache(self.directory, size=3)
+		for i, key in enumerate("abcde"):
+			cache.set(key, key)
+			# Distinct modification times, however coarse the filesystem's
+			os.utime(cache.path(key), (i, i))
+		self.assertEqual(len(cache), 3)
+		self.assertEqual(cache.get("a"), None)
+		self.assertEqual(cache.get("b"), None)
+		self.assertEqual(cache.get("e"), "e")
+	
+	def test_make_cache(self):
+		self.assertIsInstance(make_cache("memory", size=10), LRUCache)
+		cache = make_cache("disk", size=10, directory=self.directory)
+		self.assertIsInstance(cache, DiskCache)
+		self.assertEqual(cache.size, 10)
+		self.assertIsNone(make_cache(None))
+		self.assertRaises(ValueError, make_cache, "redis")
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,158 @@
+import os
+import sys
+import unittest
+import threading
+import subprocess
+
+from sqlalchemy.pool import StaticPool
+
+# Configure your app to use the testing database
+if os.environ.get("CONFIG_PATH") == None:
+	os.environ["CONFIG_PATH"] = "blog.config.TestingConfig"
+
+from blog import app, create_app
+from blog.config import Config, worker_database
+from blog import database, pagecache
+from blog.database import session, engine_options, get_engine, User, Counter
+from blog.counters import reconcile
+
+from fixtures import TransactionTestCase, create_schema, clear_tables
+
+class DatabaseTests(unittest.TestCase):
+	def test_engine_options(self):
+		config = {
+			"SQLALCHEMY_POOL_SIZE": 20,
+			"SQLALCHEMY_MAX_OVERFLOW": None,
+			"SQLALCHEMY_POOL_PRE_PING": True,
+		}
+		self.assertEqual(engine_options(config),
+				{"pool_size": 20, "pool_pre_ping": True})
+	
+	def test_engine_options_from_config(self):
+		config = {key: getattr(Config, key) for key in dir(Config)
+				if key.isupper()}
+		options = engine_options(config)
+		self.assertEqual(options["pool_size"], Config.SQLALCHEMY_POOL_SIZE)
+		self.assertEqual(options["pool_recycle"], Config.SQLALCHEMY_POOL_RECYCLE)
+	
+	def test_clear_tables(self):
+		create_schema()
+		session.add(User(name="Alice", email="alice@example.com"))
+		session.commit()
+		session.close()
+		clear_tables()
+		self.assertEqual(session.query(User).count(), 0)
+		# Numbering starts again, as it does in a fresh database
+		user = User(name="Bob", email="bob@example.com")
+		session.add(user)
+		session.commit()
+		self.assertEqual(user.id, 1)
+		session.close()
+		clear_tables()
+	
+	def test_worker_database(self):
+		worker = os.environ.pop("PYTEST_XDIST_WORKER", None)
+		try:
+			self.assertEqual(worker_database("postgresql://localhost/blog"),
+					"postgresql://localhost/blog")
+			os.environ["PYTEST_XDIST_WORKER"] = "gw3"
+			self.assertEqual(worker_database("postgresql://localhost/blog"),
+					"postgresql://localhost/blog-gw3")
+			self.assertEqual(worker_database("sqlite:////tmp/blog.db"),
+					"sqlite:////tmp/blog-gw3.db")
+			self.assertEqual(worker_database("sqlite://"), "sqlite://")
+		finally:
+			os.environ.pop("PYTEST_XDIST_WORKER", None)
+			if worker is not None:
+				os.environ["PYTEST_XDIST_WORKER"] = worker
+	
+	def test_engine_options_in_memory(self):
+		options = engine_options({"SQLALCHEMY_POOL_SIZE": None}, "sqlite://")
+		self.assertIs(options["poolclass"], StaticPool)
+		self.assertEqual(options["connect_args"], {"check_same_thread": False})
+	
+	def test_session_per_thread(self):
+		sessions = []
+		thread = threading.Thread(target=lambda: sessions.append(session()))
+		thread.start()
+		thread.join()
+		self.assertIsNot(sessions[0], session())
+	
+	def test_session_removed_after_request(self):
+		with app.test_request_context("/"):
+			first = session()
+		with app.test_request_context("/"):
+			self.assertIsNot(session(), first)
+	
+	def test_import_is_lazy(self):
+		# A fresh interpreter, as a newly forked or spawned worker would be
+		code = ("import blog, blog.database; "
+				"assert blog.database.engine is None, 'engine created on import'")
+		subprocess.check_call([sys.executable, "-c", code],
+				cwd=os.path.dirname(app.root_path))
+	
+	def test_create_app(self):
+		engine = get_engine()
+		class SmallCacheConfig(object):
+			PAGE_CACHE_SIZE = 3
+		try:
+			self.assertIs(create_app(SmallCacheConfig), app)
+			self.assertEqual(pagecache.page_cache.size, 3)
+			# The engine is rebuilt from the new config on next use
+			self.assertIsNone(database.engine)
+			self.assertIsNot(get_engine(), engine)
+		finally:
+			del app.config["PAGE_CACHE_SIZE"]
+			create_app()
+	
+	def test_session_forgotten_after_fork(self):
+		if not hasattr(os, "fork"):
+			self.skipTest("No fork on this platform")
+		parent = session()
+		read, write = os.pipe()
+		pid = os.fork()
+		if pid == 0:
+			os.close(read)
+			os.write(write, b"1" if session() is not parent else b"0")
+			os._exit(0)
+		os.close(write)
+		os.waitpid(pid, 0)
+		self.assertEqual(os.read(read, 1), b"1")
+
+class TransactionTests(TransactionTestCase):
+	def add_user(self, name):
+		session.add(User(name=name, email="{}@example.com".format(name.lower())))
+		session.commit()
+	
+	# Each of these two sees only its own rows, whichever runs first
+	def test_rolled_back(self):
+		self.add_user("Alice")
+		self.assertEqual([name for name, in session.query(User.name)], ["Alice"])
+	
+	def test_rolled_back_too(self):
+		self.add_user("Bob")
+		self.assertEqual([name for name, in session.query(User.name)], ["Bob"])
+	
+	def test_rollback_keeps_commits(self):
+		self.add_user("Alice")
+		session.add(User(name="Bob", email="bob@example.com"))
+		session.flush()
+		session.rollback()
+		self.assertEqual(session.query(User).count(), 1)
+		
+		# A failed commit, which counters recover from with a rollback
+		session.add(Counter(name="entries", value=1))
+		session.commit()
+		session.close()
+		self.assertEqual(reconcile("entries", lambda: 2), 2)
+		self.assertEqual(session.query(User).count(), 1)
+	
+	def test_closed_session_discards(self):
+		self.add_user("Alice")
+		session.add(User(name="Bob", email="bob@example.com"))
+		session.flush()
+		session.remove()
+		self.assertEqual(session.query(User).count(), 1)
+
+if __name__ == "__main__":
+	unittest.main()
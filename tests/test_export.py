@@ -0,0 +1,114 @@
+import os
+import shutil
+import datetime
+import tempfile
+import unittest
+
+# Configure your app to use the testing database
+if os.environ.get("CONFIG_PATH") == None:
+	os.environ["CONFIG_PATH"] = "blog.config.TestingConfig"
+
+from blog import app
+from blog.database import Base, get_engine, session, User, Entry, MEMORY_URIS
+from blog import export
+from blog.export import export_site, export_changes, lock
+
+@unittest.skipIf(app.config["SQLALCHEMY_DATABASE_URI"] in MEMORY_URIS,
+		"The export's worker processes can't open an in-memory database")
+class ExportTests(unittest.TestCase):
+	def setUp(self):
+		""" Test setup """
+		Base.metadata.create_all(get_engine())
+		self.directory = tempfile.mkdtemp()
+		
+		self.user = User(name="Alice", email="alice@example.com", password="")
+		session.add(self.user)
+		start = datetime.datetime(2015, 1, 1)
+		for i in range(25):
+			entry = Entry(title="Entry #{}".format(i), author=self.user,
+					datetime=start + datetime.timedelta(hours=i))
+			entry.set_content("Content #{}".format(i))
+			session.add(entry)
+		session.commit()
+	
+	def tearDown(self):
+		""" Test teardown """
+		shutil.rmtree(self.directory)
+		session.close()
+		Base.metadata.drop_all(get_engine())
+	
+	def read(self, path):
+		with open(os.path.join(self.directory, path)) as f:
+			return f.read()
+	
+	def test_export(self):
+		# On a pool of processes, as it is this big
+		export.POOL_MIN_JOBS = 0
+		try:
+			written = export_site(self.directory, processes=2)
+		finally:
+			export.POOL_MIN_JOBS = 50
+		self.assertEqual(written["entries"], 25)
+		self.assertEqual(written["pages"], 3)
+		self.assertTrue(written["static"] > 0)
+		
+		index = self.read("index.html")
+		self.assertIn("Entry #24", index)
+		self.assertNotIn("Entry #14", index)
+		self.assertIn('href="/page/2/"', index)
+		self.assertIn("Entry #14", self.read("page/2/index.html"))
+		self.assertIn("Content #3", self.read("entry/4/index.html"))
+		# Nor is anything else that needs the app, so nothing links to it
+		self.assertIn("Alice", index)
+		for page in [index, self.read("entry/4/index.html")]:
+			for path in ["/author/", "/search", "/feed.", "/login"]:
+				self.assertNotIn(path, page)
+		self.assertTrue(os.path.exists(os.path.join(self.directory, "static/css/main.css")))
+	
+	def test_export_unchanged(self):
+		export_site(self.directory, processes=2)
+		written = export_site(self.directory, processes=2)
+		self.assertEqual(written, {"entries": 0, "pages": 0, "removed": 0, "static": 0})
+	
+	def test_export_edit(self):
+		export_site(self.directory, processes=2)
+		entry = session.query(Entry).get(20)
+		entry.set_content("Edited content")
+		session.commit()
+		written = export_site(self.directory, processes=2)
+		self.assertEqual(written["entries"], 1)
+		# Only the index page the entry is listed on
+		self.assertEqual(written["pages"], 1)
+		self.assertIn("Edited content", self.read("entry/20/index.html"))
+		self.assertIn("Edited content", self.read("index.html"))
+	
+	def test_export_delete(self):
+		export_site(self.directory, processes=2)
+		session.delete(session.query(Entry).get(25))
+		session.commit()
+		written = export_site(self.directory, processes=2)
+		self.assertEqual(written["entries"], 0)
+		self.assertEqual(written["removed"], 1)
+		# Every page shifts by one entry
+		self.assertEqual(written["pages"], 3)
+		self.assertFalse(os.path.exists(os.path.join(self.directory, "entry/25/index.html")))
+	
+	def test_export_changes_locked(self):
+		app.config["EXPORT_DIR"] = self.directory
+		try:
+			# As if another process were exporting
+			held = lock(self.directory)
+			export_changes()
+			self.assertFalse(os.path.exists(os.path.join(self.directory, "index.html")))
+			self.assertTrue(os.path.exists(os.path.join(self.directory, export.PENDING)))
+			held.close()
+			
+			# Requests made meanwhile are caught up by one export
+			export_changes()
+			self.assertIn("Entry #24", self.read("index.html"))
+			self.assertFalse(os.path.exists(os.path.join(self.directory, export.PENDING)))
+		finally:
+			app.config["EXPORT_DIR"] = None
+
+if __name__ == "__main__":
+	unittest.main()
@@ -8,6 +8,7 @@ if not "CONFIG_PATH" in os.environ:
 
 import blog
 from blog.filters import *
+from blog.database import Entry
 
 class FilterTests(unittest.TestCase):
 	def test_date_format(self):
@@ -18,6 +19,62 @@ class FilterTests(unittest.TestCase):
 	def test_date_format_none(self):
 		formatted = dateformat(None, "%y/%m/%d")
 		self.assertEqual(formatted, None)
+	
+	def test_markdown(self):
+		html = markdown("Some *emphasis* <script>")
+		self.assertIn("<em>emphasis</em>", html)
+		self.assertIn("&lt;script&gt;", html)
+	
+	def test_markdown_cached(self):
+		markdown_cache.clear()
+		markdown("Cache *me*")
+		self.assertEqual(len(markdown_cache), 1)
+		markdown("Cache *me*")
+		self.assertEqual(len(markdown_cache), 1)
+	
+	def test_entry_html_stored(self):
+		entry = Entry(content="*Source*", content_html="<p>Stored</p>",
+				render_version=RENDERER_VERSION)
+		self.assertEqual(entry_html(entry), "<p>Stored</p>")
+	
+	def test_entry_html_stale(self):
+		entry = Entry(content="*Source*", content_html="<p>Stored</p>",
+				render_version=RENDERER_VERSION - 1)
+		self.assertIn("<em>Source</em>", entry_html(entry))
+
+	def test_excerpt_short(self):
+		html = render_markdown("Just *one* paragraph")
+		self.assertEqual(make_excerpt(html), (html, False))
+	
+	def test_excerpt_paragraphs(self):
+		html = render_markdown("\n\n".join(["A paragraph of some length. " * 10] * 5))
+		excerpt, truncated = make_excerpt(html, length=500)
+		self.assertTrue(truncated)
+		# Cut after the second paragraph, the first to pass 500 characters
+		self.assertEqual(excerpt.count("<p>"), 2)
+		self.assertTrue(excerpt.endswith("</p>"))
+		self.assertTrue(html.startswith(excerpt))
+	
+	def test_excerpt_keeps_blocks_whole(self):
+		code = "```\n" + "code\n\n" * 100 + "```"
+		html = render_markdown("Intro\n\n" + code + "\n\nOutro")
+		excerpt, truncated = make_excerpt(html, length=100)
+		# The code block is far too long, so the excerpt stops before it
+		self.assertEqual(excerpt, "<p>Intro</p>")
+		self.assertTrue(truncated)
+	
+	def test_excerpt_long_first_paragraph(self):
+		html = render_markdown("word & " * 500)
+		excerpt, truncated = make_excerpt(html, length=100)
+		self.assertTrue(truncated)
+		self.assertTrue(excerpt.startswith("<p>word &amp; word"))
+		self.assertTrue(excerpt.endswith("&hellip;</p>"))
+		self.assertLess(len(excerpt), 200)
+	
+	def test_excerpt_stale(self):
+		entry = Entry(content="*Source*", excerpt_html="<p>Stored</p>",
+				excerpt_truncated=True, render_version=RENDERER_VERSION - 1)
+		self.assertEqual(excerpt(entry), ("<p><em>Source</em></p>\n", False))
 
 if __name__ == "__main__":
 	unittest.main()
@@ -0,0 +1,173 @@
+import os
+import time
+import unittest
+import threading
+
+# Configure your app to use the testing database
+if os.environ.get("CONFIG_PATH") == None:
+	os.environ["CONFIG_PATH"] = "blog.config.TestingConfig"
+
+from blog import app
+from blog import jobs, pagecache
+from blog.database import Base, get_engine, session, User, Entry, Job
+from blog.login import user_cache
+
+calls = []
+release = threading.Event()
+
+@jobs.job
+def record(value):
+	calls.append(value)
+
+@jobs.job
+def block():
+	release.wait(5)
+
+@jobs.job
+def fail():
+	calls.append("fail")
+	raise RuntimeError("Failed")
+
+class JobTests(unittest.TestCase):
+	def setUp(self):
+		""" Test setup """
+		Base.metadata.create_all(get_engine())
+		self.user = User(name="Alice", email="alice@example.com", password="")
+		session.add(self.user)
+		session.commit()
+		self.client = app.test_client()
+		self.mode = app.config["JOB_QUEUE_MODE"]
+		del calls[:]
+		release.clear()
+	
+	def tearDown(self):
+		""" Test teardown """
+		app.config["JOB_QUEUE_MODE"] = self.mode
+		release.set()
+		session.close()
+		pagecache.invalidate()
+		user_cache.clear()
+		Base.metadata.drop_all(get_engine())
+	
+	def simulate_login(self):
+		with self.client.session_transaction() as http_session:
+			http_session["user_id"] = str(self.user.id)
+			http_session["_fresh"] = True
+	
+	def test_thread_queue_coalesces(self):
+		queue = jobs.ThreadQueue(1)
+		self.assertTrue(queue.put("block", []))
+		self.assertTrue(queue.put("record", [1]))
+		self.assertFalse(queue.put("record", [1]))
+		self.assertTrue(queue.put("record", [2]))
+		release.set()
+		self.assertTrue(queue.drain(5))
+		self.assertEqual(calls, [1, 2])
+		
+		# Once started, the same job queued again runs again
+		release.clear()
+		queue.put("block", [])
+		time.sleep(0.1)
+		self.assertTrue(queue.put("block", []))
+		release.set()
+		self.assertTrue(queue.drain(5))
+	
+	def test_thread_queue_survives_errors(self):
+		queue = jobs.ThreadQueue(1)
+		queue.put("fail", [])
+		queue.put("record", [1])
+		self.assertTrue(queue.drain(5))
+		self.assertEqual(calls, ["fail", 1])
+	
+	def test_unknown_job(self):
+		with self.assertRaises(ValueError):
+			jobs.enqueue("missing")
+	
+	def test_stored_jobs_coalesce(self):
+		app.config["JOB_QUEUE_MODE"] = "database"
+		self.assertTrue(jobs.enqueue("record", 1))
+		self.assertFalse(jobs.enqueue("record", 1))
+		self.assertTrue(jobs.enqueue("record", 2))
+		self.assertEqual(session.query(Job).count(), 2)
+		
+		# A claimed job no longer stops the same one being queued
+		claimed = jobs.claim()
+		self.assertEqual((claimed.name, claimed.arguments, claimed.attempts),
+				("record", "[1]", 1))
+		self.assertTrue(jobs.enqueue("record", 1))
+		self.assertEqual(jobs.claim().arguments, "[2]")
+		self.assertEqual(jobs.claim().arguments, "[1]")
+		self.assertIsNone(jobs.claim())
+	
+	def work(self, timeout=5):
+		""" Run the stored jobs on a worker thread until there are none left """
+		stopping = threading.Event()
+		worker = threading.Thread(target=jobs.work_stored, args=(stopping, 0.01))
+		worker.start()
+		deadline = time.time() + timeout
+		while session.query(Job).count() and time.time() < deadline:
+			session.commit()
+			time.sleep(0.01)
+		stopping.set()
+		worker.join()
+	
+	def test_worker(self):
+		app.config["JOB_QUEUE_MODE"] = "database"
+		jobs.enqueue("record", 1)
+		jobs.enqueue("record", 2)
+		self.work()
+		self.assertEqual(calls, [1, 2])
+		self.assertEqual(session.query(Job).count(), 0)
+	
+	def test_worker_retries(self):
+		app.config["JOB_QUEUE_MODE"] = "database"
+		app.config["JOB_LEASE_SECONDS"] = 0
+		app.config["JOB_MAX_ATTEMPTS"] = 2
+		try:
+			jobs.enqueue("fail")
+			self.work()
+		finally:
+			app.config["JOB_LEASE_SECONDS"] = 300
+			app.config["JOB_MAX_ATTEMPTS"] = 3
+		self.assertEqual(calls, ["fail", "fail"])
+		self.assertEqual(session.query(Job).count(), 0)
+	
+	def test_add_entry_renders_later(self):
+		app.config["JOB_QUEUE_MODE"] = "database"
+		self.simulate_login()
+		response = self.client.post("/entry/add", data={
+			"title": "Test Entry",
+			"content": "Some *markdown*",
+		})
+		self.assertEqual(response.status_code, 302)
+		entry = session.query(Entry).one()
+		self.assertIsNone(entry.content_html)
+		job = session.query(Job).one()
+		self.assertEqual((job.name, job.arguments), ("render_entry", "[{}]".format(entry.id)))
+		
+		# Meanwhile pages render it themselves
+		body = self.client.get("/entry/{}".format(entry.id), buffered=True).data
+		self.assertIn(b"<em>markdown</em>", body)
+		
+		session.rollback()
+		self.work()
+		entry = session.query(Entry).one()
+		self.assertIn("<em>markdown</em>", entry.content_html)
+		self.assertIn("<em>markdown</em>", entry.excerpt_html)
+	
+	def test_edit_entry_renders_eagerly(self):
+		entry = Entry(title="Test Entry", author=self.user)
+		entry.set_content("Old")
+		session.add(entry)
+		session.commit()
+		id = entry.id
+		self.simulate_login()
+		self.client.post("/entry/{}/edit".format(id), data={
+			"title": "Test Entry",
+			"content": "*New*",
+		})
+		entry = session.query(Entry).one()
+		self.assertEqual(entry.content_html, "<p><em>New</em></p>\n")
+
+if __name__ == "__main__":
+	unittest.main()
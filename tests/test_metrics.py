@@ -0,0 +1,78 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from blog.metrics import Registry, RETIRED
+
+class MetricsTests(unittest.TestCase):
+	def setUp(self):
+		self.registry = Registry()
+		self.latency = self.registry.histogram("latency_seconds", "Latency",
+				["endpoint"], buckets=(0.1, 1))
+		self.hits = self.registry.counter("hits", "Hits", ["endpoint"])
+	
+	def test_histogram(self):
+		for value in (0.05, 0.1, 0.5, 2):
+			self.latency.observe(value, "entries")
+		text = self.registry.render()
+		self.assertIn("# TYPE latency_seconds histogram", text)
+		self.assertIn('latency_seconds_bucket{endpoint="entries",le="0.1"} 2', text)
+		self.assertIn('latency_seconds_bucket{endpoint="entries",le="1"} 3', text)
+		self.assertIn('latency_seconds_bucket{endpoint="entries",le="+Inf"} 4', text)
+		self.assertIn('latency_seconds_sum{endpoint="entries"} 2.65', text)
+		self.assertIn('latency_seconds_count{endpoint="entries"} 4', text)
+	
+	def test_counter(self):
+		self.hits.inc("entries")
+		self.hits.inc("entries", amount=2)
+		self.hits.inc('say "hi"')
+		text = self.registry.render()
+		self.assertIn("# TYPE hits counter", text)
+		self.assertIn('hits_total{endpoint="entries"} 3', text)
+		self.assertIn('hits_total{endpoint="say \\"hi\\""} 1', text)
+	
+	def test_shared_directory(self):
+		directory = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, directory)
+		self.registry.directory = directory
+		
+		# Another worker's snapshot is added to this one's
+		self.hits.inc("entries")
+		self.latency.observe(0.5, "entries")
+		with open(os.path.join(directory, "1.json"), "w") as f:
+			json.dump(self.registry.snapshot(), f)
+		self.hits.inc("entries")
+		text = self.registry.render()
+		self.assertIn('hits_total{endpoint="entries"} 3', text)
+		self.assertIn('latency_seconds_count{endpoint="entries"} 2', text)
+		
+		self.registry.remove_snapshots()
+		self.assertEqual(os.listdir(directory), [])
+	
+	def test_retire(self):
+		directory = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, directory)
+		self.registry.directory = directory
+		
+		# Two workers that have since exited
+		self.hits.inc("entries")
+		self.latency.observe(0.5, "entries")
+		for pid in (1, 2):
+			with open(os.path.join(directory, "{}.json".format(pid)), "w") as f:
+				json.dump(self.registry.snapshot(), f)
+		self.registry.clear()
+		self.registry.retire(1)
+		self.registry.retire(2)
+		self.registry.retire(3)
+		self.assertEqual(os.listdir(directory), [RETIRED])
+		
+		self.hits.inc("entries")
+		text = self.registry.render()
+		self.assertIn('hits_total{endpoint="entries"} 3', text)
+		self.assertIn('latency_seconds_count{endpoint="entries"} 2', text)
+		self.assertIn('latency_seconds_sum{endpoint="entries"} 1.0', text)
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,97 @@
+import os
+import unittest
+
+from werkzeug.utils import import_string
+
+# Configure your app to use the testing database
+if os.environ.get("CONFIG_PATH") == None:
+	os.environ["CONFIG_PATH"] = "blog.config.TestingConfig"
+
+from blog import app, create_app
+from blog import pagecache
+from blog.database import Base, Session, get_engine, get_replicas, session
+from blog.database import User, Entry, Counter, STICKY_COOKIE, MEMORY_URIS
+from blog.login import load_user, user_cache
+
+base = import_string(os.environ["CONFIG_PATH"])
+
+class ReplicaConfig(base):
+	# A second database standing in for a replica that hasn't caught up
+	if base.SQLALCHEMY_DATABASE_URI in MEMORY_URIS:
+		SQLALCHEMY_REPLICA_URIS = [base.SQLALCHEMY_DATABASE_URI]
+	else:
+		SQLALCHEMY_REPLICA_URIS = [base.SQLALCHEMY_DATABASE_URI + "-replica"]
+
+class ReplicaTests(unittest.TestCase):
+	def setUp(self):
+		""" Test setup """
+		create_app(ReplicaConfig)
+		self.client = app.test_client()
+		self.replica = Session(bind=get_replicas()[0])
+		
+		for db_session, name in [(session, "Primary"), (self.replica, "Replica")]:
+			Base.metadata.create_all(db_session.get_bind())
+			user = User(id=1, name="{} Alice".format(name), email="alice@example.com")
+			entry = Entry(title="{} entry".format(name), author=user)
+			entry.set_content("{} content".format(name))
+			# Both start at the same generation, as a replica would
+			generation = Counter(name="generation", value=1)
+			db_session.add_all([user, entry, generation])
+			db_session.commit()
+	
+	def tearDown(self):
+		""" Test teardown """
+		session.close()
+		self.replica.close()
+		pagecache.invalidate()
+		user_cache.clear()
+		Base.metadata.drop_all(get_engine())
+		Base.metadata.drop_all(get_replicas()[0])
+		create_app()
+	
+	def simulate_login(self):
+		with self.client.session_transaction() as http_session:
+			http_session["user_id"] = "1"
+			http_session["_fresh"] = True
+	
+	def get(self, url):
+		return self.client.get(url, buffered=True).data.decode("utf-8")
+	
+	def test_reads_from_replica(self):
+		for url in ["/", "/entry/1", "/entry/latest", "/author/1"]:
+			body = self.get(url)
+			self.assertIn("Replica entry", body)
+			self.assertNotIn("Primary entry", body)
+	
+	def test_writes_go_to_primary(self):
+		self.simulate_login()
+		response = self.client.post("/entry/add", data={
+			"title": "New entry",
+			"content": "New content",
+		})
+		self.assertEqual(response.status_code, 302)
+		self.assertEqual(session.query(Entry).filter_by(title="New entry").count(), 1)
+		self.assertEqual(self.replica.query(Entry).filter_by(title="New entry").count(), 0)
+		self.assertIn("Max-Age=10", response.headers["Set-Cookie"])
+		
+		# The writer reads their own write from the primary for a while
+		body = self.get("/")
+		self.assertIn("New entry", body)
+		self.assertIn("Primary entry", body)
+		
+		self.client.delete_cookie("localhost", STICKY_COOKIE)
+		body = self.get("/")
+		self.assertNotIn("New entry", body)
+		self.assertIn("Replica entry", body)
+	
+	def test_load_user_from_replica(self):
+		self.assertEqual(load_user("1").name, "Primary Alice")
+		user_cache.clear()
+		with app.test_request_context("/"):
+			self.assertEqual(load_user("1").name, "Replica Alice")
+		user_cache.clear()
+		with app.test_request_context("/", headers={"Cookie": STICKY_COOKIE + "=1"}):
+			self.assertEqual(load_user("1").name, "Primary Alice")
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,115 @@
+import os
+import re
+import unittest
+
+# Configure your app to use the testing database
+if os.environ.get("CONFIG_PATH") == None:
+	os.environ["CONFIG_PATH"] = "blog.config.TestingConfig"
+
+from sqlalchemy import inspect
+
+from blog import app, search
+from blog.database import session, User, Entry
+
+from fixtures import TransactionTestCase
+
+class SearchTests(TransactionTestCase):
+	def setUp(self):
+		""" Test setup """
+		super().setUp()
+		self.client = app.test_client()
+		
+		self.user = User(name="Alice", email="alice@example.com", password="")
+		session.add(self.user)
+		session.commit()
+	
+	def add_entry(self, title, content):
+		entry = Entry(title=title, author=self.user)
+		entry.set_content(content)
+		session.add(entry)
+		session.commit()
+		return entry
+	
+	def titles(self, q, after=None, limit=10):
+		results, has_more = search.search(q, after, limit)
+		return [entry.title for entry, score in results]
+	
+	def test_search(self):
+		self.add_entry("Sourdough", "How to bake bread with a starter")
+		self.add_entry("Bicycles", "Fixing a puncture")
+		self.assertEqual(self.titles("bread"), ["Sourdough"])
+		self.assertEqual(self.titles("bicycles"), ["Bicycles"])
+		self.assertEqual(self.titles("kayak"), [])
+	
+	def test_search_ranked(self):
+		self.add_entry("Once", "bread and butter")
+		self.add_entry("Bread", "bread bread bread, all about bread")
+		self.assertEqual(self.titles("bread"), ["Bread", "Once"])
+	
+	def test_search_syntax_ignored(self):
+		self.add_entry("Sourdough", "How to bake bread with a starter")
+		self.assertEqual(self.titles('bread" OR (NEAR'), [])
+		self.assertEqual(self.titles('"bread" -'), ["Sourdough"])
+	
+	def test_search_paginated(self):
+		for i in range(7):
+			self.add_entry("Entry #{}".format(i), "bread " * (i + 1))
+		results, has_more = search.search("bread", limit=3)
+		self.assertTrue(has_more)
+		seen = [entry.title for entry, score in results]
+		while has_more:
+			cursor = search.decode_cursor(search.encode_cursor(*results[-1]))
+			results, has_more = search.search("bread", cursor, 3)
+			seen += [entry.title for entry, score in results]
+		self.assertEqual(sorted(seen), sorted("Entry #{}".format(i) for i in range(7)))
+		self.assertEqual(len(seen), 7)
+	
+	def test_index_follows_edits(self):
+		entry = self.add_entry("Sourdough", "How to bake bread")
+		entry.set_content("How to bake cake")
+		session.commit()
+		self.assertEqual(self.titles("bread"), [])
+		self.assertEqual(self.titles("cake"), ["Sourdough"])
+		session.delete(entry)
+		session.commit()
+		self.assertEqual(self.titles("cake"), [])
+	
+	def test_index_rolled_back(self):
+		entry = Entry(title="Sourdough", content="bread", author=self.user)
+		session.add(entry)
+		session.flush()
+		session.rollback()
+		self.assertEqual(self.titles("bread"), [])
+	
+	def test_rebuild(self):
+		session.execute(Entry.__table__.insert().values(title="Raw", content="inserted bread"))
+		session.commit()
+		self.assertEqual(self.titles("bread"), [])
+		self.assertEqual(search.rebuild(), 1)
+		self.assertEqual(self.titles("bread"), ["Raw"])
+	
+	def test_search_view(self):
+		for i in range(12):
+			self.add_entry("Entry #{}".format(i), "bread")
+		response = self.client.get("/search?q=bread")
+		self.assertEqual(response.status_code, 200)
+		data = response.data.decode("utf-8")
+		self.assertEqual(len(re.findall(r'id="title-\d+"', data)), 10)
+		more = re.search(r'<a href="([^"]*)">&larr; More', data).group(1)
+		response = self.client.get(more.replace("&amp;", "&"))
+		self.assertEqual(len(re.findall(r'id="title-\d+"', response.data.decode("utf-8"))), 2)
+	
+	def test_search_view_empty(self):
+		response = self.client.get("/search?q=")
+		self.assertEqual(response.status_code, 200)
+	
+	def test_search_vector_not_loaded(self):
+		# Entries are loaded without it, and only Postgres has the column
+		self.assertNotIn("search_vector", Entry.__table__.c)
+		columns = [column["name"] for column in
+				inspect(session.connection()).get_columns("entries")]
+		self.assertEqual("search_vector" in columns,
+				session.get_bind().dialect.name == "postgresql")
+
+if __name__ == "__main__":
+	unittest.main()
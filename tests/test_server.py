@@ -0,0 +1,100 @@
+import os
+import time
+import shutil
+import signal
+import socket
+import tempfile
+import unittest
+import http.client
+import multiprocessing
+
+from flask import Flask
+
+from blog.server import Server
+from blog.metrics import registry, RETIRED
+
+def free_port():
+	sock = socket.socket()
+	sock.bind(("127.0.0.1", 0))
+	port = sock.getsockname()[1]
+	sock.close()
+	return port
+
+def make_app():
+	app = Flask(__name__)
+	@app.route("/")
+	def pid():
+		return str(os.getpid())
+	return app
+
+class ServerTests(unittest.TestCase):
+	def start(self, **options):
+		self.port = free_port()
+		server = Server(make_app(), host="127.0.0.1", port=self.port, **options)
+		self.process = multiprocessing.Process(target=server.run)
+		self.process.start()
+		for i in range(50):
+			try:
+				socket.create_connection(("127.0.0.1", self.port)).close()
+				return
+			except ConnectionRefusedError:
+				time.sleep(0.1)
+	
+	def tearDown(self):
+		if self.process.is_alive():
+			os.kill(self.process.pid, signal.SIGTERM)
+		self.process.join(10)
+	
+	def get(self, connection=None):
+		connection = connection or http.client.HTTPConnection("127.0.0.1", self.port)
+		connection.request("GET", "/")
+		response = connection.getresponse()
+		self.assertEqual(response.status, 200)
+		return response.read().decode("utf-8")
+	
+	def test_workers(self):
+		self.start(workers=2, threads=2)
+		pids = set(self.get() for i in range(40))
+		self.assertTrue(1 <= len(pids) <= 2)
+		self.assertNotIn(str(self.process.pid), pids)
+	
+	def test_keepalive(self):
+		self.start(workers=1, threads=2)
+		connection = http.client.HTTPConnection("127.0.0.1", self.port)
+		self.get(connection)
+		sock = connection.sock
+		self.get(connection)
+		self.assertIs(connection.sock, sock)
+	
+	def test_max_requests(self):
+		self.start(workers=1, threads=1, max_requests=5)
+		pids = [self.get() for i in range(12)]
+		# A replacement worker takes over after every five requests
+		self.assertEqual(len(set(pids)), 3)
+		self.assertEqual(len(set(pids[:5])), 1)
+	
+	def test_max_requests_metrics(self):
+		directory = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, directory)
+		registry.directory = directory
+		try:
+			self.start(workers=1, threads=1, max_requests=2)
+		finally:
+			registry.directory = None
+		for i in range(7):
+			self.get()
+		# The replaced workers' snapshots are folded into one; the seventh
+		# request was served by a fourth, so the third has been reaped
+		self.assertEqual(sorted(os.listdir(directory)), [RETIRED])
+	
+	def test_graceful_shutdown(self):
+		self.start(workers=2, threads=2)
+		self.get()
+		os.kill(self.process.pid, signal.SIGTERM)
+		self.process.join(10)
+		self.assertEqual(self.process.exitcode, 0)
+		self.assertRaises(ConnectionRefusedError, socket.create_connection,
+				("127.0.0.1", self.port))
+
+if __name__ == "__main__":
+	unittest.main()
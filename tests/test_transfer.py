@@ -0,0 +1,185 @@
+import io
+import os
+import json
+import shutil
+import datetime
+import tempfile
+import unittest
+
+# Configure your app to use the testing database
+if os.environ.get("CONFIG_PATH") == None:
+	os.environ["CONFIG_PATH"] = "blog.config.TestingConfig"
+
+from blog import counters
+from blog.database import session, User, Entry
+from blog.search import search
+from blog.seed import copy_value
+from blog.transfer import import_entries, dump_entries, front_matter
+
+from fixtures import TransactionTestCase
+
+class TransferTests(TransactionTestCase):
+	def setUp(self):
+		""" Test setup """
+		super().setUp()
+		self.directory = tempfile.mkdtemp()
+		
+		self.user = User(name="Alice", email="alice@example.com", password="")
+		session.add(self.user)
+		session.commit()
+	
+	def tearDown(self):
+		""" Test teardown """
+		shutil.rmtree(self.directory)
+		super().tearDown()
+	
+	def write_jsonl(self, records):
+		path = os.path.join(self.directory, "entries.jsonl")
+		with open(path, "w") as f:
+			for record in records:
+				f.write(json.dumps(record) + "\n")
+		return path
+	
+	def records(self, count):
+		return [{
+			"title": "Imported #{}".format(i),
+			"content": "Imported *content* #{}".format(i),
+			"datetime": "2015-01-{:02d}T12:00:00".format(i + 1),
+			"author": "alice@example.com" if i % 2 else "nobody@example.com",
+		} for i in range(count)]
+	
+	def test_import_jsonl(self):
+		path = self.write_jsonl(self.records(5))
+		result = import_entries(path, batch=2)
+		self.assertEqual(result, {"imported": 5, "skipped": 0, "unmatched": 3})
+		
+		entries = session.query(Entry).order_by(Entry.datetime).all()
+		self.assertEqual([entry.title for entry in entries],
+				["Imported #{}".format(i) for i in range(5)])
+		self.assertEqual(entries[1].author_id, self.user.id)
+		self.assertIsNone(entries[0].author_id)
+		self.assertEqual(entries[0].datetime, datetime.datetime(2015, 1, 1, 12))
+		self.assertIn("<em>content</em>", entries[0].content_html)
+		self.assertIn("<em>content</em>", entries[0].excerpt_html)
+		
+		# Counters and the search index are caught up afterwards
+		self.assertEqual(counters.entry_count(), 5)
+		self.assertEqual(counters.author_entry_count(self.user.id), 2)
+		self.assertEqual(counters.month_count(2015, 1), 5)
+		results, more = search("imported")
+		self.assertEqual(len(results), 5)
+	
+	def test_import_resumes(self):
+		path = self.write_jsonl(self.records(5))
+		def interrupt(done):
+			raise KeyboardInterrupt()
+		with self.assertRaises(KeyboardInterrupt):
+			import_entries(path, batch=2, progress=interrupt)
+		self.assertEqual(session.query(Entry).count(), 2)
+		
+		result = import_entries(path, batch=2)
+		self.assertEqual(result["imported"], 3)
+		self.assertEqual(result["skipped"], 2)
+		titles = sorted(title for title, in session.query(Entry.title))
+		self.assertEqual(titles, ["Imported #{}".format(i) for i in range(5)])
+		
+		# Finished imports are skipped entirely, unless restarted
+		self.assertEqual(import_entries(path)["imported"], 0)
+		self.assertEqual(import_entries(path, restart=True)["imported"], 5)
+		self.assertEqual(session.query(Entry).count(), 10)
+	
+	def test_import_bad_line(self):
+		path = os.path.join(self.directory, "entries.jsonl")
+		with open(path, "w") as f:
+			f.write(json.dumps({"title": "Good"}) + "\n\n{not json\n")
+		with self.assertRaisesRegex(ValueError, "entries.jsonl:3"):
+			import_entries(path)
+	
+	def test_front_matter(self):
+		fields, body = front_matter("---\ntitle: \"Hello: world\"\ndate: 2015-02-03\n---\n\nBody\n")
+		self.assertEqual(fields, {"title": "Hello: world", "date": "2015-02-03"})
+		self.assertEqual(body, "Body\n")
+		self.assertEqual(front_matter("---\nNo end")[0], {})
+	
+	def test_import_markdown(self):
+		with open(os.path.join(self.directory, "first-post.md"), "w") as f:
+			f.write("---\ntitle: Hello\ndate: 2015-02-03 09:30\n"
+					"author: alice@example.com\n---\n\n# Heading\n")
+		with open(os.path.join(self.directory, "untitled.md"), "w") as f:
+			f.write("Just text\n")
+		with open(os.path.join(self.directory, "notes.txt"), "w") as f:
+			f.write("Not an entry\n")
+		result = import_entries(self.directory)
+		self.assertEqual(result["imported"], 2)
+		
+		entry = session.query(Entry).filter_by(title="Hello").one()
+		self.assertEqual(entry.datetime, datetime.datetime(2015, 2, 3, 9, 30))
+		self.assertEqual(entry.author_id, self.user.id)
+		self.assertIn("<h1>Heading</h1>", entry.content_html)
+		entry = session.query(Entry).filter_by(title="untitled").one()
+		self.assertEqual(entry.content, "Just text\n")
+	
+	def test_dump_round_trip(self):
+		start = datetime.datetime(2015, 1, 1)
+		for i in range(3):
+			entry = Entry(title="Entry #{}".format(i), author=self.user if i else None,
+					datetime=start + datetime.timedelta(hours=i, microseconds=i))
+			entry.set_content("Content #{}".format(i))
+			session.add(entry)
+		session.commit()
+		
+		out = io.StringIO()
+		self.assertEqual(dump_entries(out, batch=2), 3)
+		lines = out.getvalue().splitlines()
+		self.assertEqual([json.loads(line)["title"] for line in lines],
+				["Entry #0", "Entry #1", "Entry #2"])
+		self.assertEqual(json.loads(lines[1])["author"], "alice@example.com")
+		
+		path = os.path.join(self.directory, "dump.jsonl")
+		with open(path, "w") as f:
+			f.write(out.getvalue())
+		import_entries(path)
+		copies = session.query(Entry).order_by(Entry.id).all()[3:]
+		self.assertEqual([(entry.title, entry.content, entry.datetime, entry.author_id)
+				for entry in copies],
+				[("Entry #{}".format(i), "Content #{}".format(i),
+				start + datetime.timedelta(hours=i, microseconds=i),
+				self.user.id if i else None) for i in range(3)])
+	
+	def test_empty_and_null_round_trip(self):
+		path = self.write_jsonl([{"title": "Escaped", "content": "Tab\tand \\N"},
+				{"title": "Blank", "content": ""}])
+		# Unrendered, so the HTML columns are NULL
+		import_entries(path, render=False)
+		entries = session.query(Entry).order_by(Entry.id).all()
+		self.assertEqual([entry.content for entry in entries], ["Tab\tand \\N", ""])
+		self.assertEqual([entry.content_html for entry in entries], [None, None])
+		self.assertEqual([entry.author_id for entry in entries], [None, None])
+		
+		out = io.StringIO()
+		dump_entries(out)
+		self.assertEqual([json.loads(line)["content"] for line in out.getvalue().splitlines()],
+				["Tab\tand \\N", ""])
+	
+	def test_copy_value(self):
+		self.assertEqual(copy_value(None), "\\N")
+		self.assertEqual(copy_value(""), "")
+		self.assertEqual(copy_value("\\N"), "\\\\N")
+		self.assertEqual(copy_value("a\tb\nc\\"), "a\\tb\\nc\\\\")
+		self.assertEqual(copy_value(True), "True")
+	
+	def test_import_progress_by_real_path(self):
+		path = self.write_jsonl(self.records(4))
+		def interrupt(done):
+			raise KeyboardInterrupt()
+		with self.assertRaises(KeyboardInterrupt):
+			import_entries(os.path.relpath(path), batch=2, progress=interrupt)
+		# The same file however it is named
+		self.assertEqual(import_entries(path, batch=2)["skipped"], 2)
+		
+		# A changed file is imported from the start
+		self.write_jsonl(self.records(5))
+		self.assertEqual(import_entries(path)["imported"], 5)
+
+if __name__ == "__main__":
+	unittest.main()
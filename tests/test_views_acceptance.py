@@ -14,15 +14,21 @@ if os.environ.get("CONFIG_PATH") == None:
 	os.environ["CONFIG_PATH"] = "blog.config.TestingConfig"
 
 from blog import app
-from blog.database import Base, engine, session, User
+from blog.database import get_engine, session, User
+
+from fixtures import create_schema, clear_tables, worker_number
+
+# Each parallel test process serves the app on a port of its own
+PORT = 8081 + worker_number()
+ROOT = "http://127.0.0.1:{}".format(PORT)
 
 class TestViews(unittest.TestCase):
 	def setUp(self):
 		""" Test setup """
 		self.browser = Browser("phantomjs")
 		
-		# Set up the tables in the database
-		Base.metadata.create_all(engine)
+		# Set up the tables in the database, if this process hasn't yet
+		create_schema()
 		
 		# Create example users
 		self.user = User(name="Alice", email="alice@example.com",
@@ -34,17 +40,17 @@ class TestViews(unittest.TestCase):
 		session.commit()
 		
 		self.process = multiprocessing.Process(target=app.run,
-							kwargs={"port": 8081})
+							kwargs={"port": PORT})
 		self.process.start()
 		time.sleep(1)
 	
 	def tearDown(self):
 		""" Test teardown """
-		# Remove the tables and their data from the database
+		# Remove the data from the database, which the server has committed
 		self.process.terminate()
 		session.close()
-		engine.dispose()
-		Base.metadata.drop_all(engine)
+		get_engine().dispose()
+		clear_tables()
 		# Hack to handle exception caused by Selenium bug
 		try:
 			self.browser.quit()
@@ -52,54 +58,54 @@ class TestViews(unittest.TestCase):
 			pass
 	
 	def test_login_correct(self):
-		self.browser.visit("http://127.0.0.1:8081/login")
+		self.browser.visit(ROOT + "/login")
 		self.browser.fill("email", "alice@example.com")
 		self.browser.fill("password", "test")
 		button = self.browser.find_by_css("button[type=submit]")
 		button.click()
-		self.assertEqual(self.browser.url, "http://127.0.0.1:8081/")
+		self.assertEqual(self.browser.url, ROOT + "/")
 		self.assertEqual(self.browser.find_by_css(".username").first.html, "Alice")
 	
 	def test_login_incorrect(self):
-		self.browser.visit("http://127.0.0.1:8081/login")
+		self.browser.visit(ROOT + "/login")
 		self.browser.fill("email", "bob@example.com")
 		self.browser.fill("password", "test")
 		button = self.browser.find_by_css("button[type=submit]")
 		button.click()
-		self.assertEqual(self.browser.url, "http://127.0.0.1:8081/login")
+		self.assertEqual(self.browser.url, ROOT + "/login")
 		self.assertEqual(self.browser.find_by_css(".alert-danger").first.text,
 					"Incorrect username or password")
 	
 	def test_login_view(self):
-		self.browser.visit("http://127.0.0.1:8081/")
+		self.browser.visit(ROOT + "/")
 		# Working around an apparent PhantomJS bug that "throws out the baby with the bathwater" -
 		# The text seems to be stripped as well as the HTML
 		self.assertEqual(self.browser.find_by_css(".login").first.html, "Login")
-		self.browser.visit("http://127.0.0.1:8081/entry/add")
-		self.assertEqual(self.browser.url, "http://127.0.0.1:8081/login?next=%2Fentry%2Fadd")
+		self.browser.visit(ROOT + "/entry/add")
+		self.assertEqual(self.browser.url, ROOT + "/login?next=%2Fentry%2Fadd")
 		self.assertEqual(self.browser.find_by_css(".alert-danger").first.text,
 					"Please log in to access this page.")
 		self.browser.fill("email", "alice@example.com")
 		self.browser.fill("password", "test")
 		button = self.browser.find_by_css("button[type=submit]")
 		button.click()
-		self.assertEqual(self.browser.url, "http://127.0.0.1:8081/entry/add")
+		self.assertEqual(self.browser.url, ROOT + "/entry/add")
 		self.assertEqual(self.browser.find_by_css(".logout").first.html, "Logout")
 	
 	def test_add_entry(self):
 		self.test_login_correct()
-		self.browser.visit("http://127.0.0.1:8081/entry/add")
+		self.browser.visit(ROOT + "/entry/add")
 		self.browser.fill("title", "Test Entry")
 		self.browser.fill("content", "Testibg new entry.")
 		button = self.browser.find_by_css("button[type=submit]")
 		button.click()
-		self.assertEqual(self.browser.url, "http://127.0.0.1:8081/")
+		self.assertEqual(self.browser.url, ROOT + "/")
 		self.assertEqual(self.browser.find_by_css("#title-1").first.text,
 					"Test Entry")
 	
 	def test_edit_entry(self):
 		self.test_add_entry()
-		self.browser.visit("http://127.0.0.1:8081/entry/1/edit")
+		self.browser.visit(ROOT + "/entry/1/edit")
 		self.assertEqual(self.browser.find_by_css("#title").first.value,
 					"Test Entry")
 		self.assertEqual(self.browser.find_by_css("#content").first.value,
@@ -107,13 +113,13 @@ class TestViews(unittest.TestCase):
 		self.browser.fill("content", "Testing new entry.")
 		button = self.browser.find_by_css("button[type=submit]")
 		button.click()
-		self.assertEqual(self.browser.url, "http://127.0.0.1:8081/")
+		self.assertEqual(self.browser.url, ROOT + "/")
 		self.assertEqual(self.browser.find_by_css("#content-1").first.text,
 					"Testing new entry.")
 	
 	def test_delete_entry(self):
 		self.test_add_entry()
-		self.browser.visit("http://127.0.0.1:8081/entry/1/delete")
+		self.browser.visit(ROOT + "/entry/1/delete")
 		button = self.browser.find_by_css("button[type=submit]")
 		button.click()
 		self.assertEqual(len(self.browser.find_by_css("#title-1")), 0)
@@ -124,18 +130,18 @@ class TestViews(unittest.TestCase):
 		seed_content = """Lorem ipsum dolor sit amet, consectetur adipisicing elit, sed do eiusmod tempor incididunt ut labore et dolore magna aliqua. Ut enim ad minim veniam, quis nostrud exercitation ullamco laboris nisi ut aliquip ex ea commodo consequat. Duis aute irure dolor in reprehenderit in voluptate velit esse cillum dolore eu fugiat nulla pariatur. Excepteur sint occaecat cupidatat non proident, sunt in culpa qui officia deserunt mollit anim id est laborum."""
 		self.test_login_correct()
 		for i in range(51):
-			self.browser.visit("http://127.0.0.1:8081/entry/add")
+			self.browser.visit(ROOT + "/entry/add")
 			self.browser.fill("title", "Test Entry #{}".format(i))
 			self.browser.fill("content", seed_content)
 			button = self.browser.find_by_css("button[type=submit]")
 			button.click()			
-		self.browser.visit("http://127.0.0.1:8081/")
+		self.browser.visit(ROOT + "/")
 		self.assertTrue(len(self.browser.find_by_css(".row"))<=10)
-		self.browser.visit("http://127.0.0.1:8081/?limit=20")
+		self.browser.visit(ROOT + "/?limit=20")
 		self.assertTrue(len(self.browser.find_by_css(".row"))<=20)
-		self.browser.visit("http://127.0.0.1:8081/?limit=50")
+		self.browser.visit(ROOT + "/?limit=50")
 		self.assertTrue(len(self.browser.find_by_css(".row"))<=50)
-		self.browser.visit("http://127.0.0.1:8081/?limit=3.14")
+		self.browser.visit(ROOT + "/?limit=3.14")
 		self.assertTrue(len(self.browser.find_by_css(".row"))<=10)
 	
 	def test_author_links(self):
@@ -143,11 +149,11 @@ class TestViews(unittest.TestCase):
 		self.assertTrue(self.browser.is_element_present_by_text("Edit"))
 		self.assertTrue(self.browser.is_element_present_by_text("Delete"))
 		# check not logged in
-		self.browser.visit("http://127.0.0.1:8081/logout")
+		self.browser.visit(ROOT + "/logout")
 		self.assertTrue(self.browser.is_element_not_present_by_text("Edit"))
 		self.assertTrue(self.browser.is_element_not_present_by_text("Delete"))
 		# check other user logged in
-		self.browser.visit("http://127.0.0.1:8081/login")
+		self.browser.visit(ROOT + "/login")
 		self.browser.fill("email", "bob@example.com")
 		self.browser.fill("password", "asdf")
 		button = self.browser.find_by_css("button[type=submit]")
@@ -1,24 +1,33 @@
 import os
+import re
 import unittest
+import datetime
 from urllib.parse import urlparse
 
 from werkzeug.security import generate_password_hash
+from sqlalchemy import event
 
 # Configure your app to use the testing database
 if os.environ.get("CONFIG_PATH") == None:
 	os.environ["CONFIG_PATH"] = "blog.config.TestingConfig"
 
 from blog import app
-from blog.database import Base, engine, session, User, Entry
+from blog.database import get_engine, session, User, Entry, Counter
+from blog import counters, pagecache
+from blog.login import load_user, user_cache
+from blog.filters import RENDERER_VERSION
+from blog.pagination import encode_cursor
+from blog.metrics import registry
+from blog.instrumentation import sql_queries
 
-class TestViews(unittest.TestCase):
+from fixtures import TransactionTestCase
+
+class TestViews(TransactionTestCase):
 	def setUp(self):
 		""" Test setup """
+		super().setUp()
 		self.client = app.test_client()
 		
-		# Set up the tables in the database
-		Base.metadata.create_all(engine)
-		
 		# Create an example user
 		self.user = User(name="Alice", email="alice@example.com",
 				password=generate_password_hash("test"))
@@ -30,12 +39,6 @@ class TestViews(unittest.TestCase):
 			http_session["user_id"] = str(self.user.id)
 			http_session["_fresh"] = True
 	
-	def tearDown(self):
-		""" Test teardown """
-		session.close()
-		# Remove the tables and their data from the database
-		Base.metadata.drop_all(engine)
-	
 	def test_add_entry(self):
 		self.simulate_login()
 		
@@ -121,6 +124,415 @@ class TestViews(unittest.TestCase):
 		self.assertEqual(entry.content, "Edited content")
 		self.assertEqual(entry.author, self.user)
 	
+	def test_add_entry_rendered(self):
+		self.simulate_login()
+		
+		response = self.client.post("/entry/add", data={
+		"title": "Test Entry",
+		"content": "Some *emphasis* <b>and tags</b>"
+		})
+		
+		entry = session.query(Entry).one()
+		self.assertEqual(entry.render_version, RENDERER_VERSION)
+		self.assertIn("<em>emphasis</em>", entry.content_html)
+		self.assertIn("&lt;b&gt;", entry.content_html)
+		
+		response = self.client.get("/")
+		self.assertIn(entry.content_html, response.data.decode("utf-8"))
+	
+	def test_edit_entry_rerendered(self):
+		self.test_add_entry()
+		
+		response = self.client.post("entry/1/edit", data={
+		"title": "Edited Entry",
+		"content": "Edited **content**"
+		})
+		
+		entry = session.query(Entry).one()
+		self.assertIn("<strong>content</strong>", entry.content_html)
+	
+	def add_entries(self, count, authors=None):
+		authors = authors or [self.user]
+		start = datetime.datetime(2015, 1, 1)
+		for i in range(count):
+			entry = Entry(title="Entry #{}".format(i),
+					author=authors[i % len(authors)],
+					datetime=start + datetime.timedelta(hours=i // 2))
+			entry.set_content("Content #{}".format(i))
+			session.add(entry)
+		session.commit()
+	
+	def page_titles(self, response):
+		return re.findall(r'id="title-\d+">([^<]*)<', response.data.decode("utf-8"))
+	
+	def test_entries_keyset(self):
+		self.add_entries(25)
+		expected = [entry.title for entry in session.query(Entry).order_by(
+				Entry.datetime.desc(), Entry.id.desc())]
+		
+		seen = []
+		url = "/"
+		while url:
+			response = self.client.get(url)
+			self.assertEqual(response.status_code, 200)
+			seen += self.page_titles(response)
+			match = re.search(r'class="previous">\s*<a href="([^"]*)"', response.data.decode("utf-8"))
+			url = match and match.group(1).replace("&amp;", "&")
+		self.assertEqual(seen, expected)
+		
+		# Walking back through the newer links returns the same pages
+		oldest = session.query(Entry).filter_by(title="Entry #0").one()
+		response = self.client.get("/?limit=10&after={}".format(encode_cursor(oldest)))
+		self.assertEqual(self.page_titles(response), expected[14:24])
+	
+	def test_entries_page_compat(self):
+		self.add_entries(25)
+		expected = [entry.title for entry in session.query(Entry).order_by(
+				Entry.datetime.desc(), Entry.id.desc())]
+		response = self.client.get("/page/2")
+		self.assertEqual(self.page_titles(response), expected[10:20])
+		response = self.client.get("/page/3?limit=20")
+		self.assertEqual(self.page_titles(response), [])
+	
+	def test_entries_bad_cursor(self):
+		self.add_entries(5)
+		response = self.client.get("/?before=yesterday")
+		self.assertEqual(len(self.page_titles(response)), 5)
+	
+	def add_authors(self, count):
+		authors = [User(name="Author #{}".format(i),
+				email="author{}@example.com".format(i), password="")
+				for i in range(count)]
+		session.add_all(authors)
+		session.commit()
+		return authors
+	
+	def query_count(self, url):
+		# Make sure the generation counter exists before counting, and read
+		# the month index, which is only read once per generation
+		counters.generation()
+		counters.month_index()
+		before = sql_queries.total()
+		# Buffered, so that a streamed page has run its queries
+		response = self.client.get(url, buffered=True)
+		self.assertEqual(response.status_code, 200)
+		return sql_queries.total() - before
+	
+	def test_entries_query_budget(self):
+		self.add_entries(100, self.add_authors(100))
+		session.close()
+		self.assertEqual(self.query_count("/?limit=100"), 1)
+		self.assertEqual(self.query_count("/page/2?limit=30"), 1)
+		# Nothing at all once the page is cached
+		self.assertEqual(self.query_count("/?limit=100"), 0)
+	
+	def test_entries_query_budget_unrendered(self):
+		self.add_entries(30)
+		session.query(Entry).filter(Entry.id % 2 == 0).update(
+				{Entry.excerpt_html: None}, synchronize_session=False)
+		session.commit()
+		session.close()
+		# Plus one for the text of each batch with entries missing excerpts
+		self.assertEqual(self.query_count("/?limit=30"), 3)
+		self.assertIn("Content #2", self.client.get("/?limit=30").data.decode("utf-8"))
+	
+	def test_entries_query_budget_logged_in(self):
+		self.add_entries(100, self.add_authors(100))
+		self.simulate_login()
+		session.close()
+		# Plus one to load the logged in user
+		self.assertEqual(self.query_count("/?limit=100"), 2)
+		# Which is cached for later requests
+		self.assertEqual(self.query_count("/?limit=50"), 1)
+	
+	def test_query_stats_header(self):
+		authors = self.add_authors(2)
+		self.add_entries(30, authors)
+		counters.generation()
+		counters.month_index()
+		author_id = authors[0].id
+		counters.author_entry_count(author_id)
+		session.close()
+		app.config["QUERY_STATS_HEADER"] = True
+		try:
+			# Listings are rendered before they're sent so that they can be counted
+			response = self.client.get("/?limit=20")
+			self.assertEqual(response.headers["X-Query-Count"], "1")
+			self.assertRegex(response.headers["X-Query-Time"], r"^\d+\.\d\dms$")
+			response = self.client.get("/author/{}".format(author_id))
+			# The author, their entry counter and the page of entries
+			self.assertEqual(response.headers["X-Query-Count"], "3")
+		finally:
+			app.config["QUERY_STATS_HEADER"] = False
+		self.assertNotIn("X-Query-Count", self.client.get("/page/2").headers)
+	
+	def test_single_post_query_budget(self):
+		self.add_entries(1, self.add_authors(1))
+		session.close()
+		self.assertEqual(self.query_count("/entry/1"), 1)
+	
+	def test_author_entries(self):
+		authors = self.add_authors(2)
+		self.add_entries(30, authors)
+		expected = [entry.title for entry in session.query(Entry)
+				.filter_by(author=authors[1])
+				.order_by(Entry.datetime.desc(), Entry.id.desc())]
+		
+		seen = []
+		url = "/author/{}".format(authors[1].id)
+		while url:
+			response = self.client.get(url)
+			body = response.data.decode("utf-8")
+			self.assertIn("Entries by Author #1 <small>15 entries</small>", body)
+			seen += self.page_titles(response)
+			match = re.search(r'class="previous">\s*<a href="([^"]*)"', body)
+			url = match and match.group(1).replace("&amp;", "&")
+		self.assertEqual(seen, expected)
+		
+		response = self.client.get("/author/{}/page/2".format(authors[1].id))
+		self.assertEqual(self.page_titles(response), expected[10:])
+		self.assertEqual(self.client.get("/author/999").status_code, 404)
+	
+	def test_author_entry_counter(self):
+		self.add_entries(2)
+		user_id = self.user.id
+		key = counters.author_key(user_id)
+		self.assertEqual(counters.author_entry_count(user_id), 2)
+		self.simulate_login()
+		self.client.post("/entry/add", data={"title": "Test", "content": "Test"})
+		self.assertEqual(session.query(Counter).get(key).value, 3)
+		self.client.post("/entry/1/delete")
+		self.assertEqual(session.query(Counter).get(key).value, 2)
+		
+		# Entries added behind the counter's back are picked up on reconcile
+		self.add_entries(1, [session.query(User).get(user_id)])
+		self.assertEqual(counters.reconcile_authors(), 1)
+		self.assertEqual(session.query(Counter).get(key).value, 3)
+	
+	def test_author_entries_query_budget(self):
+		authors = self.add_authors(2)
+		self.add_entries(100, authors)
+		author_id = authors[0].id
+		counters.author_entry_count(author_id)
+		session.close()
+		stats = user_cache.stats()
+		# The author, their entry counter and the page of entries
+		self.assertEqual(self.query_count("/author/{}?limit=50".format(author_id)), 3)
+		self.assertEqual(self.query_count("/author/{}/page/2?limit=20".format(author_id)), 3)
+		# Authors aren't logged in users, so they stay out of their cache
+		self.assertEqual(user_cache.stats(), stats)
+	
+	def add_monthly_entries(self):
+		# Three entries in January, two in February and one in March 2015
+		for i, day in enumerate([5, 10, 30, 36, 45, 60]):
+			entry = Entry(title="Entry #{}".format(i), author=self.user,
+					datetime=datetime.datetime(2015, 1, 1) + datetime.timedelta(days=day))
+			entry.set_content("Content #{}".format(i))
+			session.add(entry)
+		session.commit()
+		counters.reconcile_months()
+	
+	def test_archive(self):
+		self.add_monthly_entries()
+		response = self.client.get("/archive/2015/2")
+		body = response.data.decode("utf-8")
+		self.assertEqual(self.page_titles(response), ["Entry #4", "Entry #3"])
+		self.assertIn("Entries from February 2015 <small>2 entries</small>", body)
+		self.assertEqual(re.findall(r'href="/archive/(\d+/\d+)">[^<]*</a> \((\d+)\)', body),
+				[("2015/3", "1"), ("2015/2", "2"), ("2015/1", "3")])
+		# The sidebar's layout adds no rows to those of the entries
+		self.assertEqual(body.count('class="row"'), 2)
+		
+		response = self.client.get("/archive/2015/1?limit=2")
+		self.assertEqual(self.page_titles(response), ["Entry #2", "Entry #1"])
+		match = re.search(r'class="previous">\s*<a href="([^"]*)"', response.data.decode("utf-8"))
+		response = self.client.get(match.group(1).replace("&amp;", "&"))
+		self.assertEqual(self.page_titles(response), ["Entry #0"])
+		
+		self.assertEqual(self.page_titles(self.client.get("/archive/2015/4")), [])
+		self.assertEqual(self.client.get("/archive/2015/13").status_code, 404)
+	
+	def test_archive_query_budget(self):
+		self.add_monthly_entries()
+		session.close()
+		# The month's counter and one range scan for its entries
+		self.assertEqual(self.query_count("/archive/2015/1"), 2)
+	
+	def test_month_counters(self):
+		self.add_monthly_entries()
+		self.simulate_login()
+		now = datetime.datetime.now()
+		key = counters.month_key(now)
+		# The current month is new, so its counter is created
+		self.client.post("/entry/add", data={"title": "New", "content": "New"})
+		self.client.post("/entry/add", data={"title": "Newer", "content": "Newer"})
+		self.assertEqual(session.query(Counter).get(key).value, 2)
+		self.assertEqual(counters.month_index()[0], (now.date().replace(day=1), 2))
+		
+		self.client.post("/entry/1/delete")
+		self.assertEqual(session.query(Counter).get("month:2015-01").value, 2)
+		self.assertEqual(counters.reconcile_months(), 4)
+		self.assertEqual(session.query(Counter).get("month:2015-01").value, 2)
+	
+	def neighbour_links(self, url):
+		body = self.client.get(url).data.decode("utf-8")
+		older = re.search(r'class="previous">\s*<a href="/entry/(\d+)"', body)
+		newer = re.search(r'class="next">\s*<a href="/entry/(\d+)"', body)
+		return (older and int(older.group(1)), newer and int(newer.group(1)))
+	
+	def test_single_post_neighbours(self):
+		# Entries come in pairs with the same time, so ties are broken by id
+		self.add_entries(5)
+		self.assertEqual(self.neighbour_links("/entry/1"), (None, 2))
+		self.assertEqual(self.neighbour_links("/entry/2"), (1, 3))
+		self.assertEqual(self.neighbour_links("/entry/3"), (2, 4))
+		self.assertEqual(self.neighbour_links("/entry/5"), (4, None))
+		self.assertEqual(self.neighbour_links("/entry/latest"), (4, None))
+		self.assertIn("Entry #4", self.client.get("/entry/latest").data.decode("utf-8"))
+		self.assertEqual(self.client.get("/entry/6").status_code, 404)
+	
+	def test_single_post_neighbours_cached(self):
+		self.add_entries(3)
+		pagecache.page_cache = None
+		try:
+			self.assertEqual(self.query_count("/entry/2"), 1)
+			self.assertEqual(len(pagecache.neighbour_cache), 1)
+			# Rendered again, with only the entry itself read
+			self.assertEqual(self.query_count("/entry/2"), 1)
+			self.assertEqual(pagecache.neighbour_cache.hits, 1)
+		finally:
+			pagecache.init_app(app)
+		
+		# Adding or removing a neighbour shows up straight away
+		self.simulate_login()
+		self.client.post("/entry/3/delete")
+		self.assertEqual(self.neighbour_links("/entry/2"), (1, None))
+		self.client.post("/entry/add", data={"title": "New", "content": "New"})
+		new = session.query(Entry).filter_by(title="New").one()
+		self.assertEqual(self.neighbour_links("/entry/2"), (1, new.id))
+	
+	def test_single_post_missing(self):
+		self.assertEqual(self.client.get("/entry/latest").status_code, 404)
+	
+	def test_feeds(self):
+		self.add_entries(25)
+		response = self.client.get("/feed.atom")
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(response.mimetype, "application/atom+xml")
+		data = response.data.decode("utf-8")
+		self.assertEqual(data.count("<entry>"), 20)
+		self.assertIn("<title>Entry #24</title>", data)
+		self.assertIn("&lt;p&gt;Content #24&lt;/p&gt;", data)
+		
+		response = self.client.get("/feed.rss")
+		self.assertEqual(response.mimetype, "application/rss+xml")
+		self.assertEqual(response.data.decode("utf-8").count("<item>"), 20)
+	
+	def test_feed_conditional_get(self):
+		self.add_entries(3)
+		response = self.client.get("/feed.atom")
+		etag = response.headers["ETag"]
+		last_modified = response.headers["Last-Modified"]
+		
+		self.assertEqual(self.query_count("/feed.atom"), 0)
+		response = self.client.get("/feed.atom", headers={"If-None-Match": etag})
+		self.assertEqual(response.status_code, 304)
+		response = self.client.get("/feed.atom", headers={"If-Modified-Since": last_modified})
+		self.assertEqual(response.status_code, 304)
+		# Served from the cache with the right type
+		response = self.client.get("/feed.atom")
+		self.assertEqual(response.mimetype, "application/atom+xml")
+		
+		self.simulate_login()
+		self.client.post("/entry/add", data={
+		"title": "Test Entry",
+		"content": "Test content"
+		})
+		response = self.client.get("/feed.atom", headers={"If-None-Match": etag})
+		self.assertEqual(response.status_code, 200)
+		self.assertIn("Test Entry", response.data.decode("utf-8"))
+	
+	def test_user_cache(self):
+		user_id = self.user.id
+		session.close()
+		registry.clear()
+		stats = user_cache.stats()
+		user = load_user(str(user_id))
+		self.assertEqual(user.name, "Alice")
+		self.assertEqual(user_cache.stats()["misses"], stats["misses"] + 1)
+		self.assertEqual(load_user(str(user_id)).name, "Alice")
+		self.assertEqual(user_cache.stats()["hits"], stats["hits"] + 1)
+		self.assertIsNone(load_user("1000"))
+		
+		text = self.client.get("/metrics").data.decode("utf-8")
+		self.assertEqual(self.metric(text, "blog_user_cache_hits_total"), 1)
+		self.assertEqual(self.metric(text, "blog_user_cache_misses_total"), 2)
+	
+	def test_user_cache_invalidated(self):
+		user_id = self.user.id
+		self.assertEqual(load_user(str(user_id)).name, "Alice")
+		self.user.name = "Alicia"
+		session.commit()
+		self.assertEqual(load_user(str(user_id)).name, "Alicia")
+	
+	def test_page_cache_invalidated(self):
+		self.add_entries(3)
+		self.simulate_login()
+		self.assertNotIn("Test Entry", self.client.get("/").data.decode("utf-8"))
+		self.client.post("/entry/add", data={
+		"title": "Test Entry",
+		"content": "Test content"
+		})
+		self.assertIn("Test Entry", self.client.get("/").data.decode("utf-8"))
+		
+		self.client.post("/entry/4/edit", data={
+		"title": "Edited Entry",
+		"content": "Edited content"
+		})
+		data = self.client.get("/").data.decode("utf-8")
+		self.assertIn("Edited Entry", data)
+		self.assertNotIn("Test Entry", data)
+	
+	def test_entry_links_authorless(self):
+		entry = Entry(title="Orphan")
+		entry.set_content("No author")
+		session.add(entry)
+		session.commit()
+		data = self.client.get("/entry/{}".format(entry.id)).data.decode("utf-8")
+		self.assertIn("Orphan", data)
+		self.assertNotIn("/edit", data)
+		self.assertNotIn("/delete", data)
+	
+	def test_page_cache_per_user(self):
+		self.add_entries(3)
+		self.assertNotIn("Logout", self.client.get("/").data.decode("utf-8"))
+		self.simulate_login()
+		self.assertIn("Logout", self.client.get("/").data.decode("utf-8"))
+	
+	def test_conditional_get(self):
+		self.add_entries(3)
+		response = self.client.get("/", buffered=True)
+		etag = response.headers["ETag"]
+		self.assertTrue(response.headers["Last-Modified"])
+		
+		response = self.client.get("/", headers={"If-None-Match": etag},
+				buffered=True)
+		self.assertEqual(response.status_code, 304)
+		self.assertEqual(response.data, b"")
+		response = self.client.get("/?limit=20", headers={"If-None-Match": etag},
+				buffered=True)
+		self.assertEqual(response.status_code, 200)
+		
+		self.simulate_login()
+		self.client.post("/entry/add", data={
+		"title": "Test Entry",
+		"content": "Test content"
+		})
+		response = self.client.get("/", headers={"If-None-Match": etag},
+				buffered=True)
+		self.assertEqual(response.status_code, 200)
+		self.assertNotEqual(response.headers["ETag"], etag)
+	
 	def test_remove_entry(self):
 		self.test_add_entry()
 		
@@ -130,6 +542,142 @@ class TestViews(unittest.TestCase):
 		self.assertEqual(urlparse(response.location).path, "/")
 		entries = session.query(Entry).all()
 		self.assertEqual(len(entries), 0)
+	
+	def test_entry_counter(self):
+		self.add_entries(3)
+		self.assertEqual(counters.entry_count(), 3)
+		
+		self.simulate_login()
+		self.client.post("/entry/add", data={
+		"title": "Test Entry",
+		"content": "Test content"
+		})
+		self.assertEqual(session.query(Counter).get("entries").value, 4)
+		
+		self.client.post("/entry/1/delete")
+		self.assertEqual(session.query(Counter).get("entries").value, 3)
+	
+	def test_entry_counter_reconcile(self):
+		self.add_entries(3)
+		self.assertEqual(counters.entry_count(), 3)
+		# Entries added behind the counter's back are picked up on reconcile
+		self.add_entries(2)
+		self.assertEqual(counters.entry_count(), 3)
+		counter = session.query(Counter).get("entries")
+		counter.reconciled -= datetime.timedelta(days=1)
+		session.commit()
+		self.assertEqual(counters.entry_count(), 5)
+	
+	def test_entries_has_next_exact(self):
+		self.add_entries(10)
+		response = self.client.get("/")
+		self.assertEqual(len(self.page_titles(response)), 10)
+		self.assertNotIn("Older", response.data.decode("utf-8"))
+	
+	def test_entries_total_pages(self):
+		self.add_entries(25)
+		app.config["SHOW_TOTAL_PAGES"] = True
+		try:
+			response = self.client.get("/page/2")
+		finally:
+			del app.config["SHOW_TOTAL_PAGES"]
+		self.assertIn("Page 2 of 3", response.data.decode("utf-8"))
+	
+	def test_entries_streamed(self):
+		self.add_entries(30)
+		response = self.client.get("/?limit=25")
+		self.assertNotIn("Content-Length", response.headers)
+		chunks = iter(response.response)
+		# The page header goes out before any entries are read
+		first = next(chunks)
+		self.assertIn(b"<head>", first)
+		self.assertNotIn(b'id="title-', first)
+		body = (first + b"".join(chunks)).decode("utf-8")
+		self.assertEqual(len(re.findall(r'id="title-\d+"', body)), 25)
+		self.assertIn('class="previous"', body)
+		response.close()
+	
+	def test_entries_flashed_not_streamed(self):
+		with self.client.session_transaction() as http_session:
+			http_session["_flashes"] = [("warning", "Flashed message")]
+		response = self.client.get("/")
+		# Showing the message changes the session, so the cookie must go first
+		self.assertIn("Content-Length", response.headers)
+		self.assertIn("Flashed message", response.data.decode("utf-8"))
+		self.assertIn("Set-Cookie", response.headers)
+	
+	def test_entries_excerpts(self):
+		long_content = "\n\n".join("Paragraph {}. ".format(i) * 30 for i in range(10))
+		entry = Entry(title="Long", author=self.user)
+		entry.set_content(long_content)
+		session.add(entry)
+		session.commit()
+		self.assertTrue(entry.excerpt_truncated)
+		
+		statements = []
+		def capture(conn, cursor, statement, *args):
+			statements.append(statement)
+		event.listen(get_engine(), "before_cursor_execute", capture)
+		try:
+			response = self.client.get("/", buffered=True)
+		finally:
+			event.remove(get_engine(), "before_cursor_execute", capture)
+		body = response.data.decode("utf-8")
+		self.assertIn(entry.excerpt_html, body)
+		self.assertNotIn("Paragraph 9.", body)
+		self.assertIn('class="read-more"', body)
+		# The full text is never read for a list page
+		listing = [statement for statement in statements if "FROM entries" in statement]
+		self.assertEqual(len(listing), 1)
+		self.assertNotIn("entries.content", listing[0])
+		self.assertNotIn("entries.content_html", listing[0])
+		
+		response = self.client.get("/entry/{}".format(entry.id))
+		self.assertIn("Paragraph 9.", response.data.decode("utf-8"))
+	
+	def metric(self, text, name):
+		match = re.search(r"^{} (\S+)$".format(re.escape(name)), text, re.M)
+		return match and float(match.group(1))
+	
+	def test_metrics(self):
+		self.add_entries(3)
+		# Rendered on the fly, so the markdown filter is used
+		session.query(Entry).update({Entry.render_version: None})
+		session.commit()
+		registry.clear()
+		# Streamed pages are recorded once they have been sent
+		self.client.get("/", buffered=True)
+		self.client.get("/", buffered=True)
+		self.client.get("/no/such/page", buffered=True)
+		
+		response = self.client.get("/metrics")
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(response.mimetype, "text/plain")
+		text = response.data.decode("utf-8")
+		self.assertEqual(self.metric(text,
+				'blog_request_duration_seconds_count{endpoint="entries"}'), 2)
+		self.assertEqual(self.metric(text,
+				'blog_responses_total{endpoint="none",status="404"}'), 1)
+		self.assertGreater(self.metric(text,
+				'blog_sql_queries_total{endpoint="entries"}'), 0)
+		self.assertGreater(self.metric(text,
+				'blog_request_sql_seconds_sum{endpoint="entries"}'), 0)
+		self.assertGreater(self.metric(text,
+				'blog_request_render_seconds_sum{endpoint="entries"}'), 0)
+		self.assertGreater(self.metric(text,
+				'blog_request_markdown_seconds_sum{endpoint="entries"}'), 0)
+	
+	def test_slow_request_log(self):
+		self.add_entries(3)
+		app.config["SLOW_REQUEST_SECONDS"] = 0
+		try:
+			with self.assertLogs("blog.instrumentation", "WARNING") as logs:
+				self.client.get("/?limit=2", buffered=True)
+		finally:
+			app.config["SLOW_REQUEST_SECONDS"] = None
+		self.assertEqual(len(logs.output), 1)
+		self.assertIn("GET /?limit=2 (entries) 200", logs.output[0])
+		self.assertIn("FROM entries", logs.output[0])
 
 if __name__ == "__main__":
 	unittest.main()